@@ -1,6 +1,18 @@
+import re
+from typing import Optional
+
 from langchain_community.vectorstores import FAISS
 from langchain_core.callbacks.manager import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
 from langchain_core.retrievers import BaseRetriever
+from pydantic import field_validator
+
+from games.lexical_index import reciprocal_rank_fusion
+from games.vectorstores import GameVectorStore
+
+VECTOR_SEARCH = "vector"
+HYBRID_SEARCH = "hybrid"
+SEARCH_MODES = [VECTOR_SEARCH, HYBRID_SEARCH]
 
 
 class RulesBotRetriever(BaseRetriever):
@@ -10,30 +22,50 @@ class RulesBotRetriever(BaseRetriever):
     This retriever uses a FAISS index to retrieve the most similar documents.
 
     It also adds the setup page to the results if the question is a setup question.
+    When the game vector store is given, queries are embedded through its query embedding cache and the setup
+    pages are looked up directly instead of with a vector search.
+
+    In hybrid search mode the vector search results are fused with the results of the lexical index of the vector
+    store using reciprocal rank fusion. Keyword queries of at most lexical_max_terms words with lexical matches are
+    answered from the lexical index alone, which skips embedding the query.
     """
 
     index: FAISS
     search_kwargs: dict
+    vector_store: Optional[GameVectorStore] = None
+    search_mode: str = VECTOR_SEARCH
+    lexical_max_terms: int = 2
+
+    @field_validator("search_mode")
+    @classmethod
+    def _validate_search_mode(cls, search_mode):
+        if search_mode not in SEARCH_MODES:
+            raise ValueError(
+                f"Unknown search mode {search_mode!r}, expected one of {SEARCH_MODES}"
+            )
+        return search_mode
 
     def _get_relevant_documents(
         self, query: str, *, run_manager: CallbackManagerForRetrieverRun
     ):
         # TODO: Debug relevancy score and figure out if we should filter at a threshold
-        docs_with_score = self.index.similarity_search_with_relevance_scores(
-            query, **self.search_kwargs
-        )
+        docs_with_score = self._search(query)
 
         docs = []
         for doc, score in docs_with_score:
-            doc.metadata["relevancy_score"] = score
-            docs.append(doc)
+            # The index can be shared between requests, so annotate a copy instead of the stored document
+            docs.append(
+                Document(
+                    id=doc.id,
+                    page_content=doc.page_content,
+                    metadata={**doc.metadata, "relevancy_score": score},
+                )
+            )
 
         if self._is_setup_question(query):
             # If the setup page is not already in the results, add it
             if not any(doc.metadata.get("setup_page") for doc in docs):
-                setup_documents = self.index.similarity_search(
-                    "setup", filter={"setup_page": True}
-                )
+                setup_documents = self._setup_documents()
                 if len(setup_documents) > 0:
                     # Remove the N last results from docs where N is the number of setup documents and add the setup documents
                     docs = docs[: -len(setup_documents)]
@@ -41,6 +73,78 @@ class RulesBotRetriever(BaseRetriever):
 
         return docs
 
+    def _search(self, query):
+        if (
+            self.search_mode != HYBRID_SEARCH
+            or self.vector_store is None
+            or self.vector_store.lexical_index is None
+        ):
+            return self._similarity_search_with_relevance_scores(query)
+
+        k = self.search_kwargs.get("k", 4)
+        lexical_docs_with_score = self.vector_store.lexical_search(query, k=2 * k)
+        if not lexical_docs_with_score:
+            return self._similarity_search_with_relevance_scores(query)
+
+        # BM25 scores are unbounded, so report them relative to the best match
+        best_score = lexical_docs_with_score[0][1]
+        lexical_docs_with_score = [
+            (doc, score / best_score) for doc, score in lexical_docs_with_score
+        ]
+        # Count the words as typed, stopwords included, so short questions are not mistaken for keywords
+        if len(re.findall(r"\w+", query)) <= self.lexical_max_terms:
+            return lexical_docs_with_score[:k]
+
+        vector_docs_with_score = self._similarity_search_with_relevance_scores(
+            query, k=2 * k
+        )
+        docs = {}
+        scores = {}
+        # Prefer the vector relevance score of sections found by both searches
+        for doc, score in lexical_docs_with_score + vector_docs_with_score:
+            docs[self._section_key(doc)] = doc
+            scores[self._section_key(doc)] = score
+        fused = reciprocal_rank_fusion(
+            [
+                [self._section_key(doc) for doc, _ in vector_docs_with_score],
+                [self._section_key(doc) for doc, _ in lexical_docs_with_score],
+            ]
+        )
+        return [(docs[key], scores[key]) for key, _ in fused[:k]]
+
+    @staticmethod
+    def _section_key(doc):
+        # Sections of indexes pickled by older LangChain versions have no id
+        if doc.id is not None:
+            return doc.id
+        return (
+            doc.metadata.get("document_id"),
+            doc.metadata.get("page"),
+            doc.page_content,
+        )
+
+    def _similarity_search_with_relevance_scores(self, query, k=None):
+        search_kwargs = dict(self.search_kwargs)
+        if k is not None:
+            search_kwargs["k"] = k
+
+        if self.vector_store is None:
+            return self.index.similarity_search_with_relevance_scores(
+                query, **search_kwargs
+            )
+
+        # Embed the query through the shared query embedding cache instead of calling the embedding model
+        relevance_score_fn = self.index._select_relevance_score_fn()
+        docs_with_score = self.index.similarity_search_with_score_by_vector(
+            self.vector_store.embed_query(query), **search_kwargs
+        )
+        return [(doc, relevance_score_fn(score)) for doc, score in docs_with_score]
+
+    def _setup_documents(self):
+        if self.vector_store is not None:
+            return self.vector_store.setup_documents()
+        return self.index.similarity_search("setup", filter={"setup_page": True})
+
     def _is_setup_question(self, question):
         question = question.lower()
         return (
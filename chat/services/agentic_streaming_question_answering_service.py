@@ -6,7 +6,11 @@ from langchain_core.tools import tool
 from langchain_openai import ChatOpenAI
 
 from chat.retrievers.rules_bot_retriever import RulesBotRetriever
-from rulesbot.settings import DEFAULT_CHATGPT_MODEL
+from rulesbot.settings import (
+    DEFAULT_CHATGPT_MODEL,
+    RETRIEVER_LEXICAL_MAX_TERMS,
+    RETRIEVER_SEARCH_MODE,
+)
 
 prompt_template = """Please use the available tools to provide a clear and accurate answer to questions regarding the rules of %%GAME%%.
 Always use the rulebook search tool before answering rule questions.
@@ -86,9 +90,13 @@ def _build_question_answering_agent(chat_session, tools):
 
 
 def _build_rulebook_search_tool(chat_session, retrieved_documents):
+    vector_store = chat_session.game.vector_store
     retriever = RulesBotRetriever(
-        index=chat_session.game.vector_store.index,
+        index=vector_store.index,
+        vector_store=vector_store,
         search_kwargs={"k": 3},
+        search_mode=RETRIEVER_SEARCH_MODE,
+        lexical_max_terms=RETRIEVER_LEXICAL_MAX_TERMS,
     )
 
     @tool("rulebook_search")
@@ -11,7 +11,11 @@ from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_openai import ChatOpenAI
 
 from chat.retrievers.rules_bot_retriever import RulesBotRetriever
-from rulesbot.settings import DEFAULT_CHATGPT_MODEL
+from rulesbot.settings import (
+    DEFAULT_CHATGPT_MODEL,
+    RETRIEVER_LEXICAL_MAX_TERMS,
+    RETRIEVER_SEARCH_MODE,
+)
 
 prompt_template = """Please use the following information to provide a clear and accurate answer to this question regarding the rules of the game %%GAME%%.
 Explain your answer in detail using the rulebook information provided.
@@ -94,11 +98,15 @@ def _setup_conversational_retrieval_chain(chat_session, response_queue):
         ]
     )
 
+    vector_store = chat_session.game.vector_store
     history_aware_retriever = create_history_aware_retriever(
         llm=ChatOpenAI(model=DEFAULT_CHATGPT_MODEL, temperature=0.1),
         retriever=RulesBotRetriever(
-            index=chat_session.game.vector_store.index,
+            index=vector_store.index,
+            vector_store=vector_store,
             search_kwargs={"k": 3},
+            search_mode=RETRIEVER_SEARCH_MODE,
+            lexical_max_terms=RETRIEVER_LEXICAL_MAX_TERMS,
         ),
         prompt=contextualize_q_prompt,
     )
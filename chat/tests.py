@@ -18,6 +18,7 @@ from chat.services.streaming_question_answering_service import (
     _get_chat_history,
     ask_question,
 )
+from games.embedding_cache import query_embedding_cache
 from games.models import Game
 from tests.decorators import prevent_request_warnings, prevent_warnings
 
@@ -265,6 +266,149 @@ class RulesBotRetrieverTests(TestCase):
             [doc.metadata.get("setup_page") for doc in docs], [None, None, None]
         )
 
+    @prevent_warnings
+    def test_setup_question_uses_recorded_setup_documents(self):
+        game = Game.objects.create(name="Test Game")
+        vector_store = game.vector_store
+        vector_store.add_documents(self.documents_for_test_with_setup_page(), 1)
+        retriever = RulesBotRetriever(
+            index=vector_store.index, vector_store=vector_store, search_kwargs={"k": 3}
+        )
+
+        with mock.patch.object(
+            FAISS, "similarity_search", side_effect=AssertionError
+        ), mock.patch.object(
+            DeterministicFakeEmbedding,
+            "embed_query",
+            wraps=vector_store.embedding.embed_query,
+        ) as embed_query_mock:
+            docs = retriever.invoke("how many pieces do you start with?")
+
+        embed_query_mock.assert_called_once_with("how many pieces do you start with?")
+        self.assertEqual(len(docs), 3)
+        self.assertEqual(docs[2].page_content, "Setup instructions for a game")
+
+    @prevent_warnings
+    def test_queries_are_embedded_through_query_embedding_cache(self):
+        game = Game.objects.create(name="Test Game")
+        vector_store = game.vector_store
+        vector_store.add_documents(self.documents_for_test_without_setup_page(), 1)
+        retriever = RulesBotRetriever(
+            index=vector_store.index, vector_store=vector_store, search_kwargs={"k": 3}
+        )
+        query_embedding_cache.clear()
+
+        with mock.patch.object(
+            DeterministicFakeEmbedding,
+            "embed_query",
+            wraps=vector_store.embedding.embed_query,
+        ) as embed_query_mock:
+            first_docs = retriever.invoke("clue")
+            second_docs = retriever.invoke("Clue ")
+
+        embed_query_mock.assert_called_once_with("clue")
+        self.assertEqual(first_docs, second_docs)
+        self.assertEqual(first_docs[0].metadata["page"], 44)
+        self.assertEqual(query_embedding_cache.stats()["local_hits"], 1)
+
+    @prevent_warnings
+    def test_hybrid_search_answers_keyword_queries_without_embedding(self):
+        game = Game.objects.create(name="Test Game")
+        vector_store = game.vector_store
+        vector_store.add_documents(self.documents_for_test_without_setup_page(), 1)
+        retriever = RulesBotRetriever(
+            index=vector_store.index,
+            vector_store=vector_store,
+            search_kwargs={"k": 3},
+            search_mode="hybrid",
+        )
+        query_embedding_cache.clear()
+
+        with mock.patch.object(
+            DeterministicFakeEmbedding, "embed_query", side_effect=AssertionError
+        ):
+            docs = retriever.invoke("Monopoly?")
+
+        self.assertEqual(len(docs), 1)
+        self.assertEqual(docs[0].metadata["page"], 45)
+        self.assertEqual(docs[0].metadata["relevancy_score"], 1.0)
+
+    @prevent_warnings
+    def test_hybrid_search_embeds_short_questions(self):
+        game = Game.objects.create(name="Test Game")
+        vector_store = game.vector_store
+        vector_store.add_documents(self.documents_for_test_without_setup_page(), 1)
+        retriever = RulesBotRetriever(
+            index=vector_store.index,
+            vector_store=vector_store,
+            search_kwargs={"k": 3},
+            search_mode="hybrid",
+        )
+        query_embedding_cache.clear()
+
+        with mock.patch.object(
+            DeterministicFakeEmbedding,
+            "embed_query",
+            wraps=vector_store.embedding.embed_query,
+        ) as embed_query_mock:
+            # Only two terms once the stopwords are removed, but a question of five words
+            docs = retriever.invoke("can I move in monopoly?")
+
+        embed_query_mock.assert_called_once()
+        self.assertEqual(len(docs), 3)
+
+    def test_unknown_search_mode_is_rejected(self):
+        with self.assertRaises(ValueError):
+            RulesBotRetriever(
+                index=mock.Mock(spec=FAISS), search_kwargs={}, search_mode="hybird"
+            )
+
+    @prevent_warnings
+    def test_hybrid_search_fuses_vector_and_lexical_results(self):
+        game = Game.objects.create(name="Test Game")
+        vector_store = game.vector_store
+        vector_store.add_documents(self.documents_for_test_without_setup_page(), 1)
+        retriever = RulesBotRetriever(
+            index=vector_store.index,
+            vector_store=vector_store,
+            search_kwargs={"k": 3},
+            search_mode="hybrid",
+        )
+        query_embedding_cache.clear()
+
+        with mock.patch.object(
+            DeterministicFakeEmbedding,
+            "embed_query",
+            wraps=vector_store.embedding.embed_query,
+        ) as embed_query_mock:
+            docs = retriever.invoke("how do chess pieces move in monopoly")
+
+        embed_query_mock.assert_called_once()
+        self.assertEqual(len(docs), 3)
+        # Both lexical matches are ranked first by the fusion
+        self.assertEqual({doc.metadata["page"] for doc in docs[:2]}, {42, 45})
+        self.assertEqual(len({doc.metadata["page"] for doc in docs}), 3)
+
+    @prevent_warnings
+    def test_hybrid_search_without_lexical_matches_uses_vector_search(self):
+        game = Game.objects.create(name="Test Game")
+        vector_store = game.vector_store
+        vector_store.add_documents(self.documents_for_test_without_setup_page(), 1)
+        retriever = RulesBotRetriever(
+            index=vector_store.index,
+            vector_store=vector_store,
+            search_kwargs={"k": 3},
+            search_mode="hybrid",
+        )
+
+        docs = retriever.invoke("xyzzy")
+        vector_docs = RulesBotRetriever(
+            index=vector_store.index, vector_store=vector_store, search_kwargs={"k": 3}
+        ).invoke("xyzzy")
+
+        self.assertEqual(len(docs), 3)
+        self.assertEqual(docs, vector_docs)
+
 
 class AgenticStreamingQuestionAnsweringServiceTests(TestCase):
     def test_ask_question_persists_messages_and_sources(self):
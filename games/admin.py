@@ -1,13 +1,39 @@
 from django.contrib import admin
+from django.http import JsonResponse
+from django.shortcuts import render
+from django.urls import path, reverse
+from django.utils.html import format_html
 
-from games.services.document_ingestion_service import ingest_document
+from games.ingestion_stats import throughput
+from games.services import ingestion_job_service
+from games.vector_store_stats import process_stats
 
-from .models import Document, Game
+from .models import Document, Game, IngestionJob, IngestionRun
+
+# Changing any of these fields means the document has to be ingested again
+DOCUMENT_INGESTION_FIELDS = {"url", "rulebook_file", "ignore_pages", "setup_pages"}
+
+# Number of recent ingestion runs aggregated by the ingestion throughput view
+THROUGHPUT_RUNS = 200
 
 
 class DocumentInline(admin.TabularInline):
     model = Document
     extra = 2
+    exclude = ["source_etag", "source_last_modified"]
+    readonly_fields = ["last_ingestion_run"]
+
+    @admin.display(description="Last ingest")
+    def last_ingestion_run(self, document):
+        run = document.ingestion_runs.first() if document.pk else None
+        if run is None:
+            return "-"
+        return format_html(
+            '<a href="{}?document__id__exact={}">{}</a>',
+            reverse("admin:games_ingestionrun_changelist"),
+            document.pk,
+            _run_summary(run),
+        )
 
 
 class GameAdmin(admin.ModelAdmin):
@@ -20,19 +46,230 @@ class GameAdmin(admin.ModelAdmin):
     )
     list_filter = ["ingested", "created_at", "updated_at"]
     search_fields = ["name"]
-    actions = ["ingest_documents"]
+    actions = ["ingest_documents", "refresh_documents", "reingest_all_documents"]
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = extra_context or {}
+        extra_context["vector_store_stats_url"] = reverse(
+            "admin:games_game_vector_store_stats"
+        )
+        extra_context["ingestion_throughput_url"] = reverse(
+            "admin:games_game_ingestion_throughput"
+        )
+        return super().changelist_view(request, extra_context)
+
+    def get_urls(self):
+        urls = super().get_urls()
+        custom_urls = [
+            path(
+                "vector-store-stats/",
+                self.admin_site.admin_view(self.vector_store_stats_view),
+                name="games_game_vector_store_stats",
+            ),
+            path(
+                "vector-store-stats.json",
+                self.admin_site.admin_view(self.vector_store_stats_json_view),
+                name="games_game_vector_store_stats_json",
+            ),
+            path(
+                "ingestion-throughput/",
+                self.admin_site.admin_view(self.ingestion_throughput_view),
+                name="games_game_ingestion_throughput",
+            ),
+        ]
+        return custom_urls + urls
+
+    def vector_store_stats_view(self, request):
+        """
+        Index and cache statistics of the worker process serving the request
+        """
+        stats = process_stats()
+        games = Game.objects.in_bulk(stats["games"].keys())
+        game_stats = sorted(
+            (
+                {"game": games.get(game_id), "game_id": game_id, **game}
+                for game_id, game in stats["games"].items()
+            ),
+            key=lambda game: game["loaded_at"],
+            reverse=True,
+        )
 
-    @admin.action(description="Ingest game documents")
+        context = {
+            **self.admin_site.each_context(request),
+            "title": "Vector Store Stats",
+            "stats": stats,
+            "game_stats": game_stats,
+            "opts": self.model._meta,
+        }
+        return render(request, "admin/games/vector_store_stats.html", context)
+
+    def vector_store_stats_json_view(self, request):
+        return JsonResponse(process_stats())
+
+    def ingestion_throughput_view(self, request):
+        """
+        Throughput and stage timings of the recent ingests that ingested a rulebook
+        """
+        runs = list(
+            IngestionRun.objects.filter(outcome=IngestionRun.INGESTED)
+            .select_related("document__game")
+            .order_by("-created_at")[:THROUGHPUT_RUNS]
+        )
+        context = {
+            **self.admin_site.each_context(request),
+            "title": "Ingestion Throughput",
+            "throughput": throughput(runs),
+            "runs": runs,
+            "opts": self.model._meta,
+        }
+        return render(request, "admin/games/ingestion_throughput.html", context)
+
+    def save_formset(self, request, form, formset, change):
+        for document_form in formset.forms:
+            changed_data = set(document_form.changed_data)
+            if (
+                changed_data & DOCUMENT_INGESTION_FIELDS
+                and "ingested" not in changed_data
+            ):
+                document_form.instance.ingested = False
+        super().save_formset(request, form, formset, change)
+
+    @admin.action(description="Ingest new and changed game documents")
     def ingest_documents(self, request, queryset):
-        for game in queryset:
-            # clear the vector store
-            game.vector_store.clear()
-            # ingest the documents
-            for document in game.document_set.all():
-                ingest_document(document)
-            game.ingested = True
-            game.save()
-        self.message_user(request, "Documents ingested")
+        self._enqueue(request, queryset, IngestionJob.INGEST)
+
+    @admin.action(description="Re-ingest game documents changed at their url")
+    def refresh_documents(self, request, queryset):
+        self._enqueue(request, queryset, IngestionJob.REFRESH)
+
+    @admin.action(description="Re-ingest all game documents")
+    def reingest_all_documents(self, request, queryset):
+        self._enqueue(request, queryset, IngestionJob.REINGEST_ALL)
+
+    def _enqueue(self, request, queryset, kind):
+        # Ingestion takes minutes, the jobs are run by the ingestion_worker management command
+        jobs = [ingestion_job_service.enqueue(game, kind) for game in queryset]
+        self.message_user(
+            request,
+            format_html(
+                '{} ingestion jobs queued, <a href="{}?id__in={}">follow their progress</a>',
+                len(jobs),
+                reverse("admin:games_ingestionjob_changelist"),
+                ",".join(str(job.id) for job in jobs),
+            ),
+        )
+
+
+class IngestionJobAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "game",
+        "kind",
+        "state",
+        "progress_display",
+        "step",
+        "created_at",
+        "queued_seconds_display",
+        "duration_seconds_display",
+        "worker",
+    )
+    list_filter = ["state", "kind", "created_at"]
+    search_fields = ["game__name"]
+    list_select_related = ["game"]
+    actions = ["retry_jobs"]
+    # Reload the job list while jobs are queued or running
+    refresh_seconds = 5
+
+    def get_readonly_fields(self, request, obj=None):
+        return [field.name for field in self.model._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = extra_context or {}
+        if IngestionJob.objects.filter(
+            state__in=[IngestionJob.QUEUED, IngestionJob.RUNNING]
+        ).exists():
+            extra_context["refresh_seconds"] = self.refresh_seconds
+        return super().changelist_view(request, extra_context)
+
+    @admin.display(description="Progress")
+    def progress_display(self, job):
+        return (
+            f"{job.documents_done}/{job.documents_total} documents ({job.progress:.0%})"
+        )
+
+    @admin.display(description="Queued (s)")
+    def queued_seconds_display(self, job):
+        return _seconds(job.queued_seconds)
+
+    @admin.display(description="Duration (s)")
+    def duration_seconds_display(self, job):
+        return _seconds(job.duration_seconds)
+
+    @admin.action(description="Retry failed jobs")
+    def retry_jobs(self, request, queryset):
+        jobs = [
+            ingestion_job_service.enqueue(job.game, job.kind)
+            for job in queryset.filter(state=IngestionJob.FAILED)
+        ]
+        self.message_user(request, f"{len(jobs)} ingestion jobs queued")
+
+
+class IngestionRunAdmin(admin.ModelAdmin):
+    list_display = (
+        "created_at",
+        "document",
+        "game",
+        "outcome",
+        "seconds_display",
+        "stages_display",
+        "pages",
+        "sections",
+        "tokens",
+        "bytes_uploaded",
+    )
+    list_filter = ["outcome", "created_at"]
+    search_fields = ["document__game__name", "document__display_name"]
+    list_select_related = ["document__game"]
+
+    def get_readonly_fields(self, request, obj=None):
+        return [field.name for field in self.model._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.display(description="Game", ordering="document__game__name")
+    def game(self, run):
+        return run.document.game
+
+    @admin.display(description="Duration (s)", ordering="seconds")
+    def seconds_display(self, run):
+        return _seconds(run.seconds)
+
+    @admin.display(description="Stages (s)")
+    def stages_display(self, run):
+        return _stages(run)
+
+
+def _seconds(seconds):
+    return "-" if seconds is None else f"{seconds:.1f}"
+
+
+def _stages(run):
+    return ", ".join(
+        f"{stage} {seconds:.1f}" for stage, seconds in run.stage_seconds.items()
+    )
+
+
+def _run_summary(run):
+    summary = f"{run.get_outcome_display()} in {run.seconds:.1f}s"
+    if run.outcome == IngestionRun.INGESTED:
+        summary += f": {run.pages} pages, {run.sections} sections, {_stages(run)}"
+    return summary
 
 
 admin.site.register(Game, GameAdmin)
+admin.site.register(IngestionJob, IngestionJobAdmin)
+admin.site.register(IngestionRun, IngestionRunAdmin)
@@ -0,0 +1,327 @@
+"""
+Compact, pickle free docstore for game indexes.
+
+The docstore file holds every chunk of a game index in a few flat sections:
+
+    header            magic, version, chunk count and arena sizes
+    offset tables     start/end offsets of each chunk's id, text and extra metadata in the arenas
+    packed metadata   document_id, game_id, page and setup_page of each chunk as fixed size records
+    id arena          UTF-8 docstore ids, in faiss index order
+    text arena        UTF-8 page content
+    extra arena       JSON for any other metadata (e.g. source, total_pages)
+
+Loading only parses the offset tables and ids. Chunks are turned into langchain Documents when they are looked up,
+so a search only materializes the k documents it returns. The file is memory mapped from the local index cache,
+so the text arena is shared by all workers on a host just like the memory mapped faiss index.
+"""
+
+import json
+import mmap
+import struct
+import sys
+from array import array
+
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+
+MAGIC = b"RBDS"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHHIQQQ")
+RECORD = struct.Struct("<qqiB")
+
+HAS_DOCUMENT_ID = 1
+HAS_GAME_ID = 2
+HAS_PAGE = 4
+HAS_SETUP_PAGE = 8
+SETUP_PAGE = 16
+
+PACKED_INT_FIELDS = (
+    ("document_id", HAS_DOCUMENT_ID),
+    ("game_id", HAS_GAME_ID),
+    ("page", HAS_PAGE),
+)
+
+
+class CompactDocstore(Docstore, AddableMixin):
+    """
+    A docstore backed by one or more compact docstore buffers.
+
+    Documents added after loading are kept in memory until the docstore is serialized again.
+    """
+
+    def __init__(self, parts=None):
+        self._parts = parts or []
+        self._locations = {}
+        self._added = {}
+        for part_number, part in enumerate(self._parts):
+            for position, doc_id in enumerate(part.ids):
+                self._locations[doc_id] = (part_number, position)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Memory map a docstore file. Returns the docstore and the faiss index to docstore id mapping.
+        """
+        with open(path, "rb") as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        part = _DocstorePart(buffer)
+        return cls([part]), dict(enumerate(part.ids))
+
+    @classmethod
+    def merge(cls, docstores):
+        """
+        Merge docstores into a new docstore without decoding any documents. The underlying buffers are shared.
+        """
+        merged = cls()
+        for docstore in docstores:
+            part_offset = len(merged._parts)
+            merged._parts = merged._parts + docstore._parts
+            for doc_id, (part_number, position) in docstore._locations.items():
+                merged._locations[doc_id] = (part_offset + part_number, position)
+            merged._added.update(docstore._added)
+        return merged
+
+    def search(self, search: str):
+        if search in self._added:
+            return self._added[search]
+        location = self._locations.get(search)
+        if location is None:
+            return f"ID {search} not found."
+        part_number, position = location
+        return self._parts[part_number].document(position)
+
+    def add(self, texts: dict):
+        existing = [
+            doc_id
+            for doc_id in texts
+            if doc_id in self._locations or doc_id in self._added
+        ]
+        if existing:
+            raise ValueError(f"Tried to add ids that already exist: {existing}")
+        self._added.update(texts)
+
+    def delete(self, ids: list):
+        missing = [
+            doc_id
+            for doc_id in ids
+            if doc_id not in self._locations and doc_id not in self._added
+        ]
+        if missing:
+            raise ValueError(f"Tried to delete ids that does not exist: {missing}")
+        for doc_id in ids:
+            self._locations.pop(doc_id, None)
+            self._added.pop(doc_id, None)
+
+    def is_setup_page(self, doc_id):
+        """
+        Returns if the chunk is a setup page, read from the packed metadata without decoding the chunk.
+        """
+        if doc_id in self._added:
+            return bool(self._added[doc_id].metadata.get("setup_page"))
+        part_number, position = self._locations[doc_id]
+        return self._parts[part_number].is_setup_page(position)
+
+    def copy(self):
+        """
+        Return a copy that can be modified without affecting this docstore. The underlying buffers are shared.
+        """
+        docstore = CompactDocstore()
+        docstore._parts = self._parts
+        docstore._locations = dict(self._locations)
+        docstore._added = dict(self._added)
+        return docstore
+
+    def __len__(self):
+        return len(self._locations) + len(self._added)
+
+    def _encoded_record(self, doc_id):
+        """
+        Returns the (id, text, extra, packed metadata) of a chunk without decoding it if it is stored in a buffer.
+        """
+        if doc_id in self._added:
+            return _encode_document(doc_id, self._added[doc_id])
+        part_number, position = self._locations[doc_id]
+        return self._parts[part_number].encoded_record(position)
+
+
+def serialize(ids, docstore) -> bytes:
+    """
+    Serialize the documents with the given ids, in order, into the compact docstore format.
+    """
+    records = []
+    for doc_id in ids:
+        if isinstance(docstore, CompactDocstore):
+            records.append(docstore._encoded_record(doc_id))
+        else:
+            document = docstore.search(doc_id)
+            if not isinstance(document, Document):
+                raise ValueError(f"Could not find document for id {doc_id}")
+            records.append(_encode_document(doc_id, document))
+
+    id_offsets = _offsets([record[0] for record in records])
+    text_offsets = _offsets([record[1] for record in records])
+    extra_offsets = _offsets([record[2] for record in records])
+
+    return b"".join(
+        [
+            HEADER.pack(
+                MAGIC,
+                VERSION,
+                0,
+                len(records),
+                id_offsets[-1],
+                text_offsets[-1],
+                extra_offsets[-1],
+            ),
+            _array_bytes(id_offsets),
+            _array_bytes(text_offsets),
+            _array_bytes(extra_offsets),
+            b"".join(record[3] for record in records),
+            b"".join(record[0] for record in records),
+            b"".join(record[1] for record in records),
+            b"".join(record[2] for record in records),
+        ]
+    )
+
+
+class _DocstorePart:
+    """
+    A single parsed compact docstore buffer.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = memoryview(buffer)
+        (
+            magic,
+            version,
+            _flags,
+            self.count,
+            ids_length,
+            text_length,
+            extra_length,
+        ) = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a compact docstore")
+        if version != VERSION:
+            raise ValueError(f"Unsupported compact docstore version {version}")
+
+        offset = HEADER.size
+        table_size = (self.count + 1) * 8
+        self.id_offsets = _read_array(self.buffer, offset, self.count + 1)
+        offset += table_size
+        self.text_offsets = _read_array(self.buffer, offset, self.count + 1)
+        offset += table_size
+        self.extra_offsets = _read_array(self.buffer, offset, self.count + 1)
+        offset += table_size
+        self.records_start = offset
+        offset += self.count * RECORD.size
+        self.ids_start = offset
+        self.text_start = self.ids_start + ids_length
+        self.extra_start = self.text_start + text_length
+
+        if self.extra_start + extra_length > len(self.buffer):
+            raise ValueError("Truncated compact docstore")
+
+        self.ids = [
+            bytes(self._slice(self.ids_start, self.id_offsets, position)).decode()
+            for position in range(self.count)
+        ]
+
+    def document(self, position):
+        doc_id, text, extra, record = self.encoded_record(position)
+        return Document(
+            id=doc_id.decode(),
+            page_content=text.decode(),
+            metadata=_decode_metadata(record, extra),
+        )
+
+    def is_setup_page(self, position):
+        _, _, _, flags = RECORD.unpack(self._record(position))
+        return bool(flags & SETUP_PAGE)
+
+    def encoded_record(self, position):
+        return (
+            self.ids[position].encode(),
+            bytes(self._slice(self.text_start, self.text_offsets, position)),
+            bytes(self._slice(self.extra_start, self.extra_offsets, position)),
+            bytes(self._record(position)),
+        )
+
+    def _record(self, position):
+        start = self.records_start + position * RECORD.size
+        end = start + RECORD.size
+        return self.buffer[start:end]
+
+    def _slice(self, arena_start, offsets, position):
+        start = arena_start + offsets[position]
+        end = arena_start + offsets[position + 1]
+        return self.buffer[start:end]
+
+
+def _encode_document(doc_id, document):
+    metadata = dict(document.metadata)
+    values = {}
+    flags = 0
+
+    for key, flag in PACKED_INT_FIELDS:
+        value = metadata.get(key)
+        if isinstance(value, int) and not isinstance(value, bool):
+            values[key] = metadata.pop(key)
+            flags |= flag
+
+    setup_page = metadata.get("setup_page")
+    if isinstance(setup_page, bool):
+        metadata.pop("setup_page")
+        flags |= HAS_SETUP_PAGE
+        if setup_page:
+            flags |= SETUP_PAGE
+
+    record = RECORD.pack(
+        values.get("document_id", 0),
+        values.get("game_id", 0),
+        values.get("page", 0),
+        flags,
+    )
+    extra = json.dumps(metadata, default=str).encode() if metadata else b""
+
+    return doc_id.encode(), document.page_content.encode(), extra, record
+
+
+def _decode_metadata(record, extra):
+    document_id, game_id, page, flags = RECORD.unpack(record)
+    metadata = json.loads(extra) if extra else {}
+
+    if flags & HAS_DOCUMENT_ID:
+        metadata["document_id"] = document_id
+    if flags & HAS_GAME_ID:
+        metadata["game_id"] = game_id
+    if flags & HAS_PAGE:
+        metadata["page"] = page
+    if flags & HAS_SETUP_PAGE:
+        metadata["setup_page"] = bool(flags & SETUP_PAGE)
+
+    return metadata
+
+
+def _offsets(values):
+    offsets = array("Q", [0])
+    for value in values:
+        offsets.append(offsets[-1] + len(value))
+    return offsets
+
+
+def _array_bytes(values):
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _read_array(buffer, offset, count):
+    values = array("Q")
+    end = offset + count * 8
+    values.frombytes(buffer[offset:end])
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
@@ -0,0 +1,188 @@
+"""
+Selectable embedding backends for game indexes.
+
+    openai   the OpenAI embeddings API, every ingest and every question not in the query cache is a network call
+    hashed   local hashed n-gram projection, computed on the CPU in microseconds, no network and no API costs
+    fake     DeterministicFakeEmbedding, random vectors for tests, only the default backend of the test settings
+
+The embedding backend of a game is set on Game.embedding_backend, or for all games with settings.EMBEDDING_BACKEND.
+The backend an index was embedded with is recorded on each segment in the index manifest, and the index is always
+queried with that backend, also after the backend of the game is changed. The game is embedded with its new backend
+the next time it is ingested (see games/services/ingestion_job_service.py).
+
+Other backends are added with register_backend. Run tests/benchmarks/benchmark_embedding_backends.py to compare
+retrieval latency and quality of the backends.
+"""
+
+import math
+import threading
+import zlib
+from collections import Counter
+
+import numpy as np
+from django.conf import settings
+from langchain_community.embeddings.fake import DeterministicFakeEmbedding
+from langchain_core.embeddings import Embeddings
+from langchain_openai.embeddings import OpenAIEmbeddings
+
+from games.lexical_index import tokenize
+
+OPENAI = "openai"
+HASHED = "hashed"
+FAKE = "fake"
+
+# The backends a game can be set to in the admin. The fake backend is not one of them, it would answer questions
+# from random vectors.
+EMBEDDING_BACKEND_CHOICES = [
+    (OPENAI, "OpenAI"),
+    (HASHED, "Local hashed n-grams"),
+]
+
+# Weight of the character trigrams of a word relative to the word, they match word forms the stemming misses
+TRIGRAM_WEIGHT = 0.5
+
+
+class HashedNgramEmbedding(Embeddings):
+    """
+    Embeds texts locally by hashing their word unigrams, word bigrams and character trigrams into a fixed number of
+    dimensions, weighted by sublinear term frequency, with a hashed sign so colliding features cancel out instead
+    of adding up. Vectors are L2 normalized, so inner product and L2 distance rank like cosine similarity.
+
+    Words are the terms of the lexical index (games/lexical_index.py): lowercased, without stopwords and with
+    plural endings removed. Stopwords get no weight at all, which is what IDF weighting would mostly do; real IDF
+    weights would depend on the sections already ingested, and change the vectors of a text over time.
+
+    With use_numpy the vectors of a batch are accumulated in a NumPy matrix, otherwise in Python lists.
+    Both give the same vectors.
+    """
+
+    model = "hashed-ngram-v1"
+
+    def __init__(self, dimensions=None, use_numpy=True):
+        self.dimensions = dimensions or settings.HASHED_EMBEDDING_DIMENSIONS
+        self.use_numpy = use_numpy
+
+    def embed_documents(self, texts: list) -> list:
+        features = [self.features(text) for text in texts]
+        if self.use_numpy:
+            return self._numpy_vectors(features).tolist()
+        return [self._python_vector(text_features) for text_features in features]
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_documents([text])[0]
+
+    def features(self, text: str) -> dict:
+        """
+        The signed weight of each dimension that the n-grams of text hash to.
+        """
+        words = tokenize(text)
+        counts = Counter(words)
+        counts.update(f"{first} {second}" for first, second in zip(words, words[1:]))
+        weights = {term: 1 + math.log(count) for term, count in counts.items()}
+
+        for word, count in Counter(words).items():
+            padded = f"<{word}>"
+            trigrams = ["".join(chars) for chars in zip(padded, padded[1:], padded[2:])]
+            # Spread over the trigrams, so long words do not outweigh short ones
+            trigram_weight = TRIGRAM_WEIGHT * (1 + math.log(count)) / len(trigrams)
+            for trigram in trigrams:
+                key = f"#{trigram}"
+                weights[key] = weights.get(key, 0.0) + trigram_weight
+
+        features = {}
+        for term, weight in weights.items():
+            # crc32 is stable across processes, unlike hash()
+            value = zlib.crc32(term.encode())
+            dimension = value % self.dimensions
+            sign = -1.0 if value & 0x80000000 else 1.0
+            features[dimension] = features.get(dimension, 0.0) + sign * weight
+        return features
+
+    def _python_vector(self, features):
+        vector = [0.0] * self.dimensions
+        for dimension, weight in features.items():
+            vector[dimension] = weight
+        norm = math.sqrt(sum(weight * weight for weight in features.values()))
+        if norm:
+            vector = [weight / norm for weight in vector]
+        return vector
+
+    def _numpy_vectors(self, features):
+        matrix = np.zeros((len(features), self.dimensions), dtype=np.float64)
+        rows = np.repeat(
+            np.arange(len(features)),
+            [len(text_features) for text_features in features],
+        )
+        columns = np.fromiter(
+            (dimension for text_features in features for dimension in text_features),
+            dtype=np.int64,
+        )
+        weights = np.fromiter(
+            (weight for text_features in features for weight in text_features.values()),
+            dtype=np.float64,
+        )
+        matrix[rows, columns] = weights
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return np.divide(matrix, norms, out=matrix, where=norms > 0)
+
+
+def _openai_embedding():
+    return OpenAIEmbeddings()
+
+
+def _fake_embedding():
+    return DeterministicFakeEmbedding(size=1536)
+
+
+_factories = {
+    OPENAI: _openai_embedding,
+    HASHED: HashedNgramEmbedding,
+    FAKE: _fake_embedding,
+}
+_embeddings = {}
+_lock = threading.Lock()
+
+
+def register_backend(name, factory):
+    """
+    Register an embedding backend. factory is called without arguments to create its embedding, once per process.
+    """
+    with _lock:
+        _factories[name] = factory
+        _embeddings.pop(name, None)
+
+
+def get_embedding(name) -> Embeddings:
+    """
+    The embedding of a backend, shared by all vector stores of the process. Raises ValueError for unknown backends.
+    """
+    with _lock:
+        if name not in _embeddings:
+            if name not in _factories:
+                raise ValueError(f"Unknown embedding backend: {name}")
+            _embeddings[name] = _factories[name]()
+        return _embeddings[name]
+
+
+def game_backend(game) -> str:
+    """
+    The embedding backend selected for the game.
+    """
+    return game.embedding_backend or settings.EMBEDDING_BACKEND
+
+
+def is_local(embedding) -> bool:
+    """
+    Local embeddings are cheaper to compute than to look up in the embedding caches.
+    """
+    return isinstance(embedding, HashedNgramEmbedding)
+
+
+def backend_name(embedding):
+    """
+    The name of the backend of an embedding returned by get_embedding, or None for other embeddings.
+    """
+    with _lock:
+        return next(
+            (name for name, shared in _embeddings.items() if shared is embedding), None
+        )
@@ -0,0 +1,311 @@
+"""
+Persistent cache of chunk embeddings, shared by every ingest.
+
+Re-ingesting a document mostly produces chunks with exactly the same text as the previous ingest. Embeddings are
+cached in the database keyed on (embedding model, dimension, sha256 of the chunk text), so only new or changed
+chunks are sent to the embedding API. The key includes the model and dimension, so switching embedding model never
+returns vectors from another embedding space.
+
+Questions are embedded through a separate query embedding cache, as many users ask the same questions word for word.
+It keeps recently used query embeddings in an in-process LRU in front of a database table shared by all workers,
+and expires embeddings after a TTL.
+
+Local embeddings (see games/embedding_backends.py) are computed faster than they are looked up, so neither cache
+stores them.
+"""
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+import numpy as np
+from django.apps import apps
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+from games.embedding_backends import is_local
+
+logger = logging.getLogger(__name__)
+
+# Keep the number of query parameters well below the database limits
+LOOKUP_BATCH_SIZE = 500
+
+
+class EmbeddingCache:
+    """
+    Embeds texts with an embedding model, only calling the model for texts that are not cached.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def embed_documents(self, embedding, texts: list) -> list:
+        """
+        Returns the embeddings of texts, in order, embedding only the texts that are not cached.
+        """
+        if is_local(embedding):
+            return embedding.embed_documents(texts)
+
+        model = embedding_model_name(embedding)
+        dimension = embedding_dimension(embedding)
+        hashes = [text_hash(text) for text in texts]
+
+        vectors = self._lookup(model, dimension, set(hashes))
+        hits = sum(1 for hash in hashes if hash in vectors)
+
+        # Identical texts only have to be embedded once
+        missing = {}
+        for hash, text in zip(hashes, texts):
+            if hash not in vectors:
+                missing.setdefault(hash, text)
+
+        if missing:
+            embedded = embedding.embed_documents(list(missing.values()))
+            # Vectors are stored as float32 like in the faiss index, so hits and misses return the same values
+            new_vectors = {
+                hash: np.asarray(vector, dtype=np.float32).tolist()
+                for hash, vector in zip(missing.keys(), embedded)
+            }
+            self._store(model, dimension, new_vectors)
+            vectors.update(new_vectors)
+
+        with self._lock:
+            self.hits += hits
+            self.misses += len(texts) - hits
+        logger.info(
+            f"Embedding cache for {model}: {hits} hits, {len(texts) - hits} misses"
+        )
+
+        return [vectors[hash] for hash in hashes]
+
+    def cached_vectors(self, embedding, texts: list) -> list:
+        """
+        Returns the cached embeddings of texts, in order, with None for texts that are not cached.
+        Never calls the embedding model and does not count towards the hit/miss counters. Local embeddings are
+        always computed.
+        """
+        if is_local(embedding):
+            return embedding.embed_documents(texts)
+
+        hashes = [text_hash(text) for text in texts]
+        vectors = self._lookup(
+            embedding_model_name(embedding), embedding_dimension(embedding), set(hashes)
+        )
+        return [vectors.get(hash) for hash in hashes]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def _lookup(self, model, dimension, hashes):
+        entries = _entry_model().objects.filter(model=model, dimension=dimension)
+        hashes = list(hashes)
+        vectors = {}
+        for start in range(0, len(hashes), LOOKUP_BATCH_SIZE):
+            end = start + LOOKUP_BATCH_SIZE
+            batch = hashes[start:end]
+            for hash, vector in entries.filter(text_hash__in=batch).values_list(
+                "text_hash", "vector"
+            ):
+                vectors[hash] = np.frombuffer(vector, dtype=np.float32).tolist()
+        return vectors
+
+    def _store(self, model, dimension, vectors):
+        entry_model = _entry_model()
+        entry_model.objects.bulk_create(
+            [
+                entry_model(
+                    model=model,
+                    dimension=dimension,
+                    text_hash=hash,
+                    vector=np.asarray(vector, dtype=np.float32).tobytes(),
+                )
+                for hash, vector in vectors.items()
+            ],
+            batch_size=LOOKUP_BATCH_SIZE,
+            # Another ingest might have embedded the same text concurrently
+            ignore_conflicts=True,
+        )
+
+
+class QueryEmbeddingCache:
+    """
+    Embeds queries with an embedding model through an in-process LRU and a shared database table.
+
+    Queries are normalized (case and whitespace) before they are embedded, so trivially different questions
+    share the same embedding.
+    """
+
+    # Expired rows are deleted from the shared table every this many misses
+    PRUNE_INTERVAL = 100
+
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def embed_query(self, embedding, query: str) -> list:
+        if is_local(embedding):
+            return embedding.embed_query(query)
+
+        query = normalize_query(query)
+        model = embedding_model_name(embedding)
+        dimension = embedding_dimension(embedding)
+        key = (model, dimension, text_hash(query))
+
+        vector = self._get_local(key)
+        if vector is not None:
+            self._count("local_hits")
+            return vector.tolist()
+
+        stored_vector = self._get_shared(model, dimension, key[2])
+        if stored_vector is not None:
+            vector = np.frombuffer(stored_vector, dtype=np.float32)
+            self._count("shared_hits")
+        else:
+            vector = np.asarray(embedding.embed_query(query), dtype=np.float32)
+            self._put_shared(model, dimension, key[2], vector)
+            if self._count("misses") % self.PRUNE_INTERVAL == 0:
+                self.prune()
+
+        self._put_local(key, vector)
+        return vector.tolist()
+
+    def prune(self):
+        """
+        Delete expired query embeddings from the shared table.
+        """
+        try:
+            _query_entry_model().objects.filter(
+                embedded_at__lt=timezone.now() - self.ttl
+            ).delete()
+        except DatabaseError as e:
+            logger.warning(f"Could not prune query embeddings: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.local_hits + self.shared_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "local_hits": self.local_hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_rate": (
+                    (self.local_hits + self.shared_hits) / lookups if lookups else 0.0
+                ),
+            }
+
+    def clear(self):
+        """
+        Drop the in-process entries and reset the counters. The shared table is left untouched.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.local_hits = 0
+            self.shared_hits = 0
+            self.misses = 0
+
+    # The shared table is only an optimization, so questions are still answered if the database is unavailable
+
+    def _get_shared(self, model, dimension, query_hash):
+        try:
+            return (
+                _query_entry_model()
+                .objects.filter(
+                    model=model,
+                    dimension=dimension,
+                    query_hash=query_hash,
+                    embedded_at__gte=timezone.now() - self.ttl,
+                )
+                .values_list("vector", flat=True)
+                .first()
+            )
+        except DatabaseError as e:
+            logger.warning(f"Could not look up shared query embedding: {e}")
+            return None
+
+    def _put_shared(self, model, dimension, query_hash, vector):
+        try:
+            _query_entry_model().objects.update_or_create(
+                model=model,
+                dimension=dimension,
+                query_hash=query_hash,
+                defaults={"vector": vector.tobytes(), "embedded_at": timezone.now()},
+            )
+        except DatabaseError as e:
+            logger.warning(f"Could not store shared query embedding: {e}")
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            vector, embedded_at = entry
+            if timezone.now() - embedded_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return vector
+
+    def _put_local(self, key, vector):
+        with self._lock:
+            self._entries[key] = (vector, timezone.now())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _count(self, counter):
+        with self._lock:
+            value = getattr(self, counter) + 1
+            setattr(self, counter, value)
+            return value
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.split()).casefold()
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def embedding_model_name(embedding) -> str:
+    return getattr(embedding, "model", None) or type(embedding).__name__
+
+
+def embedding_dimension(embedding) -> int:
+    """
+    The configured dimension of the embedding model, or 0 for the default dimension of the model.
+    """
+    return getattr(embedding, "dimensions", None) or getattr(embedding, "size", 0)
+
+
+def _entry_model():
+    # games.models imports the vector store, so look the model up lazily
+    return apps.get_model("games", "EmbeddingCacheEntry")
+
+
+def _query_entry_model():
+    return apps.get_model("games", "QueryEmbedding")
+
+
+embedding_cache = EmbeddingCache()
+query_embedding_cache = QueryEmbeddingCache(
+    max_entries=settings.QUERY_EMBEDDING_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.QUERY_EMBEDDING_CACHE_TTL_SECONDS,
+)
@@ -0,0 +1,278 @@
+"""
+Batched, concurrent embedding of rulebook sections during ingestion.
+
+OpenAIEmbeddings sends its batches one request at a time, and backs off each request on its own when the API
+throttles. Ingesting a big rulebook is mostly waiting for those round trips. The EmbeddingScheduler packs sections
+into batches bounded by an estimated token budget, keeps several batch requests in flight with asyncio, and when the
+API answers 429 pauses all requests for the Retry-After delay before retrying, so throttling is not made worse by the
+other requests in flight. Vectors are returned in the order of the texts, whatever order the batches complete in.
+
+Queries are still embedded one at a time through the embedding of the vector store, only ingestion is scheduled.
+"""
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+
+import openai
+from django.conf import settings
+from langchain_core.embeddings import Embeddings
+from langchain_openai.embeddings import OpenAIEmbeddings
+
+logger = logging.getLogger(__name__)
+
+# A token is about 4 characters of English text, estimate on the safe side so batches stay below the API limits
+CHARACTERS_PER_TOKEN = 3
+
+
+class EmbeddingScheduler(Embeddings):
+    """
+    Embeds texts with an OpenAI compatible embeddings API in token bounded batches, max_concurrency at a time.
+
+    model and dimensions are the same attributes as OpenAIEmbeddings, so the embedding cache keys the vectors the
+    same way whichever of the two embedded them.
+    """
+
+    def __init__(
+        self,
+        model,
+        dimensions=None,
+        api_key=None,
+        base_url=None,
+        organization=None,
+        max_batch_tokens=None,
+        max_batch_size=None,
+        max_concurrency=None,
+        max_retries=None,
+        retry_backoff_seconds=None,
+        timeout=None,
+    ):
+        self.model = model
+        self.dimensions = dimensions
+        self.api_key = api_key
+        self.base_url = base_url
+        self.organization = organization
+        self.max_batch_tokens = max_batch_tokens or settings.EMBEDDING_BATCH_MAX_TOKENS
+        self.max_batch_size = max_batch_size or settings.EMBEDDING_BATCH_MAX_SIZE
+        self.max_concurrency = max_concurrency or settings.EMBEDDING_MAX_CONCURRENCY
+        self.max_retries = (
+            settings.EMBEDDING_MAX_RETRIES if max_retries is None else max_retries
+        )
+        self.retry_backoff_seconds = (
+            settings.EMBEDDING_RETRY_BACKOFF_SECONDS
+            if retry_backoff_seconds is None
+            else retry_backoff_seconds
+        )
+        self.timeout = timeout
+        self.requests = 0
+        self.throttled = 0
+
+    @classmethod
+    def from_openai(cls, embedding: OpenAIEmbeddings, **kwargs):
+        """
+        A scheduler embedding with the same model, dimensions and credentials as the OpenAIEmbeddings.
+        """
+        return cls(
+            model=embedding.model,
+            dimensions=embedding.dimensions,
+            api_key=(
+                embedding.openai_api_key.get_secret_value()
+                if embedding.openai_api_key
+                else None
+            ),
+            base_url=embedding.openai_api_base,
+            organization=embedding.openai_organization,
+            timeout=embedding.request_timeout,
+            **kwargs,
+        )
+
+    def embed_documents(self, texts: list) -> list:
+        if not texts:
+            return []
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.aembed_documents(texts))
+
+        # asyncio.run can not be nested in a running event loop, so run the requests on a loop of their own thread
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, self.aembed_documents(texts)).result()
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: list) -> list:
+        """
+        Returns the embeddings of texts, in order.
+
+        Raises the openai.APIError of a batch that still fails after max_retries retries.
+        """
+        if not texts:
+            return []
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        throttle = _Throttle()
+        client = openai.AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=self.base_url,
+            organization=self.organization,
+            timeout=self.timeout,
+            # Retries are handled here, so a 429 pauses every request in flight and not only the throttled one
+            max_retries=0,
+        )
+        async with client:
+            results = await asyncio.gather(
+                *(
+                    self._embed_batch(client, semaphore, throttle, batch)
+                    for batch in self.batches(texts)
+                )
+            )
+        return [vector for vectors in results for vector in vectors]
+
+    async def aembed_query(self, text: str) -> list:
+        return (await self.aembed_documents([text]))[0]
+
+    def batches(self, texts: list) -> list:
+        """
+        Split texts, in order, into batches of at most max_batch_size texts and max_batch_tokens estimated tokens.
+        A text longer than max_batch_tokens is a batch of its own.
+        """
+        batches = []
+        batch = []
+        batch_tokens = 0
+        for text in texts:
+            tokens = estimate_tokens(text)
+            if batch and (
+                batch_tokens + tokens > self.max_batch_tokens
+                or len(batch) >= self.max_batch_size
+            ):
+                batches.append(batch)
+                batch = []
+                batch_tokens = 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    async def _embed_batch(self, client, semaphore, throttle, batch):
+        kwargs = {"model": self.model, "input": batch, "encoding_format": "float"}
+        if self.dimensions:
+            kwargs["dimensions"] = self.dimensions
+
+        attempt = 0
+        while True:
+            backoff = 0.0
+            async with semaphore:
+                await throttle.wait()
+                self.requests += 1
+                try:
+                    response = await client.embeddings.create(**kwargs)
+                    return [
+                        item.embedding
+                        for item in sorted(response.data, key=lambda item: item.index)
+                    ]
+                except openai.RateLimitError as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    self.throttled += 1
+                    delay = retry_after_seconds(e.response)
+                    if delay is None:
+                        delay = self._backoff(attempt)
+                    logger.info(
+                        f"Embedding API rate limited, pausing requests for {delay:.2f}s"
+                    )
+                    throttle.pause(delay)
+                except (openai.APIConnectionError, openai.InternalServerError):
+                    if attempt >= self.max_retries:
+                        raise
+                    # A failed request only backs off itself, and without holding up a slot
+                    backoff = self._backoff(attempt)
+            attempt += 1
+            await asyncio.sleep(backoff)
+
+    def _backoff(self, attempt):
+        return self.retry_backoff_seconds * 2**attempt
+
+
+class _Throttle:
+    """
+    Pauses all requests of a scheduler run until the Retry-After delay of the latest 429 has passed.
+    """
+
+    def __init__(self):
+        self.resume_at = 0.0
+
+    def pause(self, seconds):
+        self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+
+    async def wait(self):
+        # A 429 can arrive while waiting, so check again after sleeping
+        while (delay := self.resume_at - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+
+
+def ingestion_embedding(embedding: Embeddings) -> Embeddings:
+    """
+    The embedding to embed rulebook sections with during ingestion: a scheduler for OpenAIEmbeddings, and the
+    embedding itself for embeddings that do not call the OpenAI API.
+    """
+    if isinstance(embedding, OpenAIEmbeddings):
+        return EmbeddingScheduler.from_openai(embedding)
+    return embedding
+
+
+def concurrent_windows(batches, embedding):
+    """
+    Combine consecutive batches of documents into windows that keep every concurrent request of the embedding busy.
+
+    A scheduler only has as many requests in flight as one call to embed_documents has batches, and a batch of the
+    ingestion pipeline usually fits in a single request. Windows are filled up to max_concurrency requests worth of
+    documents. Embeddings other than a scheduler get the batches as they are.
+    """
+    if not isinstance(embedding, EmbeddingScheduler):
+        yield from batches
+        return
+
+    max_tokens = embedding.max_batch_tokens * embedding.max_concurrency
+    max_size = embedding.max_batch_size * embedding.max_concurrency
+    window = []
+    window_tokens = 0
+    for documents in batches:
+        window.extend(documents)
+        window_tokens += sum(
+            estimate_tokens(document.page_content) for document in documents
+        )
+        if window_tokens >= max_tokens or len(window) >= max_size:
+            yield window
+            window = []
+            window_tokens = 0
+    if window:
+        yield window
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARACTERS_PER_TOKEN + 1
+
+
+def retry_after_seconds(response):
+    """
+    The delay in seconds the Retry-After (or retry-after-ms) header of a response asks for, or None.
+    """
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            value = headers["retry-after"]
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        pass
+    return None
@@ -0,0 +1,152 @@
+"""
+Local on-disk cache for index files kept in the default storage (S3 in production).
+
+All gunicorn workers on a host share the cache directory, so once any worker has downloaded an index file the
+other workers (and restarted workers) can read it from local disk instead of doing a full S3 GET.
+
+Files of split format indexes are written once under a unique name and never overwritten, so they are cached by
+their name alone and a cache hit needs no request to the storage at all. Other files, like legacy pickled indexes
+that may have been overwritten in place, are cached by the storage name plus a fingerprint of the stored object
+(the ETag and size on S3, the size and modification time on other storages). Looking up the fingerprint is a cheap
+metadata request, so a stale local copy of those is never used.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+
+from django.conf import settings
+from storages.utils import clean_name
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+TEMP_FILE_PREFIX = ".tmp-"
+# Fingerprint of files that are never overwritten
+IMMUTABLE = "immutable"
+
+
+class LocalIndexCache:
+    """
+    A size capped, least recently used, local disk cache of files in a Django storage.
+    """
+
+    def __init__(self, directory, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def fetch(self, storage, name, immutable=False) -> Path:
+        """
+        Return a local path with the current contents of name in storage, downloading it on a cache miss.
+
+        Files that are never overwritten are immutable, their freshness is not checked against the storage.
+        """
+        fingerprint = IMMUTABLE if immutable else _storage_fingerprint(storage, name)
+        path = self.directory / self._cache_key(name, fingerprint)
+
+        try:
+            # Touch the file to mark it as recently used
+            os.utime(path)
+            self._count("hits")
+            return path
+        except FileNotFoundError:
+            self._count("misses")
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._download(storage, name, path)
+        self._enforce_size_cap(keep=path)
+        return path
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "bytes": sum(size for _, size, _ in self._cached_files()),
+                "max_bytes": self.max_bytes,
+            }
+
+    def _download(self, storage, name, path):
+        # Write to a temporary file in the cache directory and atomically move it in place,
+        # so other workers never observe a partially written file.
+        fd, tmp_name = tempfile.mkstemp(prefix=TEMP_FILE_PREFIX, dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as tmp_file, storage.open(name, "rb") as source:
+                shutil.copyfileobj(source, tmp_file, DOWNLOAD_CHUNK_SIZE)
+            os.replace(tmp_name, path)
+        except BaseException:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            raise
+
+    def _enforce_size_cap(self, keep):
+        files = sorted(self._cached_files(), key=lambda file: file[2])
+        total_bytes = sum(size for _, size, _ in files)
+
+        for path, size, _ in files:
+            if total_bytes <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                # Another worker evicted it first
+                pass
+            total_bytes -= size
+            self._count("evictions")
+            logger.info(f"Evicted {path.name} from local index cache")
+
+    def _cached_files(self):
+        """
+        Returns a list of (path, size, last used) for the files in the cache.
+        """
+        files = []
+        if not self.directory.exists():
+            return files
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(TEMP_FILE_PREFIX) or not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((Path(entry.path), stat.st_size, stat.st_mtime))
+        return files
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    @staticmethod
+    def _cache_key(name, fingerprint):
+        return hashlib.sha256(f"{name}\0{fingerprint}".encode()).hexdigest()
+
+
+def _storage_fingerprint(storage, name):
+    """
+    Cheap freshness check for a stored file, only fetching object metadata.
+    """
+    bucket = getattr(storage, "bucket", None)
+    if bucket is not None:
+        # S3 storage: a single HEAD request gives us both the ETag and the size
+        stored_object = bucket.Object(storage._normalize_name(clean_name(name)))
+        e_tag = stored_object.e_tag.strip('"')
+        return f"{e_tag}-{stored_object.content_length}"
+
+    return f"{storage.size(name)}-{storage.get_modified_time(name).timestamp()}"
+
+
+index_cache = LocalIndexCache(
+    directory=settings.VECTOR_STORE_DISK_CACHE_DIR,
+    max_bytes=settings.VECTOR_STORE_DISK_CACHE_MAX_BYTES,
+)
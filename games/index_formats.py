@@ -0,0 +1,217 @@
+"""
+Persisted formats for game indexes.
+
+Legacy format:
+    A single pickle of (faiss index, docstore, index_to_docstore_id) as produced by FAISS.serialize_to_bytes.
+    Every worker has to deserialize its own private copy of the whole index.
+
+Split format:
+    The raw faiss index is written as its own file, so it can be memory mapped from the local index cache,
+    and the docstore is written as a compact docstore sidecar file (see games/docstores.py). Memory mapped
+    vectors and chunk texts live in the kernel page cache, which is shared by all workers on a host instead
+    of being copied into each of them.
+
+    An index is made up of one or more immutable segments, each an index file plus a docstore file and a lexical
+    index file (see games/lexical_index.py). Ingesting a document appends a segment instead of rewriting the whole
+    index. A small JSON manifest lists the segments in order and is what Game.faiss_file points to.
+"""
+
+import json
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+from games import docstores
+
+SPLIT_FORMAT = "split"
+SPLIT_FORMAT_VERSION = 2
+
+# Map flat vector codes (Flat, scalar quantized and HNSW storage) straight from the page cache.
+# IO_FLAG_MMAP on its own only applies to IVF inverted lists.
+MMAP_IO_FLAGS = faiss.IO_FLAG_MMAP_IFC
+
+
+def serialize_raw_index(index: FAISS) -> bytes:
+    return faiss.serialize_index(index.index).tobytes()
+
+
+def serialize_docstore(index: FAISS) -> bytes:
+    ids = [
+        index.index_to_docstore_id[i] for i in range(len(index.index_to_docstore_id))
+    ]
+    return docstores.serialize(ids, index.docstore)
+
+
+def build_manifest(segments: list) -> bytes:
+    """
+    Build a manifest for a list of segments on the form
+    {"index": name, "docstore": name, "lexical": name, "document_ids": [...], "index_type": type, "setup_ids": [...]}.
+    """
+    return json.dumps(
+        {
+            "format": SPLIT_FORMAT,
+            "version": SPLIT_FORMAT_VERSION,
+            "segments": segments,
+        }
+    ).encode()
+
+
+def parse_manifest(data: bytes):
+    """
+    Parse a split format manifest. Returns None if data is a legacy pickled index.
+    """
+    if not data.lstrip().startswith(b"{"):
+        return None
+
+    manifest = json.loads(data)
+    if manifest.get("format") != SPLIT_FORMAT:
+        raise ValueError(f"Unknown index format: {manifest.get('format')}")
+    if manifest.get("version") != SPLIT_FORMAT_VERSION:
+        raise ValueError(f"Unknown index format version: {manifest.get('version')}")
+    return manifest
+
+
+def load_split_index(index_path, docstore_path, embedding, mmap=True) -> FAISS:
+    """
+    Load a split format segment from a local index file and docstore sidecar file.
+    """
+    raw_index = faiss.read_index(str(index_path), MMAP_IO_FLAGS if mmap else 0)
+    docstore, index_to_docstore_id = docstores.CompactDocstore.load(docstore_path)
+    return FAISS(embedding, raw_index, docstore, index_to_docstore_id)
+
+
+def writable_copy(index: FAISS) -> FAISS:
+    """
+    Return a copy of index that is safe to modify.
+
+    Memory mapped faiss indexes can not be added to, and indexes shared between requests must not change under them.
+    """
+    if isinstance(index.docstore, docstores.CompactDocstore):
+        docstore = index.docstore.copy()
+    else:
+        docstore = InMemoryDocstore(dict(index.docstore._dict))
+
+    return FAISS(
+        index.embedding_function,
+        faiss.deserialize_index(faiss.serialize_index(index.index)),
+        docstore,
+        dict(index.index_to_docstore_id),
+    )
+
+
+def merge_indexes(indexes: list) -> FAISS:
+    """
+    Merge indexes, in order, into a new in memory index. The given indexes are left untouched.
+    """
+    merged = writable_copy(indexes[0])
+
+    for index in indexes[1:]:
+        offset = merged.index.ntotal
+        merged.index.add(index.index.reconstruct_n(0, index.index.ntotal))
+
+        if isinstance(merged.docstore, docstores.CompactDocstore) and isinstance(
+            index.docstore, docstores.CompactDocstore
+        ):
+            merged.docstore = docstores.CompactDocstore.merge(
+                [merged.docstore, index.docstore]
+            )
+        else:
+            merged.docstore.add(
+                {
+                    doc_id: index.docstore.search(doc_id)
+                    for doc_id in index.index_to_docstore_id.values()
+                }
+            )
+
+        merged.index_to_docstore_id.update(
+            {offset + i: doc_id for i, doc_id in index.index_to_docstore_id.items()}
+        )
+
+    return merged
+
+
+def section_document_ids(index: FAISS) -> list:
+    """
+    Returns the game document id of each section in the index, in faiss index order.
+    """
+    return [
+        index.docstore.search(index.index_to_docstore_id[position]).metadata.get(
+            "document_id"
+        )
+        for position in range(index.index.ntotal)
+    ]
+
+
+def without_document(index: FAISS, document_id) -> FAISS:
+    """
+    Return a new in memory index without the sections of the given game document. The given index is left untouched.
+    """
+    kept = []
+    removed = []
+    for position, section_document_id in enumerate(section_document_ids(index)):
+        if section_document_id == document_id:
+            removed.append(position)
+        else:
+            kept.append(position)
+
+    filtered = writable_copy(index)
+    if not removed:
+        return filtered
+
+    # Rebuild rather than faiss remove_ids, which is not supported by every index type
+    filtered.index.reset()
+    if kept:
+        filtered.index.add(index.index.reconstruct_batch(np.array(kept, dtype="int64")))
+    filtered.docstore.delete(
+        [index.index_to_docstore_id[position] for position in removed]
+    )
+    filtered.index_to_docstore_id = {
+        new_position: index.index_to_docstore_id[position]
+        for new_position, position in enumerate(kept)
+    }
+    return filtered
+
+
+def setup_ids(index: FAISS) -> list:
+    """
+    Returns the docstore ids of the setup page sections in the index.
+    """
+    ids = [
+        index.index_to_docstore_id[position] for position in range(index.index.ntotal)
+    ]
+    if isinstance(index.docstore, docstores.CompactDocstore):
+        return [doc_id for doc_id in ids if index.docstore.is_setup_page(doc_id)]
+    return [
+        doc_id
+        for doc_id in ids
+        if index.docstore.search(doc_id).metadata.get("setup_page")
+    ]
+
+
+def verify_same_index(expected: FAISS, actual: FAISS):
+    """
+    Raise a ValueError if actual does not hold exactly the same sections and vectors as expected.
+    """
+    if expected.index.ntotal != actual.index.ntotal:
+        raise ValueError(
+            f"Expected {expected.index.ntotal} vectors, found {actual.index.ntotal}"
+        )
+    if expected.index_to_docstore_id != actual.index_to_docstore_id:
+        raise ValueError("Docstore ids differ")
+
+    for doc_id in expected.index_to_docstore_id.values():
+        expected_document = expected.docstore.search(doc_id)
+        actual_document = actual.docstore.search(doc_id)
+        if (
+            expected_document.page_content != actual_document.page_content
+            or expected_document.metadata != actual_document.metadata
+        ):
+            raise ValueError(f"Section {doc_id} differs")
+
+    if not np.array_equal(
+        expected.index.reconstruct_n(0, expected.index.ntotal),
+        actual.index.reconstruct_n(0, actual.index.ntotal),
+    ):
+        raise ValueError("Vectors differ")
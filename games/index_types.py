@@ -0,0 +1,102 @@
+"""
+Selectable faiss index types for game indexes.
+
+    flat      exact search over float32 vectors, 4 bytes per dimension
+    sq8       8 bit scalar quantization, 1 byte per dimension
+    sqfp16    float16 scalar quantization, 2 bytes per dimension
+    ivf_pq    inverted file with product quantization, a few bytes per vector, approximate
+    hnsw      HNSW graph over float32 vectors, faster search at the cost of extra memory for the graph
+
+The index type of a game is set on Game.index_type, or for all games with settings.VECTOR_STORE_INDEX_TYPE.
+Run tests/benchmarks/benchmark_index_types.py to compare recall, latency and size of the index types.
+"""
+
+import logging
+import math
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FLAT = "flat"
+SQ8 = "sq8"
+SQFP16 = "sqfp16"
+IVF_PQ = "ivf_pq"
+HNSW = "hnsw"
+
+INDEX_TYPE_CHOICES = [
+    (FLAT, "Flat"),
+    (SQ8, "Scalar quantized (8 bit)"),
+    (SQFP16, "Scalar quantized (float16)"),
+    (IVF_PQ, "IVF-PQ"),
+    (HNSW, "HNSW"),
+]
+
+# faiss wants at least 39 training vectors per centroid. Product quantization trains 2^bits centroids per
+# sub quantizer, so small indexes use fewer bits per sub quantizer and indexes too small for 4 bits are kept flat.
+TRAINING_VECTORS_PER_CENTROID = 39
+PQ_MIN_BITS = 4
+PQ_MAX_BITS = 8
+IVF_PQ_MIN_VECTORS = TRAINING_VECTORS_PER_CENTROID * 2**PQ_MIN_BITS
+IVF_MAX_PROBES = 16
+PQ_SUB_QUANTIZERS = (64, 48, 32, 24, 16, 8, 4, 2, 1)
+
+HNSW_NEIGHBORS = 32
+HNSW_EF_SEARCH = 64
+
+
+def effective_index_type(index_type, count):
+    """
+    The index type that is built for index_type and count vectors.
+    """
+    if index_type == IVF_PQ and count < IVF_PQ_MIN_VECTORS:
+        return FLAT
+    return index_type
+
+
+def build_faiss_index(index_type, vectors) -> faiss.Index:
+    """
+    Build a faiss index of the given type holding vectors. Trained index types are trained on the vectors.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    count, dimension = vectors.shape
+
+    built_type = effective_index_type(index_type, count)
+    if built_type != index_type:
+        logger.info(f"Only {count} vectors, building a {built_type} index instead")
+
+    index = faiss.index_factory(
+        dimension, _factory_string(built_type, count, dimension)
+    )
+    if not index.is_trained:
+        index.train(vectors)
+
+    if built_type == IVF_PQ:
+        ivf = faiss.extract_index_ivf(index)
+        ivf.nprobe = min(ivf.nlist, IVF_MAX_PROBES)
+        # Keep vectors reconstructable, so segments can be merged and documents removed
+        ivf.make_direct_map()
+    elif built_type == HNSW:
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+
+    index.add(vectors)
+    return index
+
+
+def _factory_string(index_type, count, dimension):
+    if index_type == FLAT:
+        return "Flat"
+    if index_type == SQ8:
+        return "SQ8"
+    if index_type == SQFP16:
+        return "SQfp16"
+    if index_type == IVF_PQ:
+        training_vectors = count // TRAINING_VECTORS_PER_CENTROID
+        lists = max(1, min(int(math.sqrt(count)), training_vectors))
+        bits = min(PQ_MAX_BITS, int(math.log2(training_vectors)))
+        sub_quantizers = next(m for m in PQ_SUB_QUANTIZERS if dimension % m == 0)
+        return f"IVF{lists},PQ{sub_quantizers}x{bits}"
+    if index_type == HNSW:
+        return f"HNSW{HNSW_NEIGHBORS}"
+    raise ValueError(f"Unknown index type: {index_type}")
@@ -0,0 +1,116 @@
+"""
+Counts and per stage timings of document ingests, recorded as IngestionRuns (see games/models.py).
+
+The stages of an ingest overlap: pages are parsed and split in a background thread while earlier sections are
+embedded, and the setup pages are summarized from the start. The seconds of a stage are the time spent in it, so the
+stages of a run can add up to more than its wall time.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+DOWNLOAD = "download"
+PARSE = "parse"
+SPLIT = "split"
+SUMMARIZE = "summarize"
+EMBED = "embed"
+PERSIST = "persist"
+STAGES = [DOWNLOAD, PARSE, SPLIT, SUMMARIZE, EMBED, PERSIST]
+
+
+@dataclass
+class IngestionStats:
+    """
+    Counts of a document ingest and the seconds spent in each of its stages.
+    """
+
+    pages: int = 0
+    sections: int = 0
+    tokens: int = 0  # estimated, see games/embedding_scheduler.py
+    bytes_downloaded: int = 0
+    bytes_uploaded: int = 0
+    seconds: dict = field(default_factory=dict)
+    _lock: threading.Lock = field(
+        default_factory=threading.Lock, repr=False, compare=False
+    )
+
+    @contextmanager
+    def stage(self, name):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_seconds(name, time.perf_counter() - started_at)
+
+    def timed(self, name, iterable):
+        """
+        Yields the items of iterable, adding the time spent producing them to the stage.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                item = next(iterator, _DONE)
+            if item is _DONE:
+                return
+            yield item
+
+    def add(self, other):
+        """
+        Add the counts and stage timings of another ingest.
+        """
+        self.pages += other.pages
+        self.sections += other.sections
+        self.tokens += other.tokens
+        self.bytes_downloaded += other.bytes_downloaded
+        self.bytes_uploaded += other.bytes_uploaded
+        for name, seconds in other.seconds.items():
+            self.add_seconds(name, seconds)
+
+    def add_seconds(self, name, seconds):
+        # Stages are timed in the pipeline thread and the summary thread too
+        with self._lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+
+_DONE = object()
+
+
+def throughput(runs):
+    """
+    Aggregate throughput of ingestion runs: totals, pages, sections and tokens per second of wall time, and the
+    seconds and share of each stage.
+    """
+    runs = list(runs)
+    seconds = sum(run.seconds for run in runs)
+    totals = {
+        name: sum(getattr(run, name) for run in runs)
+        for name in [
+            "pages",
+            "sections",
+            "tokens",
+            "bytes_downloaded",
+            "bytes_uploaded",
+        ]
+    }
+    stage_seconds = {
+        stage: sum(getattr(run, f"{stage}_seconds") for run in runs) for stage in STAGES
+    }
+    stages_total = sum(stage_seconds.values())
+    return {
+        "runs": len(runs),
+        "seconds": seconds,
+        **totals,
+        "pages_per_second": totals["pages"] / seconds if seconds else 0.0,
+        "sections_per_second": totals["sections"] / seconds if seconds else 0.0,
+        "tokens_per_second": totals["tokens"] / seconds if seconds else 0.0,
+        "stages": [
+            {
+                "stage": stage,
+                "seconds": stage_seconds[stage],
+                "share": stage_seconds[stage] / stages_total if stages_total else 0.0,
+            }
+            for stage in STAGES
+        ],
+    }
@@ -0,0 +1,195 @@
+"""
+Lexical BM25 index of the sections of a game index.
+
+Every segment of a game index has a lexical index sidecar file next to its faiss index and docstore, built from the
+same sections when they are ingested. Searching it needs no embedding, so short keyword questions ("clue",
+"victory points") can be answered without a round trip to the embedding API, and it can be fused with the vector
+search to catch exact rule terms that embeddings miss.
+
+The index is an inverted index from terms to the positions of the sections containing them, in faiss index order,
+with the term frequency and length of each section. It is stored as zlib compressed JSON. Segments are merged
+when they are loaded, so the BM25 statistics always cover the whole game index.
+"""
+
+import json
+import math
+import re
+import zlib
+
+import numpy as np
+
+VERSION = 1
+
+# BM25 parameters, the common defaults
+K1 = 1.2
+B = 0.75
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+STOPWORDS = frozenset("""
+    a an and are as at be but by can do does for from has have how i if in into is it its may of on or so such
+    than that the their then there these they this to was were what when where which who why will with you your
+    """.split())
+
+
+def tokenize(text: str) -> list:
+    """
+    Split text into lowercased terms, without stopwords and with plural s endings removed.
+    """
+    return [
+        _stem(token)
+        for token in TOKEN_PATTERN.findall(text.casefold())
+        if token not in STOPWORDS
+    ]
+
+
+def _stem(token):
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+class LexicalIndex:
+    """
+    A BM25 inverted index over the sections of a game index.
+    """
+
+    def __init__(self, ids: list, lengths, postings: dict):
+        # Docstore id of each section, in faiss index order
+        self.ids = ids
+        self.lengths = np.asarray(lengths, dtype=np.float32)
+        # Term to a tuple of (section positions, term frequencies)
+        self.postings = postings
+        self.average_length = float(self.lengths.mean()) if len(ids) else 0.0
+
+    @classmethod
+    def build(cls, ids: list, texts: list):
+        """
+        Build an index of the sections with the given docstore ids and texts.
+        """
+        lengths = []
+        term_positions = {}
+        term_frequencies = {}
+        for position, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                term_positions.setdefault(token, []).append(position)
+                term_frequencies.setdefault(token, []).append(count)
+
+        postings = {
+            term: (
+                np.array(positions, dtype=np.int32),
+                np.array(term_frequencies[term], dtype=np.float32),
+            )
+            for term, positions in term_positions.items()
+        }
+        return cls(list(ids), lengths, postings)
+
+    @classmethod
+    def merge(cls, indexes: list):
+        """
+        Merge indexes, in order, into a new index. Positions of later indexes are offset like merged faiss indexes.
+        """
+        ids = []
+        lengths = []
+        term_postings = {}
+        for index in indexes:
+            offset = len(ids)
+            ids.extend(index.ids)
+            lengths.append(index.lengths)
+            for term, (positions, frequencies) in index.postings.items():
+                term_postings.setdefault(term, []).append(
+                    (positions + offset, frequencies)
+                )
+
+        postings = {
+            term: (
+                np.concatenate([positions for positions, _ in parts]),
+                np.concatenate([frequencies for _, frequencies in parts]),
+            )
+            for term, parts in term_postings.items()
+        }
+        return cls(ids, np.concatenate(lengths) if lengths else np.zeros(0), postings)
+
+    @classmethod
+    def load(cls, data: bytes):
+        payload = json.loads(zlib.decompress(data))
+        if payload["version"] != VERSION:
+            raise ValueError(f"Unsupported lexical index version {payload['version']}")
+
+        postings = {
+            term: (
+                np.array(positions, dtype=np.int32),
+                np.array(frequencies, dtype=np.float32),
+            )
+            for term, (positions, frequencies) in payload["postings"].items()
+        }
+        return cls(payload["ids"], payload["lengths"], postings)
+
+    def serialize(self) -> bytes:
+        return zlib.compress(
+            json.dumps(
+                {
+                    "version": VERSION,
+                    "ids": self.ids,
+                    "lengths": [int(length) for length in self.lengths],
+                    "postings": {
+                        term: [positions.tolist(), frequencies.astype(int).tolist()]
+                        for term, (positions, frequencies) in self.postings.items()
+                    },
+                },
+                separators=(",", ":"),
+            ).encode()
+        )
+
+    def search(self, query: str, k: int = 4) -> list:
+        """
+        Returns up to k (docstore id, BM25 score) tuples of the sections matching the query, best match first.
+        """
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        section_count = len(self.ids)
+
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            positions, frequencies = self.postings[term]
+            document_frequency = len(positions)
+            idf = math.log(
+                1
+                + (section_count - document_frequency + 0.5)
+                / (document_frequency + 0.5)
+            )
+            normalized_lengths = (
+                1 - B + B * self.lengths[positions] / max(self.average_length, 1.0)
+            )
+            scores[positions] += (
+                idf * frequencies * (K1 + 1) / (frequencies + K1 * normalized_lengths)
+            )
+
+        matches = np.flatnonzero(scores)
+        if len(matches) > k:
+            matches = matches[np.argpartition(-scores[matches], k - 1)[:k]]
+        # Sort by score and then position, so ties are stable
+        matches = sorted(matches, key=lambda position: (-scores[position], position))
+        return [(self.ids[position], float(scores[position])) for position in matches]
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def reciprocal_rank_fusion(rankings: list, k: int = 60) -> list:
+    """
+    Fuse rankings, lists of ids best first, into a single list of (id, score) tuples, best first.
+
+    Each ranking contributes 1 / (k + rank) to the score of an id, so ids ranked high by several rankings win
+    without having to make the scores of the rankings comparable.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -1,9 +1,19 @@
-from langchain_community.document_loaders import PyMuPDFLoader
+import hashlib
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.apps import apps
 from langchain_core.documents import Document
 from langchain_openai import ChatOpenAI
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
-from rulesbot.settings import DEFAULT_CHATGPT_MODEL
+from games.loaders.pdf_pages import iter_pages, load_pages
+from rulesbot.settings import (
+    DEFAULT_CHATGPT_MODEL,
+    PDF_EXTRACTION_WORKERS,
+    PDF_PARALLEL_MIN_PAGES,
+)
+
+SETUP_SUMMARY_PROMPT = "Provided are setup instructions for a board game. Please clean them up and summarize them into an easy-to-read format. \n\n{setup_page_content}\n\nSummary:"
 
 
 def load_and_split(filename, document):
@@ -13,6 +23,7 @@ def load_and_split(filename, document):
     :param filename: The filename to load.
     :param document: The document to index.
     :return: A list of sections to index.
+    :raises InvalidPdfError: If the file is not a valid PDF file.
     """
     pages = _load_pages(filename)
 
@@ -35,40 +46,117 @@ def load_and_split(filename, document):
     return sections
 
 
+def stream_sections(filename, document):
+    """
+    Yields the same sections as load_and_split, without the setup section, splitting one page at a time as the
+    pages are extracted by stream_pages.
+
+    :raises InvalidPdfError: If the file is not a valid PDF file, when the first section is requested.
+    """
+    for page in stream_pages(filename):
+        yield from page_sections(page, document)
+
+
+def stream_pages(filename):
+    """
+    Yields the pages of the file one at a time. Large rulebooks have their next pages extracted in the pool of
+    worker processes while the pages are split and embedded.
+    """
+    return iter_pages(
+        filename,
+        workers=PDF_EXTRACTION_WORKERS,
+        parallel_min_pages=PDF_PARALLEL_MIN_PAGES,
+    )
+
+
+def page_sections(page, document):
+    """
+    Split a page, as extracted by iter_pages, into the sections load_and_split has for it. Ignored pages have none.
+    """
+    if document.ignore_pages and page.metadata["page"] in _page_numbers(
+        document.ignore_pages
+    ):
+        return []
+    # Pages are split independently, so splitting them one by one gives the same sections
+    return _section_splitter().split_documents([page])
+
+
+def load_setup_pages(filename, setup_pages):
+    """
+    Extract only the setup pages of the file, setup_pages being the comma separated page numbers of a document.
+    """
+    return list(iter_pages(filename, _page_numbers(setup_pages)))
+
+
+def start_setup_summary(setup_pages, executor) -> Future:
+    """
+    Returns a future of the summary of the setup pages. It is done right away if the same setup text has been
+    summarized before, otherwise the setup pages are summarized by the executor. Pass it to setup_document.
+    """
+    setup_page_content = _setup_page_content(setup_pages)
+    summary = _cached_setup_summary(setup_page_content)
+    if summary is None:
+        return executor.submit(_summarize_setup_instructions, setup_page_content)
+    future = Future()
+    future.set_result(summary)
+    return future
+
+
+def setup_document(setup_pages, summary: Future) -> Document:
+    """
+    Waits for the summary started by start_setup_summary and returns the setup section.
+    """
+    setup_metadata = setup_pages[0].metadata.copy()
+    setup_metadata["setup_page"] = True
+    summarized_page_content = summary.result()
+    _store_setup_summary(_setup_page_content(setup_pages), summarized_page_content)
+    return Document(page_content=summarized_page_content, metadata=setup_metadata)
+
+
 def _load_pages(filename):
-    loader = PyMuPDFLoader(filename)
-    return loader.load()
+    # Validates the PDF file while extracting the pages, so the file is only parsed once.
+    # Large rulebooks have their pages extracted in parallel in a pool of worker processes.
+    return load_pages(
+        filename,
+        workers=PDF_EXTRACTION_WORKERS,
+        parallel_min_pages=PDF_PARALLEL_MIN_PAGES,
+    )
 
 
 def _split_pages_to_sections(pages):
     # At this point we have split the pdf into pages, but they can often be too large to send to the model so lets split into smaller chunks
-    sections = RecursiveCharacterTextSplitter(
-        chunk_size=1000, chunk_overlap=100
-    ).split_documents(pages)
+    sections = _section_splitter().split_documents(pages)
     return sections
 
 
+def _section_splitter():
+    return RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+
+
+def _page_numbers(pages):
+    # Comma separated 1-indexed page numbers to 0-indexed page numbers
+    return [int(x) - 1 for x in pages.split(",")]
+
+
 def _remove_ignore_pages(pages, pages_to_ignore):
-    ignore_page_numbers = [int(x) for x in pages_to_ignore.split(",")]
-    ignore_page_numbers = [x - 1 for x in ignore_page_numbers]  # 1-indexed to 0-indexed
+    ignore_page_numbers = _page_numbers(pages_to_ignore)
     return [page for page in pages if page.metadata["page"] not in ignore_page_numbers]
 
 
 def _extract_setup_instructions(pages, setup_pages):
-    setup_page_numbers = [int(x) for x in setup_pages.split(",")]
-    setup_page_numbers = [x - 1 for x in setup_page_numbers]  # 1-indexed to 0-indexed
+    setup_page_numbers = _page_numbers(setup_pages)
     setup_pages = [
         page for page in pages if page.metadata["page"] in setup_page_numbers
     ]
 
-    setup_metadata = setup_pages[0].metadata.copy()
-    setup_metadata["setup_page"] = True
-    setup_page_content = "Start of game setup instructions:\n\n"
-    setup_page_content += "\n".join([page.page_content for page in setup_pages])
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return setup_document(setup_pages, start_setup_summary(setup_pages, executor))
 
-    summarized_page_content = _summarize_setup_instructions(setup_page_content)
 
-    return Document(page_content=summarized_page_content, metadata=setup_metadata)
+def _setup_page_content(setup_pages):
+    setup_page_content = "Start of game setup instructions:\n\n"
+    setup_page_content += "\n".join([page.page_content for page in setup_pages])
+    return setup_page_content
 
 
 def _summarize_setup_instructions(setup_page_content):
@@ -76,10 +164,48 @@ def _summarize_setup_instructions(setup_page_content):
     Use ChatGPT to summarize the setup instructions.
     """
     llm = ChatOpenAI(temperature=0.1, model=DEFAULT_CHATGPT_MODEL)
-    prompt = f"Provided are setup instructions for a board game. Please clean them up and summarize them into an easy-to-read format. \n\n{setup_page_content}\n\nSummary:"
+    prompt = SETUP_SUMMARY_PROMPT.format(setup_page_content=setup_page_content)
     return str(llm.invoke(prompt).content)
 
 
+def _setup_summary_key(setup_page_content):
+    # Changing the model or the prompt changes the summary, so they are part of the key
+    key = "\0".join([DEFAULT_CHATGPT_MODEL, SETUP_SUMMARY_PROMPT, setup_page_content])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def _cached_setup_summary(setup_page_content):
+    """
+    Returns the summary of the same setup text by the same model and prompt from an earlier ingest, or None.
+    """
+    return (
+        _setup_summary_model()
+        .objects.filter(key=_setup_summary_key(setup_page_content))
+        .values_list("summary", flat=True)
+        .first()
+    )
+
+
+def _store_setup_summary(setup_page_content, summary):
+    setup_summary_model = _setup_summary_model()
+    # Another ingest of the same setup pages may have stored it first
+    setup_summary_model.objects.bulk_create(
+        [
+            setup_summary_model(
+                key=_setup_summary_key(setup_page_content),
+                model=DEFAULT_CHATGPT_MODEL,
+                summary=summary,
+            )
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def _setup_summary_model():
+    # games.models imports the vector store, so look the model up lazily like the embedding cache
+    return apps.get_model("games", "SetupSummary")
+
+
 def _clean_up_page(page_content):
     """
     Use ChatGPT to clean up the content.
@@ -0,0 +1,311 @@
+"""
+Validate a PDF file and extract its pages in a single pass with PyMuPDF.
+
+The pages are the same langchain Documents as PyMuPDFLoader produces (page text and metadata), but the file is only
+opened once, and files that are not readable PDFs raise an InvalidPdfError saying why, instead of failing somewhere
+inside the loader.
+
+Extracting the text of large rulebooks can be spread over a pool of processes, each extracting a range of pages.
+The file is validated and its metadata read in the calling process, so the pages are the same as when extracting
+them serially. iter_pages yields the pages one at a time for the streaming ingestion pipeline. Large files are
+streamed from the same pool, which extracts a few page ranges ahead of the pipeline, so only those ranges of text
+are held at a time.
+"""
+
+import logging
+import math
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from multiprocessing import get_context
+
+import pymupdf
+from langchain_core.documents import Document
+
+# InvalidPdfError reasons
+NOT_A_PDF = "not_a_pdf"
+DAMAGED = "damaged"
+ENCRYPTED = "encrypted"
+NO_PAGES = "no_pages"
+
+# PDF files start with a %PDF- header, readers accept it anywhere in the first 1024 bytes
+PDF_HEADER = b"%PDF-"
+HEADER_SEARCH_BYTES = 1024
+
+# Page ranges per worker process, more than one so a slow range does not hold up the others
+RANGES_PER_WORKER = 2
+
+# Streamed files are split in ranges of at most this many pages, so the pipeline gets its first pages early
+STREAM_RANGE_MAX_PAGES = 50
+
+# PyMuPDF is not thread safe, langchain's PyMuPDFParser serializes parsing the same way
+_lock = threading.Lock()
+
+_executor = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidPdfError(ValueError):
+    """
+    The file is not a PDF we can extract pages from. reason is one of the reasons above.
+    """
+
+    def __init__(self, reason, detail, page=None):
+        self.reason = reason
+        self.detail = detail
+        self.page = page
+        super().__init__(f"Invalid PDF file: {detail}")
+
+    def __reduce__(self):
+        # Raised in the extraction worker processes, so it has to survive pickling
+        return (self.__class__, (self.reason, self.detail, self.page))
+
+
+def load_pages(filename, workers=1, parallel_min_pages=0) -> list:
+    """
+    Validate the PDF file and return a Document per page, numbered from 0 like PyMuPDFLoader.
+
+    With more than one worker, files of at least parallel_min_pages pages have their page text extracted in a pool
+    of worker processes, smaller files are extracted serially in this process.
+
+    Raises InvalidPdfError if the file is not a PDF, is damaged, is password protected or has no pages.
+    """
+    pdf, metadata = _open_validated(filename)
+    texts = None
+    with pdf:
+        page_count = pdf.page_count
+        if workers <= 1 or page_count < parallel_min_pages:
+            with _lock:
+                texts = _page_texts(pdf, 0, page_count)
+
+    if texts is None:
+        texts = _parallel_page_texts(filename, page_count, workers)
+
+    return [
+        Document(page_content=text, metadata={**metadata, "page": number})
+        for number, text in enumerate(texts)
+    ]
+
+
+def iter_pages(filename, page_numbers=None, workers=1, parallel_min_pages=0):
+    """
+    Validate the PDF file and yield the same Documents as load_pages one page at a time, so only the page being
+    processed is held in memory. With page_numbers, only those pages are extracted, in page order.
+
+    With more than one worker, all pages of files of at least parallel_min_pages pages are extracted in the pool of
+    worker processes, at most RANGES_PER_WORKER page ranges per worker ahead of the pages yielded.
+
+    Raises InvalidPdfError like load_pages, when the first page is requested.
+    """
+    pdf, metadata = _open_validated(filename)
+    with pdf:
+        page_count = pdf.page_count
+        parallel = (
+            page_numbers is None and workers > 1 and page_count >= parallel_min_pages
+        )
+        if not parallel:
+            if page_numbers is None:
+                numbers = range(page_count)
+            else:
+                numbers = sorted(
+                    number for number in set(page_numbers) if 0 <= number < page_count
+                )
+            for number in numbers:
+                # Only hold the lock while extracting, the consumer of the pages may take a while
+                with _lock:
+                    [text] = _page_texts(pdf, number, number + 1)
+                yield Document(page_content=text, metadata={**metadata, "page": number})
+
+    if parallel:
+        texts = _iter_parallel_page_texts(filename, page_count, workers)
+        for number, text in enumerate(texts):
+            yield Document(page_content=text, metadata={**metadata, "page": number})
+
+
+def extract_page_range(filename, start, stop) -> list:
+    """
+    Returns the text of pages start to stop of an already validated PDF file. Runs in the worker processes.
+    """
+    with _lock:
+        with _open(filename) as pdf:
+            return _page_texts(pdf, start, stop)
+
+
+def _open_validated(filename):
+    """
+    Open and validate the PDF file, returns the open file and the metadata of its pages.
+    """
+    with open(filename, "rb") as file:
+        if PDF_HEADER not in file.read(HEADER_SEARCH_BYTES):
+            raise InvalidPdfError(NOT_A_PDF, "the file is not a PDF file")
+
+    with _lock:
+        pdf = _open(filename)
+        try:
+            if pdf.needs_pass:
+                raise InvalidPdfError(ENCRYPTED, "the file is password protected")
+            if pdf.page_count == 0:
+                raise InvalidPdfError(NO_PAGES, "the file has no readable pages")
+            return pdf, document_metadata(pdf, str(filename))
+        except Exception:
+            pdf.close()
+            raise
+
+
+def _open(filename):
+    try:
+        return pymupdf.open(filename, filetype="pdf")
+    except (pymupdf.FileDataError, RuntimeError) as e:
+        raise InvalidPdfError(DAMAGED, f"the file could not be opened: {e}") from e
+
+
+def _page_texts(pdf, start, stop):
+    texts = []
+    for number in range(start, stop):
+        try:
+            texts.append(pdf[number].get_text().strip())
+        except RuntimeError as e:
+            raise InvalidPdfError(
+                DAMAGED, f"page {number + 1} could not be read: {e}", page=number
+            ) from e
+    return texts
+
+
+def _parallel_page_texts(filename, page_count, workers):
+    ranges = _page_ranges(page_count, workers * RANGES_PER_WORKER)
+    try:
+        executor = _get_executor(workers)
+        futures = [
+            executor.submit(extract_page_range, str(filename), start, stop)
+            for start, stop in ranges
+        ]
+        return [text for future in futures for text in future.result()]
+    except BrokenProcessPool:
+        # A worker died, e.g. killed for using too much memory. Start a new pool next time and extract serially.
+        logger.warning(
+            "PDF extraction pool broke, extracting %s serially", filename, exc_info=True
+        )
+        _shutdown_executor()
+        return extract_page_range(filename, 0, page_count)
+
+
+def _iter_parallel_page_texts(filename, page_count, workers):
+    """
+    Yields the page texts in page order, while the pool extracts the next page ranges.
+    """
+    count = max(
+        workers * RANGES_PER_WORKER, math.ceil(page_count / STREAM_RANGE_MAX_PAGES)
+    )
+    ranges = deque(_page_ranges(page_count, count))
+    pending = deque()
+    next_page = 0
+    try:
+        executor = _get_executor(workers)
+        while ranges or pending:
+            while ranges and len(pending) < workers * RANGES_PER_WORKER:
+                start, stop = ranges.popleft()
+                pending.append(
+                    executor.submit(extract_page_range, str(filename), start, stop)
+                )
+            for text in pending.popleft().result():
+                yield text
+                next_page += 1
+    except BrokenProcessPool:
+        # Like _parallel_page_texts, but only the pages not yielded yet are extracted serially
+        logger.warning(
+            "PDF extraction pool broke, extracting %s serially from page %s",
+            filename,
+            next_page + 1,
+            exc_info=True,
+        )
+        _shutdown_executor()
+        for start in range(next_page, page_count, STREAM_RANGE_MAX_PAGES):
+            yield from extract_page_range(
+                filename, start, min(start + STREAM_RANGE_MAX_PAGES, page_count)
+            )
+    finally:
+        # The consumer stopped early or failed, do not extract pages no one will read
+        for future in pending:
+            future.cancel()
+
+
+def _page_ranges(page_count, count):
+    """
+    Split the pages into at most count contiguous ranges of about the same size.
+    """
+    count = max(1, min(count, page_count))
+    size, remainder = divmod(page_count, count)
+    ranges = []
+    start = 0
+    for index in range(count):
+        stop = start + size + (1 if index < remainder else 0)
+        ranges.append((start, stop))
+        start = stop
+    return ranges
+
+
+def _get_executor(workers):
+    """
+    The process pool is started on first use and shared by all extractions in this process. Worker processes are
+    spawned rather than forked, as forking a process running threads (gunicorn, langchain) can deadlock.
+    """
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=get_context("spawn")
+            )
+            _executor_workers = workers
+        return _executor
+
+
+def _shutdown_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+
+
+def document_metadata(pdf, source) -> dict:
+    """
+    The document level metadata of every page, with the same keys and values as PyMuPDFLoader.
+    """
+    metadata = {
+        "producer": "PyMuPDF",
+        "creator": "PyMuPDF",
+        "creationdate": "",
+        "source": source,
+        "file_path": source,
+        "total_pages": pdf.page_count,
+    }
+    for key, value in pdf.metadata.items():
+        if not isinstance(value, (str, int)):
+            continue
+        key = key.lower()
+        if key in ("creationdate", "moddate"):
+            value = _iso_date(value)
+        elif isinstance(value, str):
+            value = value.strip()
+        metadata[key] = value
+    # PyMuPDFLoader also keeps the raw dates under their PyMuPDF names
+    for key in ("modDate", "creationDate"):
+        if key in pdf.metadata:
+            metadata[key] = pdf.metadata[key]
+    return metadata
+
+
+def _iso_date(value):
+    # PDF dates look like D:20240101120000+01'00'
+    try:
+        date = datetime.strptime(value.replace("'", ""), "D:%Y%m%d%H%M%S%z")
+    except ValueError:
+        return value
+    return date.isoformat("T")
@@ -0,0 +1,224 @@
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from games.embedding_cache import embedding_cache
+from games.ingestion_stats import IngestionStats
+from games.models import Game
+from games.services.ingestion_job_service import heartbeat, run_job, start_job
+
+DONE = "done"
+FAILED = "failed"
+
+
+class Command(BaseCommand):
+    help = (
+        "Create and ingest the games of manifest files in the shape of the tests/fixtures/evaluate_rulesbot "
+        "fixtures, a game object or a list of game objects per file. Games are ingested in parallel and recorded in "
+        "a checkpoint file as they finish, so an interrupted run can be resumed by running the command again. Each "
+        "game is ingested as a running ingestion job, so ingestion workers do not run jobs of the same game meanwhile."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("manifests", nargs="+", type=Path)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Number of games to ingest concurrently",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            type=Path,
+            default=Path("bulk_ingest_checkpoint.json"),
+            help="File recording the games that have been ingested",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore the checkpoint and ingest all games of the manifests",
+        )
+
+    def handle(self, *args, **options):
+        games = self._read_manifests(options["manifests"])
+        self.checkpoint_path = options["checkpoint"]
+        self.checkpoint = (
+            {} if options["restart"] else self._read_checkpoint(self.checkpoint_path)
+        )
+        self.checkpoint_lock = threading.Lock()
+
+        pending = [
+            game
+            for game in games
+            if self.checkpoint.get(game["name"], {}).get("status") != DONE
+        ]
+        self.stdout.write(
+            f"{len(games)} games in the manifests, {len(games) - len(pending)} already ingested, "
+            f"ingesting {len(pending)} with {options['workers']} workers"
+        )
+
+        self.worker = f"bulk_ingest:{socket.gethostname()}:{os.getpid()}"
+        self.stop = threading.Event()
+        heartbeat_thread = threading.Thread(target=self._heartbeat, daemon=True)
+        heartbeat_thread.start()
+
+        embedding_stats = embedding_cache.stats()
+        started_at = time.perf_counter()
+        try:
+            if options["workers"] > 1:
+                with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+                    results = list(executor.map(self._ingest_in_thread, pending))
+            else:
+                results = [self._ingest(game) for game in pending]
+        finally:
+            self.stop.set()
+            heartbeat_thread.join()
+        elapsed = time.perf_counter() - started_at
+
+        self._print_summary(results, elapsed, embedding_stats)
+
+    def _read_manifests(self, paths):
+        games = []
+        for path in paths:
+            try:
+                manifest = json.loads(path.read_text())
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Could not read manifest {path}: {e}")
+            games.extend(manifest if isinstance(manifest, list) else [manifest])
+
+        names = [game.get("name") for game in games]
+        if not all(names):
+            raise CommandError("Every game in the manifests needs a name")
+        if len(set(names)) != len(names):
+            raise CommandError("Game names in the manifests must be unique")
+        return games
+
+    def _read_checkpoint(self, path):
+        if not path.exists():
+            return {}
+        return json.loads(path.read_text())
+
+    def _write_checkpoint(self, name, entry):
+        with self.checkpoint_lock:
+            self.checkpoint[name] = entry
+            # Write and rename, so a crash never leaves a truncated checkpoint behind
+            temporary_path = self.checkpoint_path.with_name(
+                self.checkpoint_path.name + ".tmp"
+            )
+            temporary_path.write_text(json.dumps(self.checkpoint, indent=2))
+            os.replace(temporary_path, self.checkpoint_path)
+
+    def _ingest(self, manifest_game):
+        """
+        Create or update the game and its documents and ingest them. A game that fails, or has a running job of
+        an ingestion worker, is recorded as failed and does not affect the other games.
+        """
+        name = manifest_game["name"]
+        stats = IngestionStats()
+        started_at = time.perf_counter()
+        game = None
+        error = ""
+        try:
+            game = self._setup_game(manifest_game)
+            job = start_job(game, self.worker)
+            if job is None:
+                error = "The game has a running ingestion job"
+            else:
+                # Failures are recorded on the job, see run_job
+                job = run_job(job, stats=stats)
+                error = job.error
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        if error:
+            result = {"status": FAILED, "error": error}
+            self.stderr.write(f"Failed to ingest {name}: {error}")
+        else:
+            result = {"status": DONE}
+            self.stdout.write(f"Ingested {name} ({game.id})")
+        result.update(
+            pages=stats.pages,
+            chunks=stats.sections,
+            game_id=game and game.id,
+            seconds=round(time.perf_counter() - started_at, 3),
+        )
+        self._write_checkpoint(name, result)
+        return result
+
+    def _ingest_in_thread(self, manifest_game):
+        try:
+            return self._ingest(manifest_game)
+        finally:
+            connection.close()
+
+    def _heartbeat(self):
+        # The running jobs of the command would otherwise be queued again by the ingestion workers
+        try:
+            while not self.stop.wait(settings.INGESTION_JOB_HEARTBEAT_SECONDS):
+                heartbeat(self.worker)
+        finally:
+            connection.close()
+
+    def _setup_game(self, manifest_game):
+        # Resume with the game created by an earlier run, or a game of the same name that already exists
+        game_id = self.checkpoint.get(manifest_game["name"], {}).get("game_id")
+        game = Game.objects.filter(pk=game_id).first() if game_id else None
+        game = game or Game.objects.filter(name=manifest_game["name"]).first()
+        game = game or Game.objects.create(name=manifest_game["name"])
+
+        for manifest_document in manifest_game["documents"]:
+            values = {
+                "ignore_pages": manifest_document.get("ignore_pages", ""),
+                "setup_pages": manifest_document.get("setup_pages", ""),
+            }
+            document, created = game.document_set.get_or_create(
+                url=manifest_document["url"],
+                defaults={
+                    **values,
+                    "display_name": manifest_document.get("display_name", ""),
+                },
+            )
+            # Documents with changed pages have to be ingested again, like when they are changed in the admin
+            if not created and any(
+                (getattr(document, field) or "") != value
+                for field, value in values.items()
+            ):
+                for field, value in values.items():
+                    setattr(document, field, value)
+                document.ingested = False
+                document.save()
+        return game
+
+    def _print_summary(self, results, elapsed, embedding_stats_before):
+        done = [result for result in results if result["status"] == DONE]
+        failed = [result for result in results if result["status"] == FAILED]
+        pages = sum(result["pages"] for result in results)
+        chunks = sum(result["chunks"] for result in results)
+        # The embedding cache counts every chunk, misses are the chunks sent to the embedding model
+        embedding_stats = embedding_cache.stats()
+        embedded = embedding_stats["misses"] - embedding_stats_before["misses"]
+        cached = embedding_stats["hits"] - embedding_stats_before["hits"]
+
+        style = self.style.SUCCESS if not failed else self.style.WARNING
+        self.stdout.write(
+            style(
+                f"Ingested {len(done)} games, failed {len(failed)} in {elapsed:.1f}s: "
+                f"{pages} pages, {chunks} chunks, {embedded} embeddings ({cached} from the embedding cache)"
+            )
+        )
+        if elapsed > 0:
+            self.stdout.write(
+                f"Throughput: {pages / elapsed:.1f} pages/s, {chunks / elapsed:.1f} chunks/s, "
+                f"{embedded / elapsed:.1f} embeddings/s"
+            )
+        if failed:
+            self.stdout.write(
+                f"Run the command again to retry the failed games, see {self.checkpoint_path}"
+            )
@@ -0,0 +1,121 @@
+import os
+import signal
+import socket
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from games.services.ingestion_job_service import (
+    claim_next_job,
+    heartbeat,
+    requeue_stale_jobs,
+    run_job,
+)
+from games.vectorstores import delete_superseded_files
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued ingestion jobs, enqueued by the game admin actions. Runs until stopped with SIGTERM or SIGINT, "
+        "which lets the running jobs finish first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=settings.INGESTION_WORKER_CONCURRENCY,
+            help="Number of jobs to run concurrently",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=settings.INGESTION_WORKER_POLL_SECONDS,
+            help="Seconds to wait before checking for new jobs when the queue is empty",
+        )
+        parser.add_argument(
+            "--burst",
+            action="store_true",
+            help="Exit once there are no more queued jobs, instead of waiting for new jobs",
+        )
+
+    def handle(self, *args, **options):
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self.stop = threading.Event()
+        previous_handlers = {
+            signum: signal.signal(signum, self._request_stop)
+            for signum in (signal.SIGTERM, signal.SIGINT)
+        }
+        try:
+            self._run(options)
+        finally:
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+
+    def _run(self, options):
+        self.stdout.write(
+            f"Ingestion worker {self.worker} running {options['concurrency']} jobs concurrently"
+        )
+        heartbeat_thread = threading.Thread(target=self._heartbeat, daemon=True)
+        heartbeat_thread.start()
+
+        if options["concurrency"] > 1:
+            threads = [
+                threading.Thread(
+                    target=self._work_in_thread,
+                    args=(options["poll_interval"], options["burst"]),
+                )
+                for _ in range(options["concurrency"])
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        else:
+            self._work(options["poll_interval"], options["burst"])
+
+        self.stop.set()
+        heartbeat_thread.join()
+        self.stdout.write(self.style.SUCCESS(f"Ingestion worker {self.worker} stopped"))
+
+    def _work(self, poll_interval, burst):
+        while not self.stop.is_set():
+            requeued = requeue_stale_jobs()
+            if requeued:
+                self.stdout.write(f"Queued {requeued} jobs of dead workers again")
+            deleted = delete_superseded_files()
+            if deleted:
+                self.stdout.write(f"Deleted {deleted} superseded index files")
+
+            job = claim_next_job(self.worker)
+            if job is None:
+                if burst:
+                    return
+                self.stop.wait(poll_interval)
+                continue
+
+            self.stdout.write(f"Running job {job.id}: {job}")
+            job = run_job(job)
+            self.stdout.write(
+                f"Finished job {job.id} in {job.duration_seconds:.1f}s: {job.get_state_display()}"
+                + (f", {job.error}" if job.error else "")
+            )
+
+    def _work_in_thread(self, poll_interval, burst):
+        try:
+            self._work(poll_interval, burst)
+        finally:
+            connection.close()
+
+    def _heartbeat(self):
+        try:
+            while not self.stop.wait(settings.INGESTION_JOB_HEARTBEAT_SECONDS):
+                heartbeat(self.worker)
+        finally:
+            connection.close()
+
+    def _request_stop(self, signum, frame):
+        self.stdout.write("Stopping after the running jobs finish")
+        self.stop.set()
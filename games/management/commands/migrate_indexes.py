@@ -0,0 +1,95 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from games import index_formats
+from games.models import Game
+
+
+class Command(BaseCommand):
+    help = (
+        "Rewrite game indexes stored as legacy pickles in the current "
+        "split format. Games that are already migrated are skipped, so an interrupted run can be resumed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only list the games that would be migrated",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Number of games to migrate concurrently",
+        )
+        parser.add_argument(
+            "--no-verify",
+            action="store_true",
+            help="Do not load the rewritten index back and compare it to the original before deleting the original",
+        )
+
+    def handle(self, *args, **options):
+        games = list(
+            Game.objects.exclude(faiss_file="")
+            .exclude(faiss_file=None)
+            .exclude(index_format_version=index_formats.SPLIT_FORMAT_VERSION)
+            .order_by("id")
+        )
+        self.stdout.write(f"{len(games)} game indexes to migrate")
+
+        if options["dry_run"]:
+            for game in games:
+                self.stdout.write(f"{game} ({game.id}): {self._describe_index(game)}")
+            return
+
+        started_at = time.perf_counter()
+        verify = not options["no_verify"]
+        if options["workers"] > 1:
+            with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+                results = list(
+                    executor.map(
+                        lambda game: self._migrate_in_thread(game, verify), games
+                    )
+                )
+        else:
+            results = [self._migrate(game, verify) for game in games]
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Migrated {results.count('migrated')}, recorded {results.count('recorded')} "
+                f"already migrated and failed {results.count('failed')} game indexes "
+                f"in {time.perf_counter() - started_at:.1f}s"
+            )
+        )
+
+    def _migrate(self, game, verify):
+        try:
+            if game.vector_store.upgrade_format(verify=verify):
+                self.stdout.write(f"Migrated {game} ({game.id})")
+                return "migrated"
+            return "recorded"
+        except Exception as e:
+            self.stderr.write(f"Failed to migrate {game} ({game.id}): {e}")
+            return "failed"
+
+    def _migrate_in_thread(self, game, verify):
+        try:
+            return self._migrate(game, verify)
+        finally:
+            connection.close()
+
+    def _describe_index(self, game):
+        with game.faiss_file.open("rb") as file:
+            data = file.read()
+        manifest = index_formats.parse_manifest(data)
+        if manifest is not None:
+            return f"split format version {manifest['version']}"
+        if b"langchain.docstore" in data:
+            return (
+                f"legacy pickle with langchain.docstore module paths, {len(data)} bytes"
+            )
+        return f"legacy pickle, {len(data)} bytes"
@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from games.index_cache import index_cache
+from games.prewarm import prewarm
+
+
+class Command(BaseCommand):
+    help = "Load the indexes of the most popular games, filling the local index cache shared by the workers on this host"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--games",
+            type=int,
+            default=settings.VECTOR_STORE_PREWARM_GAMES,
+            help="Number of games to prewarm",
+        )
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.VECTOR_STORE_PREWARM_DAYS,
+            help="Rank games by the number of chat sessions in this many days",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=settings.VECTOR_STORE_PREWARM_WORKERS,
+            help="Number of indexes to load concurrently",
+        )
+
+    def handle(self, *args, **options):
+        loaded = prewarm(
+            limit=options["games"],
+            days=options["days"],
+            max_workers=options["workers"],
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Prewarmed {loaded} game indexes, local index cache: {index_cache.stats()}"
+            )
+        )
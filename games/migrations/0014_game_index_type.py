@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("games", "0013_embeddingcacheentry"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="game",
+            name="index_type",
+            field=models.CharField(
+                blank=True,
+                choices=[
+                    ("flat", "Flat"),
+                    ("sq8", "Scalar quantized (8 bit)"),
+                    ("sqfp16", "Scalar quantized (float16)"),
+                    ("ivf_pq", "IVF-PQ"),
+                    ("hnsw", "HNSW"),
+                ],
+                default="",
+                max_length=20,
+            ),
+        ),
+    ]
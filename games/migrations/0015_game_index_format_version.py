@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("games", "0014_game_index_type"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="game",
+            name="index_format_version",
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+    ]
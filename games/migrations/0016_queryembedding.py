@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:01
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("games", "0015_game_index_format_version"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="QueryEmbedding",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("model", models.CharField(max_length=200)),
+                ("dimension", models.IntegerField()),
+                ("query_hash", models.CharField(max_length=64)),
+                ("vector", models.BinaryField()),
+                (
+                    "embedded_at",
+                    models.DateTimeField(
+                        db_index=True, default=django.utils.timezone.now
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("model", "dimension", "query_hash"),
+                        name="unique_query_embedding",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("games", "0016_queryembedding"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="document",
+            name="source_etag",
+            field=models.CharField(blank=True, default="", max_length=500),
+        ),
+        migrations.AddField(
+            model_name="document",
+            name="source_last_modified",
+            field=models.CharField(blank=True, default="", max_length=100),
+        ),
+    ]
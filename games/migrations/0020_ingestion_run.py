@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("games", "0019_setup_summary"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IngestionRun",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "outcome",
+                    models.CharField(
+                        choices=[
+                            ("ingested", "Ingested"),
+                            ("unchanged", "Unchanged"),
+                            ("failed", "Failed"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("error", models.TextField(blank=True, default="")),
+                ("seconds", models.FloatField(default=0)),
+                ("download_seconds", models.FloatField(default=0)),
+                ("parse_seconds", models.FloatField(default=0)),
+                ("split_seconds", models.FloatField(default=0)),
+                ("summarize_seconds", models.FloatField(default=0)),
+                ("embed_seconds", models.FloatField(default=0)),
+                ("persist_seconds", models.FloatField(default=0)),
+                ("pages", models.PositiveIntegerField(default=0)),
+                ("sections", models.PositiveIntegerField(default=0)),
+                ("tokens", models.PositiveIntegerField(default=0)),
+                ("bytes_downloaded", models.PositiveBigIntegerField(default=0)),
+                ("bytes_uploaded", models.PositiveBigIntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True, db_index=True)),
+                (
+                    "document",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ingestion_runs",
+                        to="games.document",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-created_at"],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("games", "0020_ingestion_run"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="game",
+            name="embedding_backend",
+            field=models.CharField(
+                blank=True,
+                choices=[
+                    ("openai", "OpenAI"),
+                    ("hashed", "Local hashed n-grams"),
+                    ("fake", "Fake (tests only)"),
+                ],
+                default="",
+                max_length=20,
+            ),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 14:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("games", "0022_supersededindexfile"),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name="ingestionjob",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("state", "running")),
+                fields=("game",),
+                name="one_running_ingestion_job_per_game",
+            ),
+        ),
+    ]
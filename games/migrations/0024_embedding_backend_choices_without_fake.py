@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 14:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("games", "0023_one_running_ingestion_job_per_game"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="game",
+            name="embedding_backend",
+            field=models.CharField(
+                blank=True,
+                choices=[("openai", "OpenAI"), ("hashed", "Local hashed n-grams")],
+                default="",
+                max_length=20,
+            ),
+        ),
+    ]
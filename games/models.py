@@ -1,7 +1,11 @@
 from django.db import models
 from django.template.defaultfilters import slugify
+from django.utils import timezone
 from django_resized import ResizedImageField
 
+from games.embedding_backends import EMBEDDING_BACKEND_CHOICES
+from games.index_types import INDEX_TYPE_CHOICES
+from games.ingestion_stats import STAGES
 from games.vectorstores import GameVectorStore
 
 
@@ -20,6 +24,15 @@ class Game(models.Model):
     faiss_file = models.FileField(
         upload_to="games/faiss_indexes", null=True, blank=True
     )
+    index_format_version = models.PositiveSmallIntegerField(
+        null=True, blank=True
+    )  # Split format version of faiss_file, empty for legacy pickled indexes that have not been migrated
+    index_type = models.CharField(
+        max_length=20, choices=INDEX_TYPE_CHOICES, blank=True, default=""
+    )  # Empty to use settings.VECTOR_STORE_INDEX_TYPE
+    embedding_backend = models.CharField(
+        max_length=20, choices=EMBEDDING_BACKEND_CHOICES, blank=True, default=""
+    )  # Empty to use settings.EMBEDDING_BACKEND
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -61,6 +74,10 @@ class Document(models.Model):
         max_length=500, null=True, blank=True
     )  # Comma separated list of pages to use for setup
 
+    # HTTP validators of the last download from url, used to skip downloading unchanged rulebooks
+    source_etag = models.CharField(max_length=500, blank=True, default="")
+    source_last_modified = models.CharField(max_length=100, blank=True, default="")
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -70,3 +87,221 @@ class Document(models.Model):
     @property
     def display_url(self):
         return self.public_url or self.url
+
+
+class EmbeddingCacheEntry(models.Model):
+    """
+    A cached embedding of a chunk of text. See games/embedding_cache.py
+    """
+
+    model = models.CharField(max_length=200)
+    dimension = models.IntegerField()  # 0 means the default dimension of the model
+    text_hash = models.CharField(max_length=64)  # sha256 hex digest of the text
+    vector = models.BinaryField()  # float32 values
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["model", "dimension", "text_hash"],
+                name="unique_embedding_cache_entry",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.model} ({self.dimension}) {self.text_hash}"
+
+
+class SetupSummary(models.Model):
+    """
+    A cached summary of the setup pages of a document. See games/loaders/pdf_loader_and_summarizer.py
+    """
+
+    key = models.CharField(
+        max_length=64, unique=True
+    )  # sha256 hex digest of the model, the prompt and the setup text
+    model = models.CharField(max_length=200)
+    summary = models.TextField()
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.model} {self.key}"
+
+
+class QueryEmbedding(models.Model):
+    """
+    A cached embedding of a normalized question. See games/embedding_cache.py
+    """
+
+    model = models.CharField(max_length=200)
+    dimension = models.IntegerField()  # 0 means the default dimension of the model
+    query_hash = models.CharField(max_length=64)  # sha256 hex digest of the query
+    vector = models.BinaryField()  # float32 values
+
+    embedded_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["model", "dimension", "query_hash"],
+                name="unique_query_embedding",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.model} ({self.dimension}) {self.query_hash}"
+
+
+class SupersededIndexFile(models.Model):
+    """
+    An index file in storage that its game no longer points to, deleted once other processes are done loading it.
+    See games/vectorstores.py
+    """
+
+    name = models.CharField(max_length=500)
+    superseded_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return self.name
+
+
+class IngestionJob(models.Model):
+    """
+    A queued ingestion of the documents of a game, run by the ingestion_worker management command.
+    See games/services/ingestion_job_service.py
+    """
+
+    INGEST = "ingest"
+    REFRESH = "refresh"
+    REINGEST_ALL = "reingest_all"
+    KIND_CHOICES = [
+        (INGEST, "Ingest new and changed documents"),
+        (REFRESH, "Re-ingest documents changed at their url"),
+        (REINGEST_ALL, "Re-ingest all documents"),
+    ]
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    STATE_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (SUCCEEDED, "Succeeded"),
+        (FAILED, "Failed"),
+    ]
+
+    game = models.ForeignKey(Game, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default=INGEST)
+    state = models.CharField(
+        max_length=20, choices=STATE_CHOICES, default=QUEUED, db_index=True
+    )
+
+    documents_total = models.PositiveIntegerField(default=0)
+    documents_done = models.PositiveIntegerField(default=0)
+    documents_changed = models.PositiveIntegerField(default=0)
+    step = models.CharField(
+        max_length=500, blank=True, default=""
+    )  # What the job is doing right now
+    error = models.TextField(blank=True, default="")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    worker = models.CharField(
+        max_length=200, blank=True, default=""
+    )  # host:pid of the worker running the job
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(
+        null=True, blank=True
+    )  # Updated while running, to detect dead workers
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        constraints = [
+            # Jobs of the same game would replace each other's segments of the game index
+            models.UniqueConstraint(
+                fields=["game"],
+                condition=models.Q(state="running"),
+                name="one_running_ingestion_job_per_game",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} for {self.game} ({self.get_state_display()})"
+
+    @property
+    def active(self):
+        return self.state in (self.QUEUED, self.RUNNING)
+
+    @property
+    def progress(self):
+        """
+        The share of the documents of the job that have been processed, from 0 to 1.
+        """
+        if self.state == self.SUCCEEDED:
+            return 1.0
+        if not self.documents_total:
+            return 0.0
+        return self.documents_done / self.documents_total
+
+    @property
+    def queued_seconds(self):
+        if self.started_at is None:
+            return None
+        return (self.started_at - self.created_at).total_seconds()
+
+    @property
+    def duration_seconds(self):
+        if self.started_at is None:
+            return None
+        return ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+
+
+class IngestionRun(models.Model):
+    """
+    The outcome, counts and stage timings of an ingest of a document. See games/ingestion_stats.py
+    """
+
+    INGESTED = "ingested"
+    UNCHANGED = "unchanged"
+    FAILED = "failed"
+    OUTCOME_CHOICES = [
+        (INGESTED, "Ingested"),
+        (UNCHANGED, "Unchanged"),
+        (FAILED, "Failed"),
+    ]
+
+    document = models.ForeignKey(
+        Document, on_delete=models.CASCADE, related_name="ingestion_runs"
+    )
+    outcome = models.CharField(max_length=20, choices=OUTCOME_CHOICES)
+    error = models.TextField(blank=True, default="")
+
+    seconds = models.FloatField(default=0)  # Wall time of the whole ingest
+    download_seconds = models.FloatField(default=0)
+    parse_seconds = models.FloatField(default=0)
+    split_seconds = models.FloatField(default=0)
+    summarize_seconds = models.FloatField(default=0)
+    embed_seconds = models.FloatField(default=0)
+    persist_seconds = models.FloatField(default=0)
+
+    pages = models.PositiveIntegerField(default=0)
+    sections = models.PositiveIntegerField(default=0)
+    tokens = models.PositiveIntegerField(default=0)  # Estimated tokens of the sections
+    bytes_downloaded = models.PositiveBigIntegerField(default=0)
+    bytes_uploaded = models.PositiveBigIntegerField(default=0)
+
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"{self.document} {self.get_outcome_display()} in {self.seconds:.1f}s"
+
+    @property
+    def stage_seconds(self):
+        return {stage: getattr(self, f"{stage}_seconds") for stage in STAGES}
@@ -0,0 +1,133 @@
+"""
+Prewarm the vector store registry with the indexes of the most popular games.
+
+After a deploy every worker starts with an empty vector store registry, so the first question for a game in each
+worker pays for downloading and loading its index inside the request. Prewarming loads the indexes of the games
+with the most recent chat sessions in a small background thread pool when a worker boots (see gunicorn.conf.py),
+and the /up/ health check only reports the worker as ready once prewarming is done, or has run for
+VECTOR_STORE_PREWARM_TIMEOUT_SECONDS. A slow prewarm then goes on in the background instead of failing the health
+check and getting the container restarted.
+
+The prewarm_indexes management command fills the local disk index cache shared by all workers on the host from the
+command line. The container does not run it before starting gunicorn, as nothing would answer the health check
+until it is done, and the prewarming of the workers fills the same cache.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from games.models import Game
+from games.vector_store_registry import vector_store_registry
+
+logger = logging.getLogger(__name__)
+
+
+def popular_games(limit, days):
+    """
+    Returns the ingested games with the most chat sessions in the last days, most popular first.
+    """
+    since = timezone.now() - timedelta(days=days)
+    return list(
+        Game.objects.filter(ingested=True)
+        .exclude(faiss_file="")
+        .exclude(faiss_file=None)
+        .annotate(
+            recent_sessions=Count(
+                "chatsession", filter=Q(chatsession__created_at__gte=since)
+            )
+        )
+        .order_by("-recent_sessions", "-updated_at")[:limit]
+    )
+
+
+def prewarm(limit=None, days=None, max_workers=None):
+    """
+    Load the indexes of the most popular games into the vector store registry. Returns the number of loaded games.
+    """
+    limit = settings.VECTOR_STORE_PREWARM_GAMES if limit is None else limit
+    days = settings.VECTOR_STORE_PREWARM_DAYS if days is None else days
+    max_workers = max_workers or settings.VECTOR_STORE_PREWARM_WORKERS
+
+    games = popular_games(limit, days)
+    # Load the least popular games first, so the most popular games are the most recently used in the registry
+    # and the last to be evicted if they do not all fit
+    games.reverse()
+
+    with ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix="prewarm"
+    ) as executor:
+        loaded = sum(executor.map(_load_game_index, games))
+
+    logger.info(
+        f"Prewarmed {loaded} of {len(games)} game indexes, registry: {vector_store_registry.stats()}"
+    )
+    return loaded
+
+
+def _load_game_index(game):
+    try:
+        return game.vector_store.index is not None
+    except Exception:
+        logger.exception(f"Could not prewarm index of {game}")
+        return False
+    finally:
+        # Threads of the pool do not go through the request cycle that closes connections
+        connection.close()
+
+
+class Prewarmer:
+    """
+    Runs prewarm in a background thread and tracks whether it is done.
+
+    A process where prewarming was never started is always ready, and so is a process that has been prewarming for
+    longer than timeout_seconds.
+    """
+
+    def __init__(self, timeout_seconds=None):
+        self.timeout_seconds = (
+            settings.VECTOR_STORE_PREWARM_TIMEOUT_SECONDS
+            if timeout_seconds is None
+            else timeout_seconds
+        )
+        self._started_at = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return (
+            self._started_at is None
+            or self._done.is_set()
+            or time.monotonic() - self._started_at >= self.timeout_seconds
+        )
+
+    def start(self):
+        with self._lock:
+            if self._started_at is not None:
+                return
+            self._started_at = time.monotonic()
+            self._done.clear()
+        threading.Thread(target=self._run, name="prewarm", daemon=True).start()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def _run(self):
+        try:
+            prewarm()
+        except Exception:
+            logger.exception("Prewarming game indexes failed")
+        finally:
+            connection.close()
+            self._done.set()
+
+
+prewarmer = Prewarmer()
@@ -1,58 +1,291 @@
+"""
+Ingest game documents: download the rulebook, split it into sections and add them to the game vector store.
+
+Rulebooks at a url are downloaded over HTTP. Uploaded rulebooks are read from the storage backend: straight from
+disk when the storage is local, otherwise copied in chunks to a temporary file.
+
+Rulebooks are ingested by a streaming pipeline: pages -> sections -> batches of sections -> embedding and appending
+to the index. Pages are extracted and split in a background thread, at most INGESTION_PIPELINE_QUEUE_SIZE batches
+ahead of the embedding, so extraction overlaps with embedding and only a bounded number of pages and sections are
+held at a time. Large rulebooks have their pages extracted by the pool of worker processes, a few page ranges ahead.
+The new segment of the document, all its vectors and texts, is still built in memory, and merged into the loaded
+index of the game, so memory use does grow with the size of the rulebook. The setup pages are summarized in the
+background from the start of the ingest.
+"""
+
+import os
+import queue
 import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice
 
-import requests
-from pypdf import PdfReader
+from django.conf import settings
 
-from games.loaders.pdf_loader_and_summarizer import load_and_split
+from games.embedding_scheduler import estimate_tokens
+from games.ingestion_stats import (
+    DOWNLOAD,
+    PARSE,
+    SPLIT,
+    SUMMARIZE,
+    IngestionStats,
+)
+from games.loaders.pdf_loader_and_summarizer import (
+    load_setup_pages,
+    page_sections,
+    setup_document,
+    start_setup_summary,
+    stream_pages,
+)
+from games.models import IngestionRun
+from games.services.download_service import download_to_file
 
 
-def ingest_document(document, load_and_split_func=None):
+def ingest_document(document, load_and_split_func=None, stats=None):
     """
     Ingest a document by:
-     - Downloading rules
+     - Downloading rules, or reading uploaded rules from storage
      - Loading rules into the vector store.
+
+    An already ingested document is only downloaded and ingested again if its rulebook has changed at the url.
+    Returns False if the rulebook was unchanged.
+
+    The rulebook is ingested by the streaming pipeline, unless a load_and_split_func is given. It is called as
+    load_and_split_func(filename, document) and returns all sections, see load_and_split.
+    Its time is all counted as parsing.
+
+    Every ingest is recorded as an IngestionRun of the document, with its counts and stage timings. Pass an
+    IngestionStats to add them up over several ingests as well.
     """
-    if not load_and_split_func:
-        load_and_split_func = load_and_split
+    run_stats = IngestionStats()
+    started_at = time.perf_counter()
+    try:
+        changed = _ingest_document(document, load_and_split_func, run_stats)
+    except Exception as e:
+        _record_run(
+            document,
+            IngestionRun.FAILED,
+            run_stats,
+            started_at,
+            error=f"{type(e).__name__}: {e}",
+        )
+        raise
+    _record_run(
+        document,
+        IngestionRun.INGESTED if changed else IngestionRun.UNCHANGED,
+        run_stats,
+        started_at,
+    )
+    if stats is not None:
+        stats.add(run_stats)
+    return changed
 
-    with tempfile.NamedTemporaryFile() as file:
-        # Download and check that the downloaded file is a valid PDF file
-        if document.url:
-            _download_to_file(document.url, file)
-        elif document.rulebook_file:
-            _download_to_file(document.rulebook_file.url, file)
 
-        if not _valid_pdf(file.name):
-            raise ValueError("Invalid PDF file")
+def _ingest_document(document, load_and_split_func, stats):
+    with tempfile.NamedTemporaryFile() as file:
+        # Download the rulebook, it is validated as a PDF file while it is loaded
+        filename = file.name
+        with stats.stage(DOWNLOAD):
+            if document.url:
+                validators = {}
+                if _has_current_sections(document):
+                    validators = {
+                        "etag": document.source_etag,
+                        "last_modified": document.source_last_modified,
+                    }
+                result = _download_to_file(document.url, file, **validators)
+                if result.not_modified:
+                    return False
+                document.source_etag = result.etag
+                document.source_last_modified = result.last_modified
+            elif document.rulebook_file:
+                filename = _read_from_storage(document.rulebook_file, file)
+        stats.bytes_downloaded += os.path.getsize(filename)
 
-        # Load the rules from the PDF file and split into sections
-        sections = load_and_split_func(file.name, document)
+        vector_store = document.game.vector_store
+        if load_and_split_func:
+            # Load the rules from the PDF file and split into sections, raises InvalidPdfError for invalid files
+            with stats.stage(PARSE):
+                sections = load_and_split_func(filename, document)
+            stats.pages += max(
+                (section.metadata.get("total_pages", 0) for section in sections),
+                default=0,
+            )
+            stats.sections += len(sections)
+            stats.tokens += sum(
+                estimate_tokens(section.page_content) for section in sections
+            )
 
-        # Add to vector store
-        document.game.vector_store.add_documents(sections, document.id)
+            # Replace the sections from any previous ingest of the document in the vector store
+            vector_store.add_documents(sections, document.id, stats=stats, replace=True)
+        else:
+            _ingest_streaming(filename, document, vector_store, stats)
+        stats.bytes_uploaded += vector_store.bytes_written
 
     document.ingested = True
     document.save()
+    return True
 
 
-def _download_to_file(url, file):
-    # Pretend to be a recent chrome
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36"
-    }
-    r = requests.get(url, headers=headers)
-    file.write(r.content)
-    file.flush()
-    file.seek(0)
+def _record_run(document, outcome, stats, started_at, error=""):
+    IngestionRun.objects.create(
+        document=document,
+        outcome=outcome,
+        error=error,
+        seconds=time.perf_counter() - started_at,
+        pages=stats.pages,
+        sections=stats.sections,
+        tokens=stats.tokens,
+        bytes_downloaded=stats.bytes_downloaded,
+        bytes_uploaded=stats.bytes_uploaded,
+        **{f"{stage}_seconds": seconds for stage, seconds in stats.seconds.items()},
+    )
 
 
-def _valid_pdf(filename):
+def _has_current_sections(document):
     """
-    Check that the file is a valid PDF file
+    Check if the vector store holds sections of the document as it is configured now.
+
+    Changing the url or the pages of a document marks it as not ingested, and re-ingesting all documents clears
+    the vector store first, so in both cases the rulebook has to be downloaded even if it is unchanged.
+    """
+    return (
+        document.ingested
+        and bool(document.source_etag or document.source_last_modified)
+        and document.id in document.game.vector_store.document_ids()
+    )
+
+
+def _download_to_file(url, file, etag=None, last_modified=None):
+    return download_to_file(url, file, etag=etag, last_modified=last_modified)
+
+
+def _read_from_storage(rulebook_file, file):
+    """
+    Returns the filename of an uploaded rulebook. The file of a local storage is used as is, the rulebook of any
+    other storage is copied in chunks to file.
     """
     try:
-        with open(filename, "rb") as pdf_file:
-            PdfReader(pdf_file)
-        return True
-    except:
+        return rulebook_file.path
+    except NotImplementedError:
+        # Storages without local files, like S3, do not implement path
+        pass
+
+    with rulebook_file.open("rb") as source:
+        for chunk in source.chunks():
+            file.write(chunk)
+    file.flush()
+    return file.name
+
+
+def _ingest_streaming(filename, document, vector_store, stats):
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        # Start summarizing the setup pages right away, it takes as long as embedding a big rulebook
+        setup_pages = []
+        if document.setup_pages:
+            with stats.stage(PARSE):
+                setup_pages = load_setup_pages(filename, document.setup_pages)
+        summary = None
+        if setup_pages:
+            summary = start_setup_summary(setup_pages, executor)
+            summary_started_at = time.perf_counter()
+            summary.add_done_callback(
+                lambda _: stats.add_seconds(
+                    SUMMARIZE, time.perf_counter() - summary_started_at
+                )
+            )
+
+        batches = _buffered(
+            _batched(
+                _sections(filename, document, stats),
+                settings.INGESTION_PIPELINE_BATCH_SIZE,
+            ),
+            settings.INGESTION_PIPELINE_QUEUE_SIZE,
+        )
+        try:
+            # Replace the sections from any previous ingest of the document in the vector store. They are only
+            # removed once all sections are embedded, an invalid file (InvalidPdfError when the first page is
+            # extracted) or a failed embedding keeps them.
+            vector_store.add_document_batches(
+                chain(batches, _setup_batch(setup_pages, summary, stats)),
+                document.id,
+                stats=stats,
+                replace=True,
+            )
+        finally:
+            batches.close()
+
+
+def _sections(filename, document, stats):
+    # Runs in the pipeline thread, the same sections as stream_sections
+    for page in stats.timed(PARSE, stream_pages(filename)):
+        stats.pages += 1
+        with stats.stage(SPLIT):
+            sections = page_sections(page, document)
+        for section in sections:
+            stats.sections += 1
+            stats.tokens += estimate_tokens(section.page_content)
+            yield section
+
+
+def _setup_batch(setup_pages, summary, stats):
+    # Waits for the summary only after every other section has been embedded
+    if summary is not None:
+        section = setup_document(setup_pages, summary)
+        stats.sections += 1
+        stats.tokens += estimate_tokens(section.page_content)
+        yield [section]
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, exception):
+        self.exception = exception
+
+
+def _buffered(iterable, maxsize):
+    """
+    Iterate the iterable in a background thread, at most maxsize items ahead of the consumer. Exceptions raised by
+    the iterable are raised to the consumer.
+    """
+    items = queue.Queue(maxsize)
+    stopped = threading.Event()
+
+    def put(item):
+        # Give up when the consumer stopped, instead of blocking on a full queue forever
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
         return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(_DONE)
+        except BaseException as e:
+            put(_Failure(e))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while (item := items.get()) is not _DONE:
+            if isinstance(item, _Failure):
+                raise item.exception
+            yield item
+    finally:
+        stopped.set()
+        thread.join()
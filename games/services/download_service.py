@@ -0,0 +1,125 @@
+"""
+Download rulebooks over HTTP.
+
+Downloads are streamed in chunks straight to the target file, so a rulebook is never held in memory, and are
+aborted as soon as they exceed the size cap. Requests go through a pooled requests.Session per thread with
+keep-alive, connect and read timeouts, and retries with exponential backoff on connection errors and
+throttling or server errors.
+
+Downloads can be conditional: given the ETag and Last-Modified validators of a previous download, a server that
+supports them answers 304 Not Modified and the rulebook is not downloaded again.
+"""
+
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Pretend to be a recent chrome
+USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36"
+
+
+class DownloadTooLargeError(Exception):
+    pass
+
+
+@dataclass
+class DownloadResult:
+    not_modified: bool = False
+    etag: str = ""
+    last_modified: str = ""
+    bytes: int = 0
+
+
+_sessions = threading.local()
+
+
+def download_to_file(
+    url, file, etag: Optional[str] = None, last_modified: Optional[str] = None
+) -> DownloadResult:
+    """
+    Stream url to file. With the validators of a previous download, nothing is written if the server answers
+    304 Not Modified.
+
+    Raises requests.HTTPError for error responses and DownloadTooLargeError if the download exceeds
+    RULEBOOK_DOWNLOAD_MAX_BYTES.
+    """
+    headers = {"User-Agent": USER_AGENT}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    max_bytes = settings.RULEBOOK_DOWNLOAD_MAX_BYTES
+    with _session().get(
+        url,
+        headers=headers,
+        stream=True,
+        timeout=(
+            settings.RULEBOOK_DOWNLOAD_CONNECT_TIMEOUT_SECONDS,
+            settings.RULEBOOK_DOWNLOAD_READ_TIMEOUT_SECONDS,
+        ),
+    ) as response:
+        if response.status_code == 304:
+            return DownloadResult(
+                not_modified=True, etag=etag or "", last_modified=last_modified or ""
+            )
+        response.raise_for_status()
+
+        content_length = response.headers.get("Content-Length")
+        if (
+            content_length
+            and content_length.isdigit()
+            and int(content_length) > max_bytes
+        ):
+            raise DownloadTooLargeError(
+                f"{url} is {content_length} bytes, more than the limit of {max_bytes} bytes"
+            )
+
+        file.seek(0)
+        file.truncate()
+        downloaded = 0
+        for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+            downloaded += len(chunk)
+            # Content-Length can be missing or wrong, so enforce the limit on the bytes actually received
+            if downloaded > max_bytes:
+                raise DownloadTooLargeError(
+                    f"{url} is more than the limit of {max_bytes} bytes"
+                )
+            file.write(chunk)
+        file.flush()
+        file.seek(0)
+
+        return DownloadResult(
+            etag=response.headers.get("ETag", ""),
+            last_modified=response.headers.get("Last-Modified", ""),
+            bytes=downloaded,
+        )
+
+
+def _session():
+    """
+    Returns the session of the current thread. Sessions are not guaranteed to be thread safe.
+    """
+    session = getattr(_sessions, "session", None)
+    if session is None:
+        retry = Retry(
+            total=settings.RULEBOOK_DOWNLOAD_RETRIES,
+            backoff_factor=settings.RULEBOOK_DOWNLOAD_RETRY_BACKOFF_SECONDS,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=("GET",),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(max_retries=retry)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _sessions.session = session
+    return session
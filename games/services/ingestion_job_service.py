@@ -0,0 +1,298 @@
+"""
+Ingest game documents in the background.
+
+Ingesting a game downloads and parses its rulebooks, summarizes the setup pages and embeds the sections, which can
+take minutes. The admin actions only enqueue an IngestionJob, and ingestion_worker processes run the queued jobs,
+recording their progress on the job as each document is ingested.
+
+Jobs are claimed with a conditional update, so two workers never run the same job on any database, and a unique
+constraint on the running jobs of a game keeps two workers from running jobs of the same game. Running jobs have a
+heartbeat, and jobs of workers that died are queued again, or failed once they have used up their attempts.
+"""
+
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F, OuterRef
+from django.utils import timezone
+
+from games import embedding_backends
+from games.models import IngestionJob
+from games.services.document_ingestion_service import ingest_document
+
+logger = logging.getLogger(__name__)
+
+# Number of queued jobs to try to claim before giving up, other workers may claim them first
+CLAIM_CANDIDATES = 10
+
+
+class Progress:
+    """
+    Receives the progress of a game ingestion. This one ignores it.
+    """
+
+    def start(self, documents_total):
+        pass
+
+    def step(self, description):
+        pass
+
+    def document_done(self, changed=True):
+        pass
+
+
+class JobProgress(Progress):
+    """
+    Records the progress of a game ingestion on its IngestionJob.
+    """
+
+    def __init__(self, job):
+        self.job = job
+
+    def start(self, documents_total):
+        self.job.documents_total = documents_total
+        self._save("documents_total")
+
+    def step(self, description):
+        self.job.step = description[:500]
+        self._save("step")
+
+    def document_done(self, changed=True):
+        self.job.documents_done += 1
+        self.job.documents_changed += int(changed)
+        self._save("documents_done", "documents_changed")
+
+    def _save(self, *fields):
+        self.job.heartbeat_at = timezone.now()
+        self.job.save(update_fields=[*fields, "heartbeat_at"])
+
+
+def enqueue(game, kind=IngestionJob.INGEST) -> IngestionJob:
+    """
+    Queue an ingestion job for the game. A game has at most one queued job of each kind, so enqueueing a job that
+    is already queued returns the queued job.
+    """
+    job = IngestionJob.objects.filter(
+        game=game, kind=kind, state=IngestionJob.QUEUED
+    ).first()
+    if job is None:
+        job = IngestionJob.objects.create(game=game, kind=kind)
+    return job
+
+
+def claim_next_job(worker):
+    """
+    Claim the oldest queued job of a game that has no running job, or return None if there is none.
+
+    Jobs of the same game are not run concurrently, as they would replace each other's segments of the game index.
+    The candidates can be stale by the time they are claimed, so the claim checks again that the game has no running
+    job, and the one_running_ingestion_job_per_game constraint rejects the claim if another worker got there first.
+    """
+    running_job_of_game = IngestionJob.objects.filter(
+        game_id=OuterRef("game_id"), state=IngestionJob.RUNNING
+    )
+    candidates = (
+        IngestionJob.objects.filter(state=IngestionJob.QUEUED)
+        .exclude(Exists(running_job_of_game))
+        .order_by("created_at", "id")[:CLAIM_CANDIDATES]
+    )
+    for job in candidates:
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                claimed = (
+                    IngestionJob.objects.filter(pk=job.pk, state=IngestionJob.QUEUED)
+                    .exclude(Exists(running_job_of_game))
+                    .update(
+                        state=IngestionJob.RUNNING,
+                        worker=worker,
+                        started_at=now,
+                        heartbeat_at=now,
+                        finished_at=None,
+                        attempts=F("attempts") + 1,
+                        documents_done=0,
+                        documents_changed=0,
+                        step="Starting",
+                        error="",
+                    )
+                )
+        except IntegrityError:
+            # Another worker claimed a job of the same game at the same time
+            continue
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def start_job(game, worker, kind=IngestionJob.INGEST):
+    """
+    Create a job of the game that is running right away, for ingests run outside of the ingestion workers, like
+    bulk_ingest. Returns None if the game already has a running job. The worker has to send heartbeats and run the
+    job with run_job, like the ingestion workers do.
+    """
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            return IngestionJob.objects.create(
+                game=game,
+                kind=kind,
+                state=IngestionJob.RUNNING,
+                worker=worker,
+                started_at=now,
+                heartbeat_at=now,
+                attempts=1,
+                step="Starting",
+            )
+    except IntegrityError:
+        return None
+
+
+def heartbeat(worker):
+    """
+    Mark the running jobs of the worker as alive.
+    """
+    return IngestionJob.objects.filter(
+        worker=worker, state=IngestionJob.RUNNING
+    ).update(heartbeat_at=timezone.now())
+
+
+def requeue_stale_jobs():
+    """
+    Queue running jobs again whose worker has not sent a heartbeat for INGESTION_JOB_STALE_SECONDS, their worker
+    died. Jobs that have been attempted INGESTION_JOB_MAX_ATTEMPTS times are failed instead.
+
+    Returns the number of jobs queued again.
+    """
+    now = timezone.now()
+    stale = IngestionJob.objects.filter(
+        state=IngestionJob.RUNNING,
+        heartbeat_at__lt=now - timedelta(seconds=settings.INGESTION_JOB_STALE_SECONDS),
+    )
+    stale.filter(attempts__gte=settings.INGESTION_JOB_MAX_ATTEMPTS).update(
+        state=IngestionJob.FAILED,
+        finished_at=now,
+        error="The worker running the job stopped responding",
+    )
+    return stale.update(state=IngestionJob.QUEUED, worker="", step="")
+
+
+def run_job(job, stats=None):
+    """
+    Run a claimed job, recording progress and the outcome on the job. Failures are recorded on the job, not raised.
+
+    The pages and sections ingested are counted in stats, an IngestionStats, if given.
+    """
+    runs = {
+        IngestionJob.INGEST: ingest_game,
+        IngestionJob.REFRESH: refresh_game,
+        IngestionJob.REINGEST_ALL: reingest_game,
+    }
+    try:
+        runs[job.kind](job.game, JobProgress(job), stats=stats)
+    except Exception as e:
+        logger.exception(f"Ingestion job {job.id} failed")
+        job.state = IngestionJob.FAILED
+        job.error = f"{type(e).__name__}: {e}"
+    else:
+        job.state = IngestionJob.SUCCEEDED
+    job.step = ""
+    job.finished_at = timezone.now()
+    job.save()
+    return job
+
+
+def ingest_game(game, progress=None, load_and_split_func=None, stats=None):
+    """
+    Ingest the documents of the game that are not ingested, and remove the sections of deleted documents.
+
+    The pages and sections ingested are counted in stats, an IngestionStats, if given.
+    """
+    progress = progress or Progress()
+    vector_store = game.vector_store
+    if _embedding_backend_changed(game, vector_store):
+        # sections embedded with different backends can not be searched together, embed all documents again
+        _clear(game, vector_store)
+    documents = list(game.document_set.filter(ingested=False))
+    progress.start(len(documents))
+
+    # remove sections of documents that have been deleted from the game
+    document_ids = set(game.document_set.values_list("id", flat=True))
+    for document_id in vector_store.document_ids() - document_ids:
+        vector_store.remove_document(document_id)
+    # only (re-)ingest documents that are not ingested, the other documents keep their sections
+    for document in documents:
+        progress.step(f"Ingesting {document}")
+        ingest_document(document, load_and_split_func, stats)
+        progress.document_done()
+
+    _compact(game, progress)
+    game.ingested = True
+    game.save()
+
+
+def refresh_game(game, progress=None, stats=None):
+    """
+    Re-ingest the documents of the game whose rulebook changed at their url.
+    """
+    if _embedding_backend_changed(game, game.vector_store):
+        return reingest_game(game, progress, stats)
+
+    progress = progress or Progress()
+    documents = list(game.document_set.exclude(url="").exclude(url=None))
+    progress.start(len(documents))
+
+    changed = False
+    for document in documents:
+        progress.step(f"Refreshing {document}")
+        # unchanged rulebooks are not downloaded again, see ingest_document
+        document_changed = ingest_document(document, stats=stats)
+        changed = changed or document_changed
+        progress.document_done(changed=document_changed)
+
+    if changed:
+        _compact(game, progress)
+
+
+def reingest_game(game, progress=None, stats=None):
+    """
+    Clear the vector store of the game and ingest all its documents.
+    """
+    progress = progress or Progress()
+    _clear(game, game.vector_store)
+    documents = list(game.document_set.all())
+    progress.start(len(documents))
+
+    for document in documents:
+        progress.step(f"Ingesting {document}")
+        ingest_document(document, stats=stats)
+        progress.document_done()
+
+    _compact(game, progress)
+    game.ingested = True
+    game.save()
+
+
+def _clear(game, vector_store):
+    # mark the documents as not ingested first, so the documents a failed job did not get to are ingested again by
+    # the next job
+    game.document_set.update(ingested=False)
+    game.ingested = False
+    game.save()
+    vector_store.clear()
+
+
+def _embedding_backend_changed(game, vector_store):
+    # the index is embedded with the backend the game had when it was ingested, see games/embedding_backends.py
+    return (
+        vector_store.index is not None
+        and vector_store.embedding_backend != embedding_backends.game_backend(game)
+    )
+
+
+def _compact(game, progress):
+    # merge the segments written per document into one memory mappable segment
+    progress.step("Compacting the index")
+    game.vector_store.compact()
@@ -1,20 +1,103 @@
+import asyncio
+import json
+import os
 import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from pathlib import Path
 from unittest import mock
 
+import faiss
+import numpy as np
+import openai
+import pymupdf
+import requests
 from django.contrib.admin.sites import AdminSite
+from django.contrib.auth import get_user_model
 from django.contrib.messages.storage.fallback import FallbackStorage
-from django.test import RequestFactory, TestCase
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.db.models.fields.files import FieldFile
+from django.test import RequestFactory, TestCase, override_settings
 from django.urls import reverse
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_openai import ChatOpenAI
+from django.utils import timezone
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.document_loaders import PyMuPDFLoader, PyPDFLoader
+from langchain_community.embeddings.fake import DeterministicFakeEmbedding
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document as LangchainDocument
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 
+from games import docstores, embedding_backends, index_formats, index_types
 from games.admin import GameAdmin
-from games.models import Document, Game
+from games.embedding_backends import HashedNgramEmbedding
+from games.embedding_cache import (
+    EmbeddingCache,
+    QueryEmbeddingCache,
+    embedding_cache,
+    embedding_model_name,
+)
+from games.embedding_scheduler import (
+    EmbeddingScheduler,
+    ingestion_embedding,
+    retry_after_seconds,
+)
+from games.index_cache import LocalIndexCache, index_cache
+from games.ingestion_stats import IngestionStats, throughput
+from games.lexical_index import LexicalIndex, reciprocal_rank_fusion, tokenize
+from games.loaders.pdf_loader_and_summarizer import load_and_split, stream_sections
+from games.loaders.pdf_pages import (
+    ENCRYPTED,
+    NO_PAGES,
+    NOT_A_PDF,
+    InvalidPdfError,
+    extract_page_range,
+    iter_pages,
+    load_pages,
+)
+from games.models import (
+    Document,
+    EmbeddingCacheEntry,
+    Game,
+    IngestionJob,
+    IngestionRun,
+    QueryEmbedding,
+    SetupSummary,
+    SupersededIndexFile,
+)
+from games.prewarm import Prewarmer, popular_games, prewarm
 from games.services.document_ingestion_service import ingest_document
-from games.vectorstores import GameVectorStore
+from games.services.download_service import (
+    DownloadResult,
+    DownloadTooLargeError,
+    download_to_file,
+)
+from games.services.ingestion_job_service import (
+    claim_next_job,
+    enqueue,
+    ingest_game,
+    requeue_stale_jobs,
+    run_job,
+)
+from games.vector_store_registry import VectorStoreRegistry, vector_store_registry
+from games.vector_store_stats import vector_store_stats
+from games.vectorstores import GameVectorStore, delete_superseded_files
 from tests.decorators import prevent_request_warnings
 
 
+def copy_test_pdf(url, file, **validators):
+    shutil.copyfile("games/fixtures/test.pdf", file.name)
+    return DownloadResult()
+
+
 class GameIndexViewTests(TestCase):
     def test_no_games(self):
         """
@@ -92,9 +175,7 @@ class DocumentIngestionServiceTest(TestCase):
         with mock.patch(
             "games.services.document_ingestion_service._download_to_file"
         ) as _download_to_file_mock:
-            _download_to_file_mock.side_effect = lambda _, file: shutil.copyfile(
-                "games/fixtures/test.pdf", file.name
-            )
+            _download_to_file_mock.side_effect = copy_test_pdf
             ingest_document(document)
 
         # try to make a similarity search for the document
@@ -106,6 +187,86 @@ class DocumentIngestionServiceTest(TestCase):
         self.assertEqual(results[0].metadata["document_id"], document.id)
         self.assertTrue("Page 1" in results[0].page_content)
 
+    def test_ingest_uploaded_rulebook_from_storage(self):
+        """
+        Test that an uploaded rulebook is read from the storage instead of downloaded
+        """
+        game = Game.objects.create(name="Test Game")
+        document = Document(game=game)
+        with open("games/fixtures/test.pdf", "rb") as f:
+            document.rulebook_file.save("test.pdf", ContentFile(f.read()))
+
+        with mock.patch(
+            "games.services.document_ingestion_service._download_to_file"
+        ) as _download_to_file_mock:
+            ingest_document(document)
+
+        _download_to_file_mock.assert_not_called()
+        self.assertEqual(game.vector_store.index.index.ntotal, 2)
+        self.assertEqual(
+            document.ingestion_runs.get().bytes_downloaded,
+            os.path.getsize("games/fixtures/test.pdf"),
+        )
+
+    def test_ingest_uploaded_rulebook_from_remote_storage(self):
+        """
+        Test that an uploaded rulebook in a storage without local files is copied to a temporary file
+        """
+        game = Game.objects.create(name="Test Game")
+        document = Document(game=game)
+        with open("games/fixtures/test.pdf", "rb") as f:
+            document.rulebook_file.save("test.pdf", ContentFile(f.read()))
+
+        # Storages without local files raise NotImplementedError for the path of a file
+        with mock.patch.object(
+            FieldFile, "path", new_callable=mock.PropertyMock
+        ) as path_mock:
+            path_mock.side_effect = NotImplementedError
+            ingest_document(document)
+
+        path_mock.assert_called()
+        self.assertEqual(game.vector_store.index.index.ntotal, 2)
+
+    def test_reingest_document_replaces_its_sections(self):
+        """
+        Test that ingesting a document again replaces its sections and leaves other documents alone
+        """
+        game = Game.objects.create(name="Test Game")
+        document = Document.objects.create(game=game, url="some-url")
+        other_document = Document.objects.create(game=game, url="some-other-url")
+
+        with mock.patch(
+            "games.services.document_ingestion_service._download_to_file"
+        ) as _download_to_file_mock:
+            _download_to_file_mock.side_effect = copy_test_pdf
+            ingest_document(document)
+            ingest_document(other_document)
+            ingest_document(document)
+
+        self.assertEqual(
+            game.vector_store.document_ids(), {document.id, other_document.id}
+        )
+        self.assertEqual(game.vector_store.index.index.ntotal, 4)
+
+    def test_failed_reingest_keeps_document_sections(self):
+        game = Game.objects.create(name="Test Game")
+        document = Document.objects.create(game=game, url="some-url")
+
+        with mock.patch(
+            "games.services.document_ingestion_service._download_to_file"
+        ) as _download_to_file_mock:
+            _download_to_file_mock.side_effect = copy_test_pdf
+            ingest_document(document)
+            with mock.patch(
+                "games.vectorstores.embedding_cache.embed_documents",
+                side_effect=RuntimeError("Embedding failed"),
+            ), self.assertRaises(RuntimeError):
+                ingest_document(Document.objects.get(pk=document.id))
+
+        vector_store = Game.objects.get(pk=game.id).vector_store
+        self.assertEqual(vector_store.document_ids(), {document.id})
+        self.assertEqual(vector_store.index.index.ntotal, 2)
+
     def test_ingest_ignore_pages(self):
         """
         Test that a document is ingested correctly
@@ -117,9 +278,7 @@ class DocumentIngestionServiceTest(TestCase):
         with mock.patch(
             "games.services.document_ingestion_service._download_to_file"
         ) as _download_to_file_mock:
-            _download_to_file_mock.side_effect = lambda _, file: shutil.copyfile(
-                "games/fixtures/test.pdf", file.name
-            )
+            _download_to_file_mock.side_effect = copy_test_pdf
             ingest_document(document)
 
         # try to make a similarity search for the document
@@ -142,9 +301,7 @@ class DocumentIngestionServiceTest(TestCase):
         with mock.patch(
             "games.services.document_ingestion_service._download_to_file"
         ) as _download_to_file_mock:
-            _download_to_file_mock.side_effect = lambda _, file: shutil.copyfile(
-                "games/fixtures/test.pdf", file.name
-            )
+            _download_to_file_mock.side_effect = copy_test_pdf
             # Mock OpenAI API for summarization
             with mock.patch(
                 "games.loaders.pdf_loader_and_summarizer.ChatOpenAI"
@@ -169,6 +326,214 @@ class DocumentIngestionServiceTest(TestCase):
             )
         )
 
+    def test_setup_summary_is_cached(self):
+        """
+        Test that ingesting unchanged setup pages again does not summarize them again
+        """
+        game = Game.objects.create(name="Test Game")
+        document = Document.objects.create(game=game, url="some-url", setup_pages="2")
+
+        with mock.patch(
+            "games.services.document_ingestion_service._download_to_file"
+        ) as _download_to_file_mock, mock.patch(
+            "games.loaders.pdf_loader_and_summarizer._summarize_setup_instructions"
+        ) as summarize_mock:
+            _download_to_file_mock.side_effect = copy_test_pdf
+            summarize_mock.return_value = "some summarized text"
+            ingest_document(document)
+            ingest_document(Document.objects.get(pk=document.id))
+
+            summarize_mock.assert_called_once()
+            self.assertEqual(SetupSummary.objects.get().summary, "some summarized text")
+
+            # a different setup text is summarized again
+            document = Document.objects.get(pk=document.id)
+            document.setup_pages = "1"
+            ingest_document(document)
+            self.assertEqual(summarize_mock.call_count, 2)
+
+    def test_sections_are_embedded_while_summarizing(self):
+        """
+        Test that the sections are embedded while the setup pages are summarized, instead of after
+        """
+        game = Game.objects.create(name="Test Game")
+        document = Document.objects.create(game=game, url="some-url", setup_pages="2")
+        events = []
+
+        def summarize(setup_page_content):
+            events.append("summary started")
+            time.sleep(0.2)
+            events.append("summary done")
+            return "some summarized text"
+
+        class RecordingEmbedding(DeterministicFakeEmbedding):
+            def embed_documents(self, texts):
+                events.append(f"embedded {len(texts)}")
+                return super().embed_documents(texts)
+
+        embedding_cache.reset_stats()
+        with mock.patch(
+            "games.services.document_ingestion_service._download_to_file"
+        ) as _download_to_file_mock, mock.patch(
+            "games.loaders.pdf_loader_and_summarizer._summarize_setup_instructions"
+        ) as summarize_mock, mock.patch(
+            "games.embedding_backends.get_embedding",
+            return_value=RecordingEmbedding(size=1536),
+        ):
+            _download_to_file_mock.side_effect = copy_test_pdf
+            summarize_mock.side_effect = summarize
+            ingest_document(document)
+
+        # Both pages are embedded while summarizing, only the summary is embedded afterwards
+        self.assertLess(events.index("embedded 2"), events.index("summary done"))
+        self.assertEqual(events[-1], "embedded 1")
+        self.assertEqual(embedding_cache.stats(), {"hits": 0, "misses": 3})
+        self.assertEqual(
+            Game.objects.get(pk=game.id).vector_store.index.index.ntotal, 3
+        )
+
+    def test_stream_sections_matches_load_and_split(self):
+        game = Game.objects.create(name="Test Game")
+        document = Document.objects.create(game=game, url="some-url", ignore_pages="1")
+
+        self.assertEqual(
+            list(stream_sections("games/fixtures/test.pdf", document)),
+            load_and_split("games/fixtures/test.pdf", document),
+        )
+
+    @override_settings(INGESTION_PIPELINE_BATCH_SIZE=2, INGESTION_PIPELINE_QUEUE_SIZE=1)
+    def test_pipeline_extracts_pages_while_embedding(self):
+        """
+        Test that pages are extracted at most a few batches ahead of the embedding, and all sections are ingested
+        """
+        game = Game.objects.create(name="Test Game")
+        document = Document.objects.create(game=game, url="some-url")
+        extracted = []
+        ahead = []
+
+        def counting_iter_pages(filename, *args, **kwargs):
+            for page in iter_pages(filename, *args, **kwargs):
+                extracted.append(page)
+                yield page
+
+        class RecordingEmbedding(DeterministicFakeEmbedding):
+            def embed_documents(self, texts):
+                ahead.append(len(extracted) - 2 * len(ahead))
+                return super().embed_documents(texts)
+
+        def download_rulebook(url, file, **validators):
+            pdf = pymupdf.open()
+            for number in range(20):
+                pdf.new_page().insert_text((72, 72), f"Rules of page {number + 1}")
+            pdf.save(file.name)
+            return DownloadResult()
+
+        stats = IngestionStats()
+        with mock.patch(
+            "games.services.document_ingestion_service._download_to_file"
+        ) as _download_to_file_mock, mock.patch(
+            "games.loaders.pdf_loader_and_summarizer.iter_pages", counting_iter_pages
+        ), mock.patch(
+            "games.embedding_backends.get_embedding",
+            return_value=RecordingEmbedding(size=1536),
+        ):
+            _download_to_file_mock.side_effect = download_rulebook
+            ingest_document(document, stats=stats)
+
+        self.assertEqual((stats.pages, stats.sections), (20, 20))
+        self.assertEqual(len(ahead), 10)
+        # the batch being embedded, one batch in the queue and one waiting to be queued
+        self.assertLessEqual(max(ahead), 3 * 2)
+        self.assertEqual(
+            Game.objects.get(pk=game.id).vector_store.index.index.ntotal, 20
+        )
+
+    def test_reingest_invalid_file_keeps_sections(self):
+        game = Game.objects.create(name="Test Game")
+        document = Document.objects.create(game=game, url="some-url")
+
+        def download_html(url, file, **validators):
+            file.write(b"<html>Not found</html>")
+            file.flush()
+            return DownloadResult()
+
+        with mock.patch(
+            "games.services.document_ingestion_service._download_to_file"
+        ) as _download_to_file_mock:
+            _download_to_file_mock.side_effect = copy_test_pdf
+            ingest_document(document)
+            _download_to_file_mock.side_effect = download_html
+            with self.assertRaises(InvalidPdfError):
+                ingest_document(Document.objects.get(pk=document.id))
+
+        vector_store = Game.objects.get(pk=game.id).vector_store
+        self.assertEqual(vector_store.document_ids(), {document.id})
+        self.assertEqual(vector_store.index.index.ntotal, 2)
+
+    def test_ingest_document_records_run(self):
+        game = Game.objects.create(name="Test Game")
+        document = Document.objects.create(game=game, url="some-url", setup_pages="2")
+
+        def download_html(url, file, **validators):
+            file.write(b"<html>Not found</html>")
+            file.flush()
+            return DownloadResult()
+
+        stats = IngestionStats()
+        with mock.patch(
+            "games.services.document_ingestion_service._download_to_file"
+        ) as _download_to_file_mock, mock.patch(
+            "games.loaders.pdf_loader_and_summarizer._summarize_setup_instructions"
+        ) as summarize_mock:
+            _download_to_file_mock.side_effect = copy_test_pdf
+            summarize_mock.return_value = "some summarized text"
+            ingest_document(document, stats=stats)
+            _download_to_file_mock.side_effect = download_html
+            with self.assertRaises(InvalidPdfError):
+                ingest_document(Document.objects.get(pk=document.id))
+
+        failed_run, run = document.ingestion_runs.all()
+        self.assertEqual(run.outcome, IngestionRun.INGESTED)
+        self.assertEqual((run.pages, run.sections), (2, 3))
+        self.assertGreater(run.tokens, 0)
+        self.assertEqual(
+            run.bytes_downloaded, os.path.getsize("games/fixtures/test.pdf")
+        )
+        self.assertGreater(run.bytes_uploaded, 0)
+        for stage in ["download", "parse", "split", "summarize", "embed", "persist"]:
+            self.assertGreater(run.stage_seconds[stage], 0, stage)
+        self.assertGreaterEqual(run.seconds, run.parse_seconds)
+        self.assertEqual(
+            (stats.pages, stats.sections, stats.bytes_uploaded),
+            (run.pages, run.sections, run.bytes_uploaded),
+        )
+
+        self.assertEqual(failed_run.outcome, IngestionRun.FAILED)
+        self.assertEqual(failed_run.sections, 0)
+        self.assertIn("InvalidPdfError", failed_run.error)
+
+    def test_unchanged_rulebook_records_run(self):
+        game = Game.objects.create(name="Test Game")
+        document = Document.objects.create(game=game, url="some-url")
+
+        def download(url, file, **validators):
+            if validators.get("etag"):
+                return DownloadResult(not_modified=True)
+            copy_test_pdf(url, file)
+            return DownloadResult(etag='"v1"')
+
+        with mock.patch(
+            "games.services.document_ingestion_service._download_to_file"
+        ) as _download_to_file_mock:
+            _download_to_file_mock.side_effect = download
+            ingest_document(document)
+            self.assertFalse(ingest_document(Document.objects.get(pk=document.id)))
+
+        self.assertEqual(
+            [run.outcome for run in document.ingestion_runs.all()],
+            [IngestionRun.UNCHANGED, IngestionRun.INGESTED],
+        )
+
 
 class GameVectorStoreTest(TestCase):
     def test_happy_path(self):
@@ -204,81 +569,2195 @@ class GameVectorStoreTest(TestCase):
         self.assertEqual(result[0].metadata["game_id"], game.id)
         self.assertEqual(result[0].metadata["document_id"], 0)
 
+    def test_loaded_index_is_shared_between_game_instances(self):
+        vector_store_registry.clear()
+        game = Game.objects.create(name="Test Game")
+        docs = PyPDFLoader("games/fixtures/test.pdf").load_and_split()
+        GameVectorStore(game).add_documents(docs, 0)
 
-class GameAdminTest(TestCase):
-    def get_ingest_documents_request(self):
-        request = RequestFactory().get("/admin/games/game")
-        setattr(request, "session", "session")
-        messages = FallbackStorage(request)
-        setattr(request, "_messages", messages)
-        return request
+        first = Game.objects.get(pk=game.id).vector_store
+        second = Game.objects.get(pk=game.id).vector_store
 
-    def test_ingest_documents(self):
+        self.assertIs(first.index, second.index)
+        self.assertEqual(vector_store_registry.stats()["hits"], 2)
+        self.assertEqual(vector_store_registry.stats()["misses"], 0)
+
+    def test_persist_creates_new_version(self):
+        vector_store_registry.clear()
         game = Game.objects.create(name="Test Game")
-        document = Document.objects.create(game=game, url="some-url")
+        docs = PyPDFLoader("games/fixtures/test.pdf").load_and_split()
 
-        # Patch / mock document ingestion._download_to_file and replace it with a function that returns a file with the contents of the test.pdf file
-        with mock.patch(
-            "games.services.document_ingestion_service._download_to_file"
-        ) as _download_to_file_mock:
-            _download_to_file_mock.side_effect = lambda _, file: shutil.copyfile(
-                "games/fixtures/test.pdf", file.name
-            )
-            GameAdmin(Game, AdminSite()).ingest_documents(
-                self.get_ingest_documents_request(), [game]
-            )
+        game_vector_store = GameVectorStore(game)
+        game_vector_store.add_documents(docs[:1], 0)
+        first_name = game.faiss_file.name
+        game_vector_store.add_documents(docs[1:], 1)
 
-        game.refresh_from_db()
+        self.assertNotEqual(game.faiss_file.name, first_name)
+        self.assertFalse(game.faiss_file.storage.exists(first_name))
+        self.assertEqual(vector_store_registry.stats()["entries"], 1)
 
-        # try to make a similarity search for the document
-        results = game.vector_store.index.similarity_search("This is some text")
+        loaded_vector_store = Game.objects.get(pk=game.id).vector_store
+        self.assertEqual(len(loaded_vector_store.index.index_to_docstore_id), 2)
 
-        self.assertEqual(len(results), 2)
-        self.assertEqual(results[0].metadata["page"], 0)
-        self.assertEqual(results[0].metadata["game_id"], game.id)
-        self.assertEqual(results[0].metadata["document_id"], document.id)
-        self.assertTrue("Page 1" in results[0].page_content)
+    @override_settings(VECTOR_STORE_SUPERSEDED_FILE_GRACE_SECONDS=60)
+    def test_superseded_files_are_deleted_after_grace_period(self):
+        vector_store_registry.clear()
+        game = Game.objects.create(name="Test Game")
+        docs = PyPDFLoader("games/fixtures/test.pdf").load_and_split()
+        game_vector_store = GameVectorStore(game)
+        game_vector_store.add_documents(docs[:1], 0)
+        stale_game = Game.objects.get(pk=game.id)
+        first_name = game.faiss_file.name
 
-    def test_ingest_documents_twice(self):
+        game_vector_store.add_documents(docs[1:], 1)
+        vector_store_registry.clear()
+
+        # A worker that read the game before the new version was saved can still load the previous version
+        self.assertEqual(stale_game.vector_store.index.index.ntotal, 1)
+        self.assertEqual(delete_superseded_files(), 0)
+
+        SupersededIndexFile.objects.update(
+            superseded_at=timezone.now() - timedelta(seconds=61)
+        )
+        self.assertEqual(delete_superseded_files(), 1)
+        self.assertFalse(game.faiss_file.storage.exists(first_name))
+        self.assertFalse(SupersededIndexFile.objects.exists())
+
+    def test_load_of_deleted_version_loads_current_index(self):
+        vector_store_registry.clear()
         game = Game.objects.create(name="Test Game")
-        document = Document.objects.create(game=game, url="some-url")
+        docs = PyPDFLoader("games/fixtures/test.pdf").load_and_split()
+        game_vector_store = GameVectorStore(game)
+        game_vector_store.add_documents(docs[:1], 0)
+        stale_game = Game.objects.get(pk=game.id)
 
-        # Patch / mock document ingestion._download_to_file and replace it with a function that returns a file with the contents of the test.pdf file
-        with mock.patch(
-            "games.services.document_ingestion_service._download_to_file"
-        ) as _download_to_file_mock:
-            _download_to_file_mock.side_effect = lambda _, file: shutil.copyfile(
-                "games/fixtures/test.pdf", file.name
-            )
-            GameAdmin(Game, AdminSite()).ingest_documents(
-                self.get_ingest_documents_request(), [game]
-            )
+        game_vector_store.add_documents(docs[1:], 1)
+        vector_store_registry.clear()
 
-            # Call it a second time
-            GameAdmin(Game, AdminSite()).ingest_documents(
-                self.get_ingest_documents_request(), [game]
-            )
+        self.assertEqual(stale_game.vector_store.index.index.ntotal, 2)
+        self.assertEqual(stale_game.faiss_file.name, game.faiss_file.name)
 
-        game.refresh_from_db()
+    def test_clear_invalidates_registry(self):
+        vector_store_registry.clear()
+        game = Game.objects.create(name="Test Game")
+        docs = PyPDFLoader("games/fixtures/test.pdf").load_and_split()
+        GameVectorStore(game).add_documents(docs, 0)
 
-        # try to make a similarity search for the document
-        results = game.vector_store.index.similarity_search("This is some text")
+        game.vector_store.clear()
 
-        self.assertEqual(len(results), 2)  # Still should only show 2 results
-        self.assertEqual(results[0].metadata["page"], 0)
-        self.assertEqual(results[0].metadata["game_id"], game.id)
-        self.assertEqual(results[0].metadata["document_id"], document.id)
-        self.assertTrue("Page 1" in results[0].page_content)
+        self.assertEqual(vector_store_registry.stats()["entries"], 0)
+        self.assertIsNone(Game.objects.get(pk=game.id).vector_store.index)
+
+    def test_load_after_registry_eviction_reads_local_disk_cache(self):
+        vector_store_registry.clear()
+        game = Game.objects.create(name="Test Game")
+        docs = PyPDFLoader("games/fixtures/test.pdf").load_and_split()
+        GameVectorStore(game).add_documents(docs, 0)
 
+        vector_store_registry.clear()
+        Game.objects.get(pk=game.id).vector_store  # Downloads into the local cache
+        vector_store_registry.clear()
+        misses = index_cache.misses
 
-class GameModelTest(TestCase):
-    def test_game_str(self):
+        with mock.patch.object(
+            game.faiss_file.storage, "open", side_effect=AssertionError
+        ):
+            loaded_vector_store = Game.objects.get(pk=game.id).vector_store
+
+        self.assertEqual(index_cache.misses, misses)
+        self.assertEqual(len(loaded_vector_store.index.index_to_docstore_id), 2)
+
+    def test_persists_split_index_files(self):
         game = Game.objects.create(name="Test Game")
-        self.assertEqual(str(game), "Test Game")
+        docs = PyPDFLoader("games/fixtures/test.pdf").load_and_split()
+        GameVectorStore(game).add_documents(docs, 0)
 
-    def test_game_with_docs(self):
+        with game.faiss_file.open("rb") as file:
+            manifest = index_formats.parse_manifest(file.read())
+        storage = game.faiss_file.storage
+        segment = manifest["segments"][0]
+        self.assertTrue(storage.exists(segment["index"]))
+        self.assertTrue(storage.exists(segment["docstore"]))
+
+        game.vector_store.clear()
+
+        self.assertFalse(storage.exists(segment["index"]))
+        self.assertFalse(storage.exists(segment["docstore"]))
+
+    def test_add_documents_to_memory_mapped_index(self):
+        vector_store_registry.clear()
         game = Game.objects.create(name="Test Game")
-        Document.objects.create(game=game, url="some-url")
-        Document.objects.create(
-            game=game, url="some--other-url", display_name="some-different-url"
+        docs = PyPDFLoader("games/fixtures/test.pdf").load_and_split()
+        GameVectorStore(game).add_documents(docs[:1], 0)
+        vector_store_registry.clear()
+
+        game_vector_store = Game.objects.get(pk=game.id).vector_store
+        mapped_index = game_vector_store.index
+        game_vector_store.add_documents(docs[1:], 1)
+
+        self.assertEqual(mapped_index.index.ntotal, 1)  # Shared index is not modified
+        self.assertEqual(game_vector_store.index.index.ntotal, 2)
+        results = game_vector_store.index.similarity_search("This is some text")
+        self.assertEqual({result.metadata["document_id"] for result in results}, {0, 1})
+
+    def test_loads_compact_docstore(self):
+        vector_store_registry.clear()
+        game = Game.objects.create(name="Test Game")
+        docs = PyPDFLoader("games/fixtures/test.pdf").load_and_split()
+        GameVectorStore(game).add_documents(docs, 0)
+        vector_store_registry.clear()
+
+        loaded_vector_store = Game.objects.get(pk=game.id).vector_store
+        self.assertIsInstance(
+            loaded_vector_store.index.docstore, docstores.CompactDocstore
+        )
+        result = loaded_vector_store.index.similarity_search("page 1", k=1)
+        self.assertEqual(result[0].metadata["page"], 0)
+        self.assertEqual(result[0].metadata["document_id"], 0)
+
+    def read_manifest(self, game):
+        with game.faiss_file.open("rb") as file:
+            return index_formats.parse_manifest(file.read())
+
+    def test_add_documents_appends_segments(self):
+        vector_store_registry.clear()
+        game = Game.objects.create(name="Test Game")
+        docs = PyPDFLoader("games/fixtures/test.pdf").load_and_split()
+
+        game_vector_store = GameVectorStore(game)
+        game_vector_store.add_documents(docs[:1], 0)
+        first_segment = self.read_manifest(game)["segments"][0]
+        game_vector_store.add_documents(docs[1:], 1)
+
+        segments = self.read_manifest(game)["segments"]
+        self.assertEqual(segments[0], first_segment)  # Not rewritten
+        self.assertEqual(segments[1]["document_ids"], [1])
+
+        vector_store_registry.clear()
+        loaded_vector_store = Game.objects.get(pk=game.id).vector_store
+        results = loaded_vector_store.index.similarity_search("This is some text")
+        self.assertEqual({result.metadata["document_id"] for result in results}, {0, 1})
+
+    def test_compact_merges_segments(self):
+        vector_store_registry.clear()
+        game = Game.objects.create(name="Test Game")
+        docs = PyPDFLoader("games/fixtures/test.pdf").load_and_split()
+        game_vector_store = GameVectorStore(game)
+        game_vector_store.add_documents(docs[:1], 0)
+        game_vector_store.add_documents(docs[1:], 1)
+        old_segments = self.read_manifest(game)["segments"]
+
+        game_vector_store.compact()
+
+        segments = self.read_manifest(game)["segments"]
+        self.assertEqual(len(segments), 1)
+        self.assertEqual(segments[0]["document_ids"], [0, 1])
+        for segment in old_segments:
+            self.assertFalse(game.faiss_file.storage.exists(segment["index"]))
+
+        vector_store_registry.clear()
+        loaded_vector_store = Game.objects.get(pk=game.id).vector_store
+        self.assertEqual(loaded_vector_store.index.index.ntotal, 2)
+
+    def test_add_documents_to_legacy_index(self):
+        vector_store_registry.clear()
+        game = Game.objects.create(name="Test Game")
+        docs = PyPDFLoader("games/fixtures/test.pdf").load_and_split()
+        for doc in docs:
+            doc.metadata["document_id"] = 0
+        legacy_index = FAISS.from_documents(docs[:1], GameVectorStore(game).embedding)
+        game.faiss_file.save("legacy", ContentFile(legacy_index.serialize_to_bytes()))
+        legacy_name = game.faiss_file.name
+
+        game_vector_store = Game.objects.get(pk=game.id).vector_store
+        self.assertEqual(game_vector_store.index.index.ntotal, 1)
+        game_vector_store.add_documents(docs[1:], 1)
+
+        segments = self.read_manifest(game_vector_store.game)["segments"]
+        self.assertEqual([segment["document_ids"] for segment in segments], [None, [1]])
+        self.assertFalse(game.faiss_file.storage.exists(legacy_name))
+
+        vector_store_registry.clear()
+        loaded_vector_store = Game.objects.get(pk=game.id).vector_store
+        self.assertEqual(loaded_vector_store.index.index.ntotal, 2)
+
+    def test_remove_document(self):
+        vector_store_registry.clear()
+        game = Game.objects.create(name="Test Game")
+        docs = PyPDFLoader("games/fixtures/test.pdf").load_and_split()
+        game_vector_store = GameVectorStore(game)
+        game_vector_store.add_documents(docs[:1], 0)
+        game_vector_store.add_documents(docs[1:], 1)
+        first_segment = self.read_manifest(game)["segments"][0]
+
+        self.assertEqual(game_vector_store.remove_document(1), 1)
+        self.assertEqual(game_vector_store.remove_document(1), 0)
+
+        self.assertEqual(self.read_manifest(game)["segments"], [first_segment])
+        self.assertEqual(game_vector_store.document_ids(), {0})
+
+        vector_store_registry.clear()
+        loaded_vector_store = Game.objects.get(pk=game.id).vector_store
+        results = loaded_vector_store.index.similarity_search("This is some text")
+        self.assertEqual([result.metadata["document_id"] for result in results], [0])
+
+    def test_remove_document_from_compacted_segment(self):
+        vector_store_registry.clear()
+        game = Game.objects.create(name="Test Game")
+        docs = PyPDFLoader("games/fixtures/test.pdf").load_and_split()
+        game_vector_store = GameVectorStore(game)
+        game_vector_store.add_documents(docs[:1], 0)
+        game_vector_store.add_documents(docs[1:], 1)
+        game_vector_store.compact()
+        compacted_segment = self.read_manifest(game)["segments"][0]
+
+        self.assertEqual(game_vector_store.remove_document(0), 1)
+
+        segments = self.read_manifest(game)["segments"]
+        self.assertEqual(len(segments), 1)
+        self.assertEqual(segments[0]["document_ids"], [1])
+        storage = game.faiss_file.storage
+        self.assertFalse(storage.exists(compacted_segment["index"]))
+
+        vector_store_registry.clear()
+        loaded_vector_store = Game.objects.get(pk=game.id).vector_store
+        self.assertEqual(loaded_vector_store.index.index.ntotal, 1)
+        results = loaded_vector_store.index.similarity_search("This is some text")
+        self.assertEqual(results[0].metadata["document_id"], 1)
+
+    def test_remove_last_document(self):
+        game = Game.objects.create(name="Test Game")
+        docs = PyPDFLoader("games/fixtures/test.pdf").load_and_split()
+        game_vector_store = GameVectorStore(game)
+        game_vector_store.add_documents(docs, 0)
+        segment = self.read_manifest(game)["segments"][0]
+
+        self.assertEqual(game_vector_store.remove_document(0), 2)
+
+        self.assertIsNone(game_vector_store.index)
+        self.assertFalse(Game.objects.get(pk=game.id).faiss_file)
+        self.assertFalse(game.faiss_file.storage.exists(segment["index"]))
+
+    def test_add_documents_uses_embedding_cache(self):
+        game = Game.objects.create(name="Test Game")
+        docs = PyPDFLoader("games/fixtures/test.pdf").load_and_split()
+        game_vector_store = GameVectorStore(game)
+        game_vector_store.add_documents(docs, 0)
+
+        embedding_cache.reset_stats()
+        with mock.patch.object(
+            DeterministicFakeEmbedding, "embed_documents"
+        ) as embed_documents_mock:
+            game_vector_store.add_documents(
+                PyPDFLoader("games/fixtures/test.pdf").load_and_split(), 1
+            )
+
+        embed_documents_mock.assert_not_called()
+        self.assertEqual(embedding_cache.stats(), {"hits": 2, "misses": 0})
+        self.assertEqual(game_vector_store.index.index.ntotal, 4)
+
+    def test_compact_builds_index_type_of_game(self):
+        docs = PyPDFLoader("games/fixtures/test.pdf").load_and_split()
+        for index_type in [index_types.SQ8, index_types.SQFP16, index_types.HNSW]:
+            with self.subTest(index_type=index_type):
+                vector_store_registry.clear()
+                game = Game.objects.create(name="Test Game", index_type=index_type)
+                game_vector_store = GameVectorStore(game)
+                game_vector_store.add_documents(docs[:1], 0)
+                game_vector_store.add_documents(docs[1:], 1)
+
+                game_vector_store.compact()
+
+                segments = self.read_manifest(game)["segments"]
+                self.assertEqual(len(segments), 1)
+                self.assertEqual(segments[0]["index_type"], index_type)
+
+                vector_store_registry.clear()
+                loaded_vector_store = Game.objects.get(pk=game.id).vector_store
+                results = loaded_vector_store.index.similarity_search(
+                    docs[1].page_content, k=1
+                )
+                self.assertEqual(results[0].metadata["document_id"], 1)
+
+                self.assertEqual(loaded_vector_store.remove_document(1), 1)
+                self.assertEqual(loaded_vector_store.index.index.ntotal, 1)
+
+    @override_settings(VECTOR_STORE_INDEX_TYPE=index_types.SQ8)
+    def test_compact_rebuilds_index_when_index_type_changes(self):
+        game = Game.objects.create(name="Test Game")
+        docs = PyPDFLoader("games/fixtures/test.pdf").load_and_split()
+        game_vector_store = GameVectorStore(game)
+        game_vector_store.add_documents(docs, 0)
+
+        game_vector_store.compact()
+        self.assertEqual(
+            self.read_manifest(game)["segments"][0]["index_type"], index_types.SQ8
+        )
+
+        game.index_type = index_types.FLAT
+        GameVectorStore(game).compact()
+        self.assertEqual(
+            self.read_manifest(game)["segments"][0]["index_type"], index_types.FLAT
+        )
+
+    def test_setup_documents(self):
+        vector_store_registry.clear()
+        game = Game.objects.create(name="Test Game")
+        docs = PyPDFLoader("games/fixtures/test.pdf").load_and_split()
+        docs[1].metadata["setup_page"] = True
+        game_vector_store = GameVectorStore(game)
+        game_vector_store.add_documents(docs[:1], 0)
+        self.assertEqual(game_vector_store.setup_documents(), [])
+
+        game_vector_store.add_documents(docs[1:], 1)
+        setup_ids = self.read_manifest(game)["segments"][1]["setup_ids"]
+        self.assertEqual(len(setup_ids), 1)
+
+        vector_store_registry.clear()
+        loaded_vector_store = Game.objects.get(pk=game.id).vector_store
+        self.assertEqual(loaded_vector_store.setup_ids, setup_ids)
+        setup_documents = loaded_vector_store.setup_documents()
+        self.assertEqual(len(setup_documents), 1)
+        self.assertEqual(setup_documents[0].page_content, docs[1].page_content)
+
+        loaded_vector_store.compact()
+        vector_store_registry.clear()
+        self.assertEqual(Game.objects.get(pk=game.id).vector_store.setup_ids, setup_ids)
+
+        loaded_vector_store.remove_document(1)
+        self.assertEqual(loaded_vector_store.setup_documents(), [])
+
+    def test_setup_documents_of_index_without_recorded_setup_ids(self):
+        vector_store_registry.clear()
+        game = Game.objects.create(name="Test Game")
+        docs = PyPDFLoader("games/fixtures/test.pdf").load_and_split()
+        docs[1].metadata["setup_page"] = True
+        legacy_index = FAISS.from_documents(docs, GameVectorStore(game).embedding)
+        game.faiss_file.save("legacy", ContentFile(legacy_index.serialize_to_bytes()))
+
+        setup_documents = Game.objects.get(pk=game.id).vector_store.setup_documents()
+
+        self.assertEqual(len(setup_documents), 1)
+        self.assertTrue(setup_documents[0].metadata["setup_page"])
+
+    def test_lexical_index_is_persisted_with_segments(self):
+        vector_store_registry.clear()
+        game = Game.objects.create(name="Test Game")
+        docs = PyPDFLoader("games/fixtures/test.pdf").load_and_split()
+        game_vector_store = GameVectorStore(game)
+        game_vector_store.add_documents(docs[:1], 0)
+        game_vector_store.add_documents(docs[1:], 1)
+
+        segments = self.read_manifest(game)["segments"]
+        for segment in segments:
+            self.assertTrue(game.faiss_file.storage.exists(segment["lexical"]))
+
+        vector_store_registry.clear()
+        loaded_vector_store = Game.objects.get(pk=game.id).vector_store
+        with mock.patch.object(
+            DeterministicFakeEmbedding, "embed_query", side_effect=AssertionError
+        ):
+            results = loaded_vector_store.lexical_search("different")
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0][0].metadata["document_id"], 1)
+
+        loaded_vector_store.remove_document(1)
+        self.assertEqual(loaded_vector_store.lexical_search("different"), [])
+        self.assertFalse(game.faiss_file.storage.exists(segments[1]["lexical"]))
+        self.assertEqual(len(loaded_vector_store.lexical_search("text")), 1)
+
+    def test_recorded_split_index_is_never_unpickled(self):
+        game = Game.objects.create(
+            name="Test Game",
+            index_format_version=index_formats.SPLIT_FORMAT_VERSION,
+        )
+        index = FAISS.from_documents(
+            PyPDFLoader("games/fixtures/test.pdf").load_and_split(),
+            GameVectorStore(game).embedding,
+        )
+        game.faiss_file.save("legacy", ContentFile(index.serialize_to_bytes()))
+
+        with self.assertRaises(ValueError):
+            GameVectorStore(game)
+
+
+class GameAdminTest(TestCase):
+    def get_ingest_documents_request(self):
+        request = RequestFactory().get("/admin/games/game")
+        setattr(request, "session", "session")
+        messages = FallbackStorage(request)
+        setattr(request, "_messages", messages)
+        return request
+
+    def run_ingestion_worker(self):
+        call_command(
+            "ingestion_worker", "--burst", "--concurrency", "1", stdout=StringIO()
+        )
+
+    def test_ingest_documents(self):
+        game = Game.objects.create(name="Test Game")
+        document = Document.objects.create(game=game, url="some-url")
+
+        # Patch / mock document ingestion._download_to_file and replace it with a function that returns a file with the contents of the test.pdf file
+        with mock.patch(
+            "games.services.document_ingestion_service._download_to_file"
+        ) as _download_to_file_mock:
+            _download_to_file_mock.side_effect = copy_test_pdf
+            GameAdmin(Game, AdminSite()).ingest_documents(
+                self.get_ingest_documents_request(), [game]
+            )
+            self.run_ingestion_worker()
+
+        game.refresh_from_db()
+
+        # try to make a similarity search for the document
+        results = game.vector_store.index.similarity_search("This is some text")
+
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0].metadata["page"], 0)
+        self.assertEqual(results[0].metadata["game_id"], game.id)
+        self.assertEqual(results[0].metadata["document_id"], document.id)
+        self.assertTrue("Page 1" in results[0].page_content)
+
+    def test_ingest_documents_twice(self):
+        game = Game.objects.create(name="Test Game")
+        document = Document.objects.create(game=game, url="some-url")
+
+        # Patch / mock document ingestion._download_to_file and replace it with a function that returns a file with the contents of the test.pdf file
+        with mock.patch(
+            "games.services.document_ingestion_service._download_to_file"
+        ) as _download_to_file_mock:
+            _download_to_file_mock.side_effect = copy_test_pdf
+            GameAdmin(Game, AdminSite()).ingest_documents(
+                self.get_ingest_documents_request(), [game]
+            )
+            self.run_ingestion_worker()
+
+            # Call it a second time
+            GameAdmin(Game, AdminSite()).ingest_documents(
+                self.get_ingest_documents_request(), [game]
+            )
+            self.run_ingestion_worker()
+
+        game.refresh_from_db()
+
+        # try to make a similarity search for the document
+        results = game.vector_store.index.similarity_search("This is some text")
+
+        self.assertEqual(len(results), 2)  # Still should only show 2 results
+        self.assertEqual(results[0].metadata["page"], 0)
+        self.assertEqual(results[0].metadata["game_id"], game.id)
+        self.assertEqual(results[0].metadata["document_id"], document.id)
+        self.assertTrue("Page 1" in results[0].page_content)
+
+    def test_ingest_documents_only_ingests_new_documents(self):
+        game = Game.objects.create(name="Test Game")
+        docs = PyPDFLoader("games/fixtures/test.pdf").load_and_split()
+        ingested_document = Document.objects.create(
+            game=game, url="some-url", ingested=True
+        )
+        game.vector_store.add_documents(docs[:1], ingested_document.id)
+        new_document = Document.objects.create(game=game, url="some-other-url")
+
+        with mock.patch(
+            "games.services.ingestion_job_service.ingest_document"
+        ) as ingest_document_mock:
+            GameAdmin(Game, AdminSite()).ingest_documents(
+                self.get_ingest_documents_request(), [game]
+            )
+            self.run_ingestion_worker()
+
+        ingest_document_mock.assert_called_once_with(new_document, None, None)
+        self.assertEqual(game.vector_store.document_ids(), {ingested_document.id})
+
+    def test_ingest_documents_removes_deleted_documents(self):
+        game = Game.objects.create(name="Test Game")
+        docs = PyPDFLoader("games/fixtures/test.pdf").load_and_split()
+        document = Document.objects.create(game=game, url="some-url", ingested=True)
+        game.vector_store.add_documents(docs[:1], document.id)
+        game.vector_store.add_documents(docs[1:], document.id + 1)
+
+        GameAdmin(Game, AdminSite()).ingest_documents(
+            self.get_ingest_documents_request(), [game]
+        )
+        self.run_ingestion_worker()
+
+        game.refresh_from_db()
+        self.assertEqual(
+            Game.objects.get(pk=game.id).vector_store.document_ids(), {document.id}
+        )
+        self.assertEqual(game.vector_store.index.index.ntotal, 1)
+
+    def test_reingest_all_documents(self):
+        game = Game.objects.create(name="Test Game")
+        document = Document.objects.create(game=game, url="some-url", ingested=True)
+
+        with mock.patch(
+            "games.services.document_ingestion_service._download_to_file"
+        ) as _download_to_file_mock:
+            _download_to_file_mock.side_effect = copy_test_pdf
+            GameAdmin(Game, AdminSite()).reingest_all_documents(
+                self.get_ingest_documents_request(), [game]
+            )
+            self.run_ingestion_worker()
+
+        game.refresh_from_db()
+        self.assertEqual(
+            Game.objects.get(pk=game.id).vector_store.document_ids(), {document.id}
+        )
+        self.assertEqual(game.vector_store.index.index.ntotal, 2)
+
+    def test_failed_reingest_all_documents_is_repaired_by_ingest(self):
+        game = Game.objects.create(name="Test Game")
+        documents = [
+            Document.objects.create(game=game, url="some-url"),
+            Document.objects.create(game=game, url="some-other-url"),
+        ]
+        request = self.get_ingest_documents_request()
+
+        with mock.patch(
+            "games.services.document_ingestion_service._download_to_file"
+        ) as _download_to_file_mock:
+            _download_to_file_mock.side_effect = copy_test_pdf
+            GameAdmin(Game, AdminSite()).ingest_documents(request, [game])
+            self.run_ingestion_worker()
+
+            with mock.patch(
+                "games.vectorstores.embedding_cache.embed_documents",
+                side_effect=RuntimeError("Embedding failed"),
+            ):
+                GameAdmin(Game, AdminSite()).reingest_all_documents(request, [game])
+                self.run_ingestion_worker()
+
+            game.refresh_from_db()
+            self.assertFalse(game.ingested)
+            self.assertFalse(game.document_set.filter(ingested=True).exists())
+
+            GameAdmin(Game, AdminSite()).ingest_documents(request, [game])
+            self.run_ingestion_worker()
+
+        game.refresh_from_db()
+        self.assertTrue(game.ingested)
+        self.assertEqual(
+            game.vector_store.document_ids(), {document.id for document in documents}
+        )
+
+    def test_admin_actions_only_enqueue_jobs(self):
+        game = Game.objects.create(name="Test Game")
+        Document.objects.create(game=game, url="some-url")
+        request = self.get_ingest_documents_request()
+
+        with mock.patch(
+            "games.services.ingestion_job_service.ingest_document"
+        ) as ingest_document_mock:
+            GameAdmin(Game, AdminSite()).ingest_documents(request, [game])
+            GameAdmin(Game, AdminSite()).ingest_documents(request, [game])
+            GameAdmin(Game, AdminSite()).refresh_documents(request, [game])
+
+        ingest_document_mock.assert_not_called()
+        self.assertEqual(
+            sorted(IngestionJob.objects.values_list("kind", "state")),
+            [
+                (IngestionJob.INGEST, IngestionJob.QUEUED),
+                (IngestionJob.REFRESH, IngestionJob.QUEUED),
+            ],
+        )
+        self.assertIn(
+            reverse("admin:games_ingestionjob_changelist"),
+            str(list(request._messages)[0]),
+        )
+
+    def test_ingestion_job_list_refreshes_while_jobs_are_active(self):
+        user = get_user_model().objects.create_superuser(
+            "admin", "admin@example.com", "password"
+        )
+        self.client.force_login(user)
+        job = IngestionJob.objects.create(game=Game.objects.create(name="Test Game"))
+
+        response = self.client.get(reverse("admin:games_ingestionjob_changelist"))
+        self.assertContains(response, 'http-equiv="refresh"')
+        self.assertContains(response, "0/0 documents")
+
+        job.state = IngestionJob.SUCCEEDED
+        job.save()
+        response = self.client.get(reverse("admin:games_ingestionjob_changelist"))
+        self.assertNotContains(response, 'http-equiv="refresh"')
+
+
+class GameModelTest(TestCase):
+    def test_game_str(self):
+        game = Game.objects.create(name="Test Game")
+        self.assertEqual(str(game), "Test Game")
+
+    def test_game_with_docs(self):
+        game = Game.objects.create(name="Test Game")
+        Document.objects.create(game=game, url="some-url")
+        Document.objects.create(
+            game=game, url="some--other-url", display_name="some-different-url"
+        )
+
+
+class VectorStoreRegistryTest(TestCase):
+    def test_hits_and_misses(self):
+        registry = VectorStoreRegistry(max_bytes=100)
+
+        self.assertIsNone(registry.get((1, "a")))
+        registry.put((1, "a"), "index", 10)
+        self.assertEqual(registry.get((1, "a")), "index")
+
+        self.assertEqual(registry.stats()["hits"], 1)
+        self.assertEqual(registry.stats()["misses"], 1)
+
+    def test_evicts_least_recently_used_by_bytes(self):
+        registry = VectorStoreRegistry(max_bytes=100)
+        registry.put((1, "a"), "index 1", 40)
+        registry.put((2, "b"), "index 2", 40)
+        registry.get((1, "a"))  # Mark game 1 as recently used
+
+        registry.put((3, "c"), "index 3", 40)
+
+        self.assertIsNone(registry.get((2, "b")))
+        self.assertEqual(registry.get((1, "a")), "index 1")
+        self.assertEqual(registry.get((3, "c")), "index 3")
+        self.assertEqual(registry.stats()["evictions"], 1)
+        self.assertEqual(registry.stats()["bytes"], 80)
+
+    def test_does_not_cache_index_larger_than_budget(self):
+        registry = VectorStoreRegistry(max_bytes=100)
+        registry.put((1, "a"), "index", 101)
+
+        self.assertEqual(registry.stats()["entries"], 0)
+
+    def test_get_or_load_only_loads_once(self):
+        registry = VectorStoreRegistry(max_bytes=100)
+        loader = mock.Mock(return_value=("index", 10))
+
+        self.assertEqual(registry.get_or_load((1, "a"), loader), "index")
+        self.assertEqual(registry.get_or_load((1, "a"), loader), "index")
+
+        loader.assert_called_once()
+
+    def test_put_drops_other_versions_of_game(self):
+        registry = VectorStoreRegistry(max_bytes=100)
+        registry.put((1, "a"), "index 1a", 10)
+        registry.put((2, "a"), "index 2a", 10)
+
+        registry.put((1, "b"), "index 1b", 10)
+
+        self.assertIsNone(registry.get((1, "a")))
+        self.assertEqual(registry.get((1, "b")), "index 1b")
+        self.assertEqual(registry.stats()["bytes"], 20)
+
+    def test_invalidate_drops_all_versions_of_game(self):
+        registry = VectorStoreRegistry(max_bytes=100)
+        registry.put((1, "a"), "index 1a", 10)
+        registry.put((1, "b"), "index 1b", 10)
+        registry.put((2, "a"), "index 2a", 10)
+
+        registry.invalidate(1)
+
+        self.assertEqual(registry.stats()["entries"], 1)
+        self.assertEqual(registry.get((2, "a")), "index 2a")
+
+
+class LocalIndexCacheTest(TestCase):
+    def setUp(self):
+        self.storage = FileSystemStorage(location=tempfile.mkdtemp())
+        self.cache = LocalIndexCache(directory=tempfile.mkdtemp(), max_bytes=100)
+
+    def test_fetch_downloads_once(self):
+        name = self.storage.save("index", ContentFile(b"some index"))
+
+        first_path = self.cache.fetch(self.storage, name)
+        with mock.patch.object(self.storage, "open", side_effect=AssertionError):
+            second_path = self.cache.fetch(self.storage, name)
+
+        self.assertEqual(first_path, second_path)
+        self.assertEqual(second_path.read_bytes(), b"some index")
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_changed_file_is_fetched_again(self):
+        name = self.storage.save("index", ContentFile(b"some index"))
+        self.cache.fetch(self.storage, name)
+
+        # Overwrite the stored file with new contents
+        with self.storage.open(name, "wb") as file:
+            file.write(b"some other index")
+
+        path = self.cache.fetch(self.storage, name)
+
+        self.assertEqual(path.read_bytes(), b"some other index")
+        self.assertEqual(self.cache.stats()["misses"], 2)
+
+    def test_immutable_file_is_cached_without_checking_storage(self):
+        name = self.storage.save("index", ContentFile(b"some index"))
+        self.cache.fetch(self.storage, name, immutable=True)
+
+        with mock.patch.object(
+            self.storage, "size", side_effect=AssertionError
+        ), mock.patch.object(
+            self.storage, "get_modified_time", side_effect=AssertionError
+        ), mock.patch.object(
+            self.storage, "open", side_effect=AssertionError
+        ):
+            path = self.cache.fetch(self.storage, name, immutable=True)
+
+        self.assertEqual(path.read_bytes(), b"some index")
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    def test_evicts_least_recently_used_files_over_size_cap(self):
+        first = self.storage.save("first", ContentFile(b"a" * 40))
+        second = self.storage.save("second", ContentFile(b"b" * 40))
+        third = self.storage.save("third", ContentFile(b"c" * 40))
+
+        first_path = self.cache.fetch(self.storage, first)
+        second_path = self.cache.fetch(self.storage, second)
+        os.utime(first_path, (0, 0))  # Make the first file the least recently used
+        third_path = self.cache.fetch(self.storage, third)
+
+        self.assertFalse(first_path.exists())
+        self.assertTrue(second_path.exists())
+        self.assertTrue(third_path.exists())
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+        self.assertEqual(self.cache.stats()["bytes"], 80)
+
+    def test_failed_download_leaves_no_files(self):
+        name = self.storage.save("index", ContentFile(b"some index"))
+
+        with mock.patch.object(self.storage, "open", side_effect=OSError):
+            with self.assertRaises(OSError):
+                self.cache.fetch(self.storage, name)
+
+        self.assertEqual(os.listdir(self.cache.directory), [])
+
+
+class CompactDocstoreTest(TestCase):
+    def documents(self):
+        return {
+            "id-1": LangchainDocument(
+                id="id-1",
+                page_content="Page one with unicode: æøå",
+                metadata={
+                    "page": 0,
+                    "document_id": 7,
+                    "game_id": 3,
+                    "source": "rules.pdf",
+                },
+            ),
+            "id-2": LangchainDocument(
+                id="id-2",
+                page_content="Setup instructions",
+                metadata={"page": 1, "document_id": 7, "setup_page": True},
+            ),
+            "id-3": LangchainDocument(
+                id="id-3",
+                page_content="No metadata",
+                metadata={},
+            ),
+        }
+
+    def load(self, data):
+        with tempfile.NamedTemporaryFile(delete=False) as file:
+            file.write(data)
+        return docstores.CompactDocstore.load(file.name)
+
+    def test_round_trip(self):
+        documents = self.documents()
+        data = docstores.serialize(list(documents), InMemoryDocstore(dict(documents)))
+
+        docstore, index_to_docstore_id = self.load(data)
+
+        self.assertEqual(index_to_docstore_id, {0: "id-1", 1: "id-2", 2: "id-3"})
+        for doc_id, document in documents.items():
+            loaded_document = docstore.search(doc_id)
+            self.assertEqual(loaded_document.id, doc_id)
+            self.assertEqual(loaded_document.page_content, document.page_content)
+            self.assertEqual(loaded_document.metadata, document.metadata)
+
+    def test_only_materializes_documents_that_are_looked_up(self):
+        documents = self.documents()
+        docstore, _ = self.load(
+            docstores.serialize(list(documents), InMemoryDocstore(dict(documents)))
+        )
+
+        with mock.patch(
+            "games.docstores.Document", wraps=LangchainDocument
+        ) as document_mock:
+            docstore.search("id-2")
+
+        document_mock.assert_called_once()
+
+    def test_add_delete_and_serialize_again(self):
+        documents = self.documents()
+        docstore, _ = self.load(
+            docstores.serialize(["id-1", "id-2"], InMemoryDocstore(dict(documents)))
+        )
+
+        copy = docstore.copy()
+        copy.add({"id-3": documents["id-3"]})
+        copy.delete(["id-1"])
+
+        self.assertEqual(len(docstore), 2)  # The original is left untouched
+        self.assertEqual(len(copy), 2)
+        reloaded, index_to_docstore_id = self.load(
+            docstores.serialize(["id-2", "id-3"], copy)
+        )
+        self.assertEqual(index_to_docstore_id, {0: "id-2", 1: "id-3"})
+        self.assertEqual(reloaded.search("id-3").page_content, "No metadata")
+        self.assertEqual(reloaded.search("id-1"), "ID id-1 not found.")
+
+    def test_add_existing_id_fails(self):
+        documents = self.documents()
+        docstore, _ = self.load(
+            docstores.serialize(["id-1"], InMemoryDocstore(dict(documents)))
+        )
+
+        with self.assertRaises(ValueError):
+            docstore.add({"id-1": documents["id-1"]})
+
+
+class IndexFormatsTest(TestCase):
+    def test_parse_unknown_manifest_version(self):
+        with self.assertRaises(ValueError):
+            index_formats.parse_manifest(
+                b'{"format": "split", "version": 1, "index": "a.index", "docstore": "a.docstore"}'
+            )
+
+    def test_parse_legacy_index(self):
+        self.assertIsNone(index_formats.parse_manifest(b"\x80\x04legacy pickle"))
+
+
+class LexicalIndexTest(TestCase):
+    def build_index(self):
+        return LexicalIndex.build(
+            ["a", "b", "c"],
+            [
+                "Each player draws five cards at the start of the game",
+                "The player with the most victory points wins",
+                "Discard a card to move your pawn",
+            ],
+        )
+
+    def test_tokenize(self):
+        self.assertEqual(
+            tokenize("How many Victory Points do the players get?"),
+            ["many", "victory", "point", "player", "get"],
+        )
+
+    def test_search(self):
+        index = self.build_index()
+
+        results = index.search("victory points")
+        self.assertEqual([doc_id for doc_id, _ in results], ["b"])
+
+        results = index.search("cards", k=2)
+        self.assertEqual([doc_id for doc_id, _ in results], ["c", "a"])
+        self.assertGreater(results[0][1], results[1][1])  # The shorter section
+
+        self.assertEqual(index.search("unknown words"), [])
+
+    def test_serialize(self):
+        index = self.build_index()
+
+        loaded = LexicalIndex.load(index.serialize())
+
+        self.assertEqual(loaded.ids, index.ids)
+        self.assertEqual(loaded.search("card player"), index.search("card player"))
+
+    def test_merge(self):
+        index = self.build_index()
+        texts = ["Roll the dice and move", "Victory points are counted at the end"]
+        other = LexicalIndex.build(["d", "e"], texts)
+
+        merged = LexicalIndex.merge([index, other])
+
+        self.assertEqual(merged.ids, ["a", "b", "c", "d", "e"])
+        self.assertEqual(
+            merged.search("victory move", k=5),
+            LexicalIndex.build(
+                merged.ids,
+                [
+                    "Each player draws five cards at the start of the game",
+                    "The player with the most victory points wins",
+                    "Discard a card to move your pawn",
+                ]
+                + texts,
+            ).search("victory move", k=5),
+        )
+
+    def test_reciprocal_rank_fusion(self):
+        fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "a"]])
+
+        self.assertEqual([doc_id for doc_id, _ in fused], ["a", "c", "b"])
+
+
+class CountingEmbedding(DeterministicFakeEmbedding):
+    embedded_texts: list = []
+
+    def embed_documents(self, texts):
+        self.embedded_texts.extend(texts)
+        return super().embed_documents(texts)
+
+
+class EmbeddingCacheTest(TestCase):
+    def test_only_embeds_texts_that_are_not_cached(self):
+        cache = EmbeddingCache()
+        embedding = CountingEmbedding(size=8)
+
+        first = cache.embed_documents(embedding, ["a", "b", "a"])
+        second = cache.embed_documents(embedding, ["b", "c"])
+
+        self.assertEqual(embedding.embedded_texts, ["a", "b", "c"])
+        self.assertEqual(first[1], second[0])
+        self.assertEqual(first[0], first[2])
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 4})
+
+    def test_returns_the_embedded_vectors(self):
+        cache = EmbeddingCache()
+        embedding = DeterministicFakeEmbedding(size=8)
+
+        cache.embed_documents(embedding, ["some text"])
+        cached = cache.embed_documents(embedding, ["some text"])
+
+        self.assertTrue(
+            np.allclose(cached[0], embedding.embed_documents(["some text"])[0])
+        )
+
+    def test_keyed_on_model_and_dimension(self):
+        cache = EmbeddingCache()
+        cache.embed_documents(CountingEmbedding(size=8), ["some text"])
+
+        embedding = CountingEmbedding(size=16)
+        vectors = cache.embed_documents(embedding, ["some text"])
+
+        self.assertEqual(embedding.embedded_texts, ["some text"])
+        self.assertEqual(len(vectors[0]), 16)
+        self.assertEqual(
+            set(EmbeddingCacheEntry.objects.values_list("model", "dimension")),
+            {("CountingEmbedding", 8), ("CountingEmbedding", 16)},
+        )
+
+
+class IndexTypesTest(TestCase):
+    def test_build_and_memory_map_index_types(self):
+        vectors = np.random.default_rng(42).random((700, 16), dtype=np.float32)
+
+        for index_type, _ in index_types.INDEX_TYPE_CHOICES:
+            with self.subTest(index_type=index_type):
+                index = index_types.build_faiss_index(index_type, vectors)
+
+                with tempfile.NamedTemporaryFile() as file:
+                    faiss.write_index(index, file.name)
+                    loaded_index = faiss.read_index(
+                        file.name, index_formats.MMAP_IO_FLAGS
+                    )
+
+                _, positions = loaded_index.search(vectors[:10], 1)
+                self.assertGreaterEqual(np.mean(positions[:, 0] == np.arange(10)), 0.8)
+                self.assertEqual(
+                    loaded_index.reconstruct_n(0, 700).shape, vectors.shape
+                )
+
+    def test_small_ivf_pq_index_is_flat(self):
+        vectors = np.random.default_rng(42).random((10, 16), dtype=np.float32)
+
+        index = index_types.build_faiss_index(index_types.IVF_PQ, vectors)
+
+        self.assertIsInstance(index, faiss.IndexFlat)
+        self.assertEqual(
+            index_types.effective_index_type(index_types.IVF_PQ, 10), index_types.FLAT
+        )
+
+    def test_unknown_index_type(self):
+        with self.assertRaises(ValueError):
+            index_types.build_faiss_index("unknown", np.zeros((1, 4)))
+
+
+class PrewarmTest(TestCase):
+    def create_game(self, name, sessions=0, old_sessions=0, ingested=True):
+        game = Game.objects.create(name=name, ingested=ingested)
+        docs = PyPDFLoader("games/fixtures/test.pdf").load_and_split()
+        game.vector_store.add_documents(docs, 0)
+        for _ in range(sessions):
+            game.chatsession_set.create()
+        for _ in range(old_sessions):
+            session = game.chatsession_set.create()
+            game.chatsession_set.filter(pk=session.pk).update(
+                created_at=timezone.now() - timedelta(days=60)
+            )
+        return game
+
+    def test_popular_games_ranked_by_recent_sessions(self):
+        quiet_game = self.create_game("Quiet", sessions=1, old_sessions=5)
+        popular_game = self.create_game("Popular", sessions=3)
+        self.create_game("Not ingested", sessions=10, ingested=False)
+        Game.objects.create(name="No index", ingested=True)
+
+        self.assertEqual(popular_games(10, days=30), [popular_game, quiet_game])
+        self.assertEqual(popular_games(1, days=30), [popular_game])
+
+    def test_prewarm_loads_indexes_into_registry(self):
+        self.create_game("Game 1", sessions=2)
+        self.create_game("Game 2", sessions=1)
+        vector_store_registry.clear()
+
+        self.assertEqual(prewarm(limit=10, days=30, max_workers=2), 2)
+
+        self.assertEqual(vector_store_registry.stats()["entries"], 2)
+
+    def test_prewarm_indexes_command(self):
+        self.create_game("Game 1", sessions=2)
+        vector_store_registry.clear()
+        out = StringIO()
+
+        call_command("prewarm_indexes", "--games", "1", stdout=out)
+
+        self.assertIn("Prewarmed 1 game indexes", out.getvalue())
+
+    def test_prewarmer_is_ready_once_done(self):
+        prewarmer = Prewarmer()
+        self.assertTrue(prewarmer.ready)  # Never started
+
+        with mock.patch("games.prewarm.prewarm") as prewarm_mock:
+            loading = threading.Event()
+            prewarm_mock.side_effect = lambda: loading.wait(5)
+            prewarmer.start()
+            self.assertFalse(prewarmer.ready)
+
+            loading.set()
+            self.assertTrue(prewarmer.wait(5))
+
+        self.assertTrue(prewarmer.ready)
+        prewarm_mock.assert_called_once()
+
+    def test_prewarmer_is_ready_after_timeout(self):
+        prewarmer = Prewarmer(timeout_seconds=60)
+
+        with mock.patch("games.prewarm.prewarm") as prewarm_mock, mock.patch(
+            "games.prewarm.time.monotonic", return_value=100
+        ) as monotonic_mock:
+            loading = threading.Event()
+            prewarm_mock.side_effect = lambda: loading.wait(5)
+            prewarmer.start()
+            self.assertFalse(prewarmer.ready)
+
+            monotonic_mock.return_value = 160
+            self.assertTrue(prewarmer.ready)  # Still prewarming in the background
+
+            loading.set()
+            self.assertTrue(prewarmer.wait(5))
+
+    def test_prewarmer_is_ready_when_prewarm_fails(self):
+        prewarmer = Prewarmer()
+
+        with mock.patch(
+            "games.prewarm.prewarm", side_effect=Exception("S3 down")
+        ), self.assertLogs("games.prewarm", level="ERROR"):
+            prewarmer.start()
+            self.assertTrue(prewarmer.wait(5))
+
+        self.assertTrue(prewarmer.ready)
+
+
+class MigrateIndexesCommandTest(TestCase):
+    def create_legacy_game(self, name="Test Game"):
+        game = Game.objects.create(name=name)
+        docs = PyPDFLoader("games/fixtures/test.pdf").load_and_split()
+        for doc in docs:
+            doc.metadata["document_id"] = 0
+        legacy_index = FAISS.from_documents(docs, GameVectorStore(game).embedding)
+        game.faiss_file.save("legacy", ContentFile(legacy_index.serialize_to_bytes()))
+        return game
+
+    def migrate_indexes(self, *args):
+        out = StringIO()
+        call_command("migrate_indexes", "--workers", "1", *args, stdout=out, stderr=out)
+        return out.getvalue()
+
+    def test_migrates_legacy_indexes(self):
+        vector_store_registry.clear()
+        game = self.create_legacy_game()
+        legacy_name = game.faiss_file.name
+
+        output = self.migrate_indexes()
+
+        self.assertIn("Migrated 1", output)
+        game.refresh_from_db()
+        self.assertEqual(game.index_format_version, index_formats.SPLIT_FORMAT_VERSION)
+        self.assertFalse(game.faiss_file.storage.exists(legacy_name))
+        with game.faiss_file.open("rb") as file:
+            self.assertIsNotNone(index_formats.parse_manifest(file.read()))
+
+        vector_store_registry.clear()
+        results = game.vector_store.index.similarity_search("This is some text")
+        self.assertEqual(len(results), 2)
+
+    def test_resume_skips_migrated_games(self):
+        self.create_legacy_game()
+        self.migrate_indexes()
+
+        with mock.patch.object(GameVectorStore, "upgrade_format") as upgrade_mock:
+            output = self.migrate_indexes()
+
+        self.assertIn("0 game indexes to migrate", output)
+        upgrade_mock.assert_not_called()
+
+    def test_records_version_of_split_indexes(self):
+        game = Game.objects.create(name="Test Game")
+        game.vector_store.add_documents(
+            PyPDFLoader("games/fixtures/test.pdf").load_and_split(), 0
+        )
+        Game.objects.filter(pk=game.pk).update(index_format_version=None)
+
+        output = self.migrate_indexes()
+
+        self.assertIn("recorded 1", output)
+        game.refresh_from_db()
+        self.assertEqual(game.index_format_version, index_formats.SPLIT_FORMAT_VERSION)
+
+    def test_dry_run(self):
+        game = self.create_legacy_game()
+        legacy_name = game.faiss_file.name
+
+        output = self.migrate_indexes("--dry-run")
+
+        self.assertIn(f"Test Game ({game.id}): legacy pickle", output)
+        game.refresh_from_db()
+        self.assertEqual(game.faiss_file.name, legacy_name)
+        self.assertIsNone(game.index_format_version)
+
+    def test_failed_verification_keeps_legacy_index(self):
+        vector_store_registry.clear()
+        game = self.create_legacy_game()
+        legacy_name = game.faiss_file.name
+        storage = game.faiss_file.storage
+        files_before = set(storage.listdir("games/faiss_indexes")[1])
+
+        with mock.patch.object(
+            index_formats, "verify_same_index", side_effect=ValueError("Vectors differ")
+        ):
+            output = self.migrate_indexes()
+
+        self.assertIn("Vectors differ", output)
+        self.assertIn("failed 1", output)
+        game.refresh_from_db()
+        self.assertEqual(game.faiss_file.name, legacy_name)
+        self.assertIsNone(game.index_format_version)
+        self.assertEqual(set(storage.listdir("games/faiss_indexes")[1]), files_before)
+
+
+class QueryEmbeddingCacheTest(TestCase):
+    def test_local_and_shared_hits(self):
+        embedding = mock.Mock(wraps=DeterministicFakeEmbedding(size=8))
+        embedding.model = "fake"
+        embedding.dimensions = 8
+        cache = QueryEmbeddingCache(max_entries=10, ttl_seconds=60)
+
+        vector = cache.embed_query(embedding, "How do I  set up?")
+        self.assertEqual(cache.embed_query(embedding, "how do i set up?"), vector)
+
+        # Another worker finds the embedding in the shared table
+        other_cache = QueryEmbeddingCache(max_entries=10, ttl_seconds=60)
+        self.assertEqual(other_cache.embed_query(embedding, "How do I set up?"), vector)
+
+        embedding.embed_query.assert_called_once_with("how do i set up?")
+        self.assertEqual(cache.stats()["local_hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+        self.assertEqual(cache.stats()["hit_rate"], 0.5)
+        self.assertEqual(other_cache.stats()["shared_hits"], 1)
+
+    def test_expired_embeddings_are_embedded_again(self):
+        embedding = mock.Mock(wraps=DeterministicFakeEmbedding(size=8))
+        embedding.model = "fake"
+        embedding.dimensions = 8
+        cache = QueryEmbeddingCache(max_entries=10, ttl_seconds=60)
+        cache.embed_query(embedding, "question")
+
+        later = timezone.now() + timedelta(seconds=61)
+        with mock.patch("django.utils.timezone.now", return_value=later):
+            cache.embed_query(embedding, "question")
+            QueryEmbeddingCache(max_entries=10, ttl_seconds=60).embed_query(
+                embedding, "question"
+            )
+
+        self.assertEqual(embedding.embed_query.call_count, 2)
+        self.assertEqual(QueryEmbedding.objects.count(), 1)
+
+    def test_in_process_entries_are_bounded(self):
+        cache = QueryEmbeddingCache(max_entries=2, ttl_seconds=60)
+        embedding = DeterministicFakeEmbedding(size=8)
+
+        for query in ["a", "b", "c"]:
+            cache.embed_query(embedding, query)
+        cache.embed_query(embedding, "a")
+
+        self.assertEqual(cache.stats()["entries"], 2)
+        self.assertEqual(cache.stats()["shared_hits"], 1)
+
+    def test_prune_deletes_expired_embeddings(self):
+        cache = QueryEmbeddingCache(max_entries=2, ttl_seconds=60)
+        cache.embed_query(DeterministicFakeEmbedding(size=8), "question")
+        QueryEmbedding.objects.update(
+            embedded_at=timezone.now() - timedelta(seconds=61)
+        )
+
+        cache.prune()
+
+        self.assertEqual(QueryEmbedding.objects.count(), 0)
+
+
+class VectorStoreStatsTest(TestCase):
+    def setUp(self):
+        vector_store_registry.clear()
+        vector_store_stats.clear()
+        self.game = Game.objects.create(name="Test Game")
+        GameVectorStore(self.game).add_documents(
+            PyPDFLoader("games/fixtures/test.pdf").load_and_split(), 0
+        )
+        vector_store_registry.clear()
+
+    def test_loading_index_records_stats(self):
+        Game.objects.get(pk=self.game.id).vector_store
+        Game.objects.get(pk=self.game.id).vector_store  # Served by the registry
+        vector_store_registry.clear()
+        Game.objects.get(pk=self.game.id).vector_store
+
+        stats = vector_store_stats.game_stats()[self.game.id]
+        with self.game.faiss_file.open("rb") as file:
+            segment = index_formats.parse_manifest(file.read())["segments"][0]
+        storage = self.game.faiss_file.storage
+        self.assertEqual(stats["loads"], 2)
+        self.assertEqual(stats["vector_count"], 2)
+        self.assertEqual(stats["segments"], 1)
+        self.assertTrue(stats["memory_mapped"])
+        self.assertEqual(stats["index_bytes"], storage.size(segment["index"]))
+        self.assertEqual(stats["docstore_bytes"], storage.size(segment["docstore"]))
+        self.assertEqual(stats["lexical_bytes"], storage.size(segment["lexical"]))
+        self.assertGreater(stats["fetch_ms"], 0)
+        self.assertGreater(stats["deserialize_ms"], 0)
+
+    def test_admin_views(self):
+        User = get_user_model()
+        User.objects.create_superuser(
+            username="admin", email="admin@test.com", password="password"
+        )
+        self.client.login(username="admin", password="password")
+        Game.objects.get(pk=self.game.id).vector_store
+
+        response = self.client.get("/admin/games/game/")
+        self.assertContains(response, "/admin/games/game/vector-store-stats/")
+
+        response = self.client.get("/admin/games/game/vector-store-stats/")
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Vector Store Stats")
+        self.assertContains(response, "Test Game")
+
+        response = self.client.get("/admin/games/game/vector-store-stats.json")
+        self.assertEqual(response.status_code, 200)
+        stats = response.json()
+        self.assertEqual(stats["pid"], os.getpid())
+        self.assertEqual(stats["games"][str(self.game.id)]["vector_count"], 2)
+        self.assertEqual(stats["registry"]["entries"], 1)
+        self.assertIn("hit_rate", stats["query_embedding_cache"])
+
+    def test_ingestion_throughput_view(self):
+        User = get_user_model()
+        User.objects.create_superuser(
+            username="admin", email="admin@test.com", password="password"
+        )
+        self.client.login(username="admin", password="password")
+        document = Document.objects.create(game=self.game, display_name="Rules")
+        IngestionRun.objects.create(
+            document=document,
+            outcome=IngestionRun.INGESTED,
+            seconds=2.0,
+            pages=10,
+            sections=30,
+            embed_seconds=1.5,
+            persist_seconds=0.5,
+        )
+
+        response = self.client.get("/admin/games/game/")
+        self.assertContains(response, "/admin/games/game/ingestion-throughput/")
+
+        response = self.client.get("/admin/games/game/ingestion-throughput/")
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "5.0/s")  # pages per second
+        self.assertContains(response, "75%")  # share of embedding
+
+        response = self.client.get(f"/admin/games/game/{self.game.id}/change/")
+        self.assertContains(response, "Ingested in 2.0s: 10 pages, 30 sections")
+
+        response = self.client.get("/admin/games/ingestionrun/")
+        self.assertContains(response, "Test Game")
+
+    def test_throughput(self):
+        runs = [
+            IngestionRun(
+                seconds=3.0, pages=30, sections=60, tokens=600, embed_seconds=2
+            ),
+            IngestionRun(seconds=1.0, pages=10, sections=20, parse_seconds=2),
+        ]
+
+        result = throughput(runs)
+
+        self.assertEqual(result["runs"], 2)
+        self.assertEqual(result["pages_per_second"], 10.0)
+        self.assertEqual(result["sections_per_second"], 20.0)
+        self.assertEqual(result["tokens_per_second"], 150.0)
+        stages = {stage["stage"]: stage for stage in result["stages"]}
+        self.assertEqual(stages["embed"]["share"], 0.5)
+        self.assertEqual(stages["parse"]["seconds"], 2)
+        self.assertEqual(throughput([])["pages_per_second"], 0.0)
+
+    @prevent_request_warnings
+    def test_admin_views_require_authentication(self):
+        for url in [
+            "/admin/games/game/vector-store-stats/",
+            "/admin/games/game/vector-store-stats.json",
+            "/admin/games/game/ingestion-throughput/",
+        ]:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 302)
+            self.assertTrue(response.url.startswith("/admin/login/"))
+
+
+class RulebookRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    etag = '"v1"'
+    last_modified = "Wed, 01 Jan 2025 00:00:00 GMT"
+    failures = 0
+    requests = []
+
+    def do_GET(self):
+        cls = type(self)
+        cls.requests.append((self.path, dict(self.headers), self.client_address))
+        with open("games/fixtures/test.pdf", "rb") as file:
+            body = file.read()
+
+        if self.path == "/flaky.pdf" and cls.failures > 0:
+            cls.failures -= 1
+            return self.respond(503, b"try again")
+        if self.path == "/missing.pdf":
+            return self.respond(404, b"not found")
+        if self.path == "/streamed.pdf":
+            # No Content-Length, the size is only known while streaming
+            self.send_response(200)
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.wfile.write(body)
+            self.close_connection = True
+            return
+        if self.headers.get("If-None-Match") == cls.etag:
+            return self.respond(304, b"")
+
+        self.respond(200, body, {"ETag": cls.etag, "Last-Modified": cls.last_modified})
+
+    def respond(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DownloadServiceTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), RulebookRequestHandler)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        RulebookRequestHandler.etag = '"v1"'
+        RulebookRequestHandler.failures = 0
+        RulebookRequestHandler.requests = []
+
+    def test_download_streams_to_file(self):
+        with tempfile.NamedTemporaryFile() as file:
+            result = download_to_file(f"{self.base_url}/rulebook.pdf", file)
+
+            with open("games/fixtures/test.pdf", "rb") as fixture:
+                self.assertEqual(file.read(), fixture.read())
+        self.assertFalse(result.not_modified)
+        self.assertEqual(result.etag, '"v1"')
+        self.assertEqual(result.last_modified, RulebookRequestHandler.last_modified)
+        self.assertEqual(result.bytes, os.path.getsize("games/fixtures/test.pdf"))
+
+    def test_connections_are_kept_alive(self):
+        with tempfile.NamedTemporaryFile() as file:
+            download_to_file(f"{self.base_url}/rulebook.pdf", file)
+            download_to_file(f"{self.base_url}/rulebook.pdf", file)
+
+        client_addresses = {request[2] for request in RulebookRequestHandler.requests}
+        self.assertEqual(len(client_addresses), 1)
+
+    def test_conditional_download(self):
+        with tempfile.NamedTemporaryFile() as file:
+            result = download_to_file(
+                f"{self.base_url}/rulebook.pdf",
+                file,
+                etag='"v1"',
+                last_modified=RulebookRequestHandler.last_modified,
+            )
+            self.assertTrue(result.not_modified)
+            self.assertEqual(file.read(), b"")
+
+            RulebookRequestHandler.etag = '"v2"'
+            result = download_to_file(
+                f"{self.base_url}/rulebook.pdf", file, etag='"v1"'
+            )
+            self.assertFalse(result.not_modified)
+            self.assertEqual(result.etag, '"v2"')
+
+        headers = RulebookRequestHandler.requests[0][1]
+        self.assertEqual(headers["If-None-Match"], '"v1"')
+        self.assertEqual(
+            headers["If-Modified-Since"], RulebookRequestHandler.last_modified
+        )
+
+    def test_retries_server_errors(self):
+        RulebookRequestHandler.failures = 1
+
+        with tempfile.NamedTemporaryFile() as file:
+            result = download_to_file(f"{self.base_url}/flaky.pdf", file)
+
+        self.assertEqual(result.bytes, os.path.getsize("games/fixtures/test.pdf"))
+        self.assertEqual(len(RulebookRequestHandler.requests), 2)
+
+    def test_error_responses_raise(self):
+        with tempfile.NamedTemporaryFile() as file:
+            with self.assertRaises(requests.HTTPError):
+                download_to_file(f"{self.base_url}/missing.pdf", file)
+
+    @override_settings(RULEBOOK_DOWNLOAD_MAX_BYTES=1000)
+    def test_size_cap(self):
+        for path in ["/rulebook.pdf", "/streamed.pdf"]:
+            with tempfile.NamedTemporaryFile() as file:
+                with self.assertRaises(DownloadTooLargeError):
+                    download_to_file(f"{self.base_url}{path}", file)
+                self.assertLessEqual(os.path.getsize(file.name), 1000)
+
+    def test_ingest_skips_unchanged_rulebook(self):
+        game = Game.objects.create(name="Test Game")
+        document = Document.objects.create(
+            game=game, url=f"{self.base_url}/rulebook.pdf"
+        )
+
+        self.assertTrue(ingest_document(document))
+        self.assertEqual(document.source_etag, '"v1"')
+        faiss_file_name = game.vector_store.game.faiss_file.name
+
+        document.refresh_from_db()
+        self.assertFalse(ingest_document(document))
+        self.assertEqual(Game.objects.get(pk=game.id).faiss_file.name, faiss_file_name)
+
+        RulebookRequestHandler.etag = '"v2"'
+        self.assertTrue(ingest_document(document))
+        document.refresh_from_db()
+        self.assertEqual(document.source_etag, '"v2"')
+        self.assertEqual(
+            Game.objects.get(pk=game.id).vector_store.document_ids(), {document.id}
+        )
+
+    def test_ingest_downloads_changed_document(self):
+        game = Game.objects.create(name="Test Game")
+        document = Document.objects.create(
+            game=game, url=f"{self.base_url}/rulebook.pdf"
+        )
+        ingest_document(document)
+
+        # Changing the pages of a document in the admin marks it as not ingested
+        document.ignore_pages = "2"
+        document.ingested = False
+        self.assertTrue(ingest_document(document))
+
+        self.assertNotIn("If-None-Match", RulebookRequestHandler.requests[-1][1])
+        self.assertEqual(game.vector_store.index.index.ntotal, 1)
+
+
+class PdfPagesTest(TestCase):
+    def write_file(self, data):
+        file = tempfile.NamedTemporaryFile(suffix=".pdf")
+        file.write(data)
+        file.flush()
+        self.addCleanup(file.close)
+        return file.name
+
+    def test_load_pages_matches_pymupdf_loader(self):
+        self.assertEqual(
+            load_pages("games/fixtures/test.pdf"),
+            PyMuPDFLoader("games/fixtures/test.pdf").load(),
+        )
+
+    def write_rulebook(self, pages):
+        pdf = pymupdf.open()
+        pdf.set_metadata({"title": "Rulebook", "author": "Test"})
+        for number in range(pages):
+            pdf.new_page().insert_text((72, 72), f"Rules of page {number + 1}")
+        return self.write_file(pdf.tobytes())
+
+    def test_parallel_load_pages_matches_serial(self):
+        filename = self.write_rulebook(7)
+
+        serial_pages = load_pages(filename)
+        parallel_pages = load_pages(filename, workers=2, parallel_min_pages=5)
+
+        self.assertEqual(parallel_pages, serial_pages)
+        self.assertEqual(parallel_pages, PyMuPDFLoader(filename).load())
+        self.assertEqual(
+            [page.metadata["page"] for page in parallel_pages], list(range(7))
+        )
+
+    def test_small_files_are_loaded_serially(self):
+        filename = self.write_rulebook(3)
+
+        with mock.patch(
+            "games.loaders.pdf_pages._parallel_page_texts"
+        ) as parallel_mock:
+            pages = load_pages(filename, workers=2, parallel_min_pages=5)
+
+        parallel_mock.assert_not_called()
+        self.assertEqual(pages, load_pages(filename))
+
+    def test_iter_pages_matches_load_pages(self):
+        filename = self.write_rulebook(4)
+
+        self.assertEqual(list(iter_pages(filename)), load_pages(filename))
+        self.assertEqual(
+            [page.page_content for page in iter_pages(filename, [3, 1])],
+            ["Rules of page 2", "Rules of page 4"],
+        )
+
+    def test_parallel_iter_pages_matches_load_pages(self):
+        filename = self.write_rulebook(7)
+
+        self.assertEqual(
+            list(iter_pages(filename, workers=2, parallel_min_pages=5)),
+            load_pages(filename),
+        )
+
+    def test_iter_pages_extracts_serially_when_the_pool_breaks(self):
+        filename = self.write_rulebook(7)
+        executor = mock.Mock()
+        executor.submit.side_effect = BrokenProcessPool
+
+        with mock.patch(
+            "games.loaders.pdf_pages._get_executor", return_value=executor
+        ), self.assertLogs("games.loaders.pdf_pages", "WARNING"):
+            pages = list(iter_pages(filename, workers=2, parallel_min_pages=5))
+
+        self.assertEqual(pages, load_pages(filename))
+
+    def test_extract_page_range(self):
+        filename = self.write_rulebook(4)
+
+        self.assertEqual(
+            extract_page_range(filename, 1, 3),
+            ["Rules of page 2", "Rules of page 3"],
+        )
+
+    def test_invalid_files(self):
+        with open("games/fixtures/test.pdf", "rb") as file:
+            pdf_data = file.read()
+        encrypted = pymupdf.open()
+        encrypted.new_page()
+        encrypted_data = encrypted.tobytes(
+            encryption=pymupdf.PDF_ENCRYPT_AES_256, user_pw="user", owner_pw="owner"
+        )
+
+        for data, reason in [
+            (b"<html>Not found</html>", NOT_A_PDF),
+            (b"", NOT_A_PDF),
+            (pdf_data[:300], NO_PAGES),
+            (encrypted_data, ENCRYPTED),
+        ]:
+            with self.subTest(reason=reason, size=len(data)):
+                with self.assertRaises(InvalidPdfError) as context:
+                    load_pages(self.write_file(data))
+                self.assertEqual(context.exception.reason, reason)
+
+    def test_ingest_invalid_file(self):
+        game = Game.objects.create(name="Test Game")
+        document = Document.objects.create(game=game, url="some-url")
+
+        def download_html(url, file, **validators):
+            file.write(b"<html>Not found</html>")
+            file.flush()
+            return DownloadResult()
+
+        with mock.patch(
+            "games.services.document_ingestion_service._download_to_file"
+        ) as _download_to_file_mock:
+            _download_to_file_mock.side_effect = download_html
+            with self.assertRaises(InvalidPdfError) as context:
+                ingest_document(document)
+
+        self.assertEqual(context.exception.reason, NOT_A_PDF)
+        self.assertFalse(Document.objects.get(pk=document.id).ingested)
+        self.assertIsNone(Game.objects.get(pk=game.id).vector_store.index)
+
+
+class EmbeddingRequestHandler(BaseHTTPRequestHandler):
+    """
+    A fake OpenAI embeddings API that answers with latency and rate limits the first requests.
+    """
+
+    protocol_version = "HTTP/1.1"
+    latency_seconds = 0.0
+    rate_limited = 0
+    retry_after = "0.05"
+    batches = []
+    in_flight = 0
+    max_in_flight = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        cls = type(self)
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with cls.lock:
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+            throttle = cls.rate_limited > 0
+            if throttle:
+                cls.rate_limited -= 1
+            else:
+                cls.batches.append(request["input"])
+        try:
+            time.sleep(cls.latency_seconds)
+            if throttle:
+                return self.respond(
+                    429,
+                    {"error": {"message": "Rate limit reached", "type": "requests"}},
+                    {"Retry-After": cls.retry_after},
+                )
+            self.respond(
+                200,
+                {
+                    "object": "list",
+                    "model": request["model"],
+                    "data": [
+                        {
+                            "object": "embedding",
+                            "index": i,
+                            "embedding": fake_vector(text),
+                        }
+                        for i, text in reversed(list(enumerate(request["input"])))
+                    ],
+                    "usage": {"prompt_tokens": 1, "total_tokens": 1},
+                },
+            )
+        finally:
+            with cls.lock:
+                cls.in_flight -= 1
+
+    def respond(self, status, body, headers=None):
+        body = json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def fake_vector(text):
+    return [float(len(text)), float(sum(map(ord, text)) % 1000)]
+
+
+class EmbeddingBackendsTest(TestCase):
+    def test_hashed_embedding(self):
+        embedding = HashedNgramEmbedding(dimensions=256)
+        texts = [
+            "Each player draws five cards at the start of the game.",
+            "At the start of the game every player draws 5 cards.",
+            "Victory points are scored for completed routes.",
+            "",
+        ]
+
+        vectors = np.array(embedding.embed_documents(texts))
+
+        self.assertEqual(vectors.shape, (4, 256))
+        np.testing.assert_allclose(np.linalg.norm(vectors[:3], axis=1), 1.0)
+        self.assertFalse(vectors[3].any())
+        # similar texts are closer than unrelated texts
+        self.assertGreater(vectors[0] @ vectors[1], vectors[0] @ vectors[2] + 0.3)
+        np.testing.assert_allclose(
+            HashedNgramEmbedding(dimensions=256, use_numpy=False).embed_documents(
+                texts
+            ),
+            vectors,
+        )
+        self.assertEqual(embedding.embed_query(texts[0]), vectors[0].tolist())
+
+    def test_get_embedding(self):
+        self.assertIs(
+            embedding_backends.get_embedding(embedding_backends.HASHED),
+            embedding_backends.get_embedding(embedding_backends.HASHED),
+        )
+        self.assertEqual(
+            embedding_backends.backend_name(
+                embedding_backends.get_embedding(embedding_backends.HASHED)
+            ),
+            embedding_backends.HASHED,
+        )
+        with self.assertRaises(ValueError):
+            embedding_backends.get_embedding("unknown")
+
+    def test_games_can_not_be_set_to_the_fake_backend(self):
+        game = Game(name="Test Game", embedding_backend=embedding_backends.FAKE)
+
+        with self.assertRaises(ValidationError):
+            game.full_clean()
+
+    def test_game_with_hashed_backend(self):
+        game = Game.objects.create(
+            name="Test Game", embedding_backend=embedding_backends.HASHED
+        )
+        document = Document.objects.create(game=game, url="some-url")
+
+        with mock.patch(
+            "games.services.document_ingestion_service._download_to_file"
+        ) as _download_to_file_mock:
+            _download_to_file_mock.side_effect = copy_test_pdf
+            ingest_document(document)
+
+        vector_store_registry.clear()
+        vector_store = Game.objects.get(pk=game.id).vector_store
+        with game.faiss_file.open("rb") as file:
+            segment = index_formats.parse_manifest(file.read())["segments"][0]
+        self.assertEqual(segment["embedding_backend"], embedding_backends.HASHED)
+        self.assertIsInstance(vector_store.embedding, HashedNgramEmbedding)
+        results = vector_store.index.similarity_search_by_vector(
+            vector_store.embed_query("some different text"), k=1
+        )
+        self.assertIn("Page 2", results[0].page_content)
+        # local embeddings are not cached
+        self.assertEqual(EmbeddingCacheEntry.objects.count(), 0)
+        self.assertEqual(QueryEmbedding.objects.count(), 0)
+
+    def test_changing_backend_reembeds_game(self):
+        game = Game.objects.create(name="Test Game")
+        Document.objects.create(game=game, url="some-url")
+        Document.objects.create(game=game, url="some-other-url")
+
+        with mock.patch(
+            "games.services.document_ingestion_service._download_to_file"
+        ) as _download_to_file_mock:
+            _download_to_file_mock.side_effect = copy_test_pdf
+            ingest_game(game)
+
+            game = Game.objects.get(pk=game.id)
+            game.embedding_backend = embedding_backends.HASHED
+            game.save()
+
+            # the index is queried with the backend it was embedded with until the game is ingested again
+            vector_store = Game.objects.get(pk=game.id).vector_store
+            self.assertEqual(vector_store.embedding_backend, embedding_backends.FAKE)
+            self.assertIsInstance(vector_store.embedding, DeterministicFakeEmbedding)
+
+            ingest_game(Game.objects.get(pk=game.id))
+
+        vector_store = Game.objects.get(pk=game.id).vector_store
+        self.assertEqual(vector_store.embedding_backend, embedding_backends.HASHED)
+        self.assertIsInstance(vector_store.embedding, HashedNgramEmbedding)
+        self.assertEqual(vector_store.index.index.ntotal, 4)
+        self.assertEqual(_download_to_file_mock.call_count, 4)
+
+
+class EmbeddingSchedulerTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), EmbeddingRequestHandler)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}/v1"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        EmbeddingRequestHandler.latency_seconds = 0.0
+        EmbeddingRequestHandler.rate_limited = 0
+        EmbeddingRequestHandler.batches = []
+        EmbeddingRequestHandler.max_in_flight = 0
+
+    def scheduler(self, **kwargs):
+        return EmbeddingScheduler(
+            model="text-embedding-ada-002",
+            api_key="test",
+            base_url=self.base_url,
+            retry_backoff_seconds=0.01,
+            **kwargs,
+        )
+
+    def test_batches_are_bounded_by_tokens_and_size(self):
+        scheduler = self.scheduler(max_batch_tokens=10, max_batch_size=3)
+        texts = ["a" * 12, "b" * 12, "c" * 40, "d", "e", "f", "g"]
+
+        self.assertEqual(
+            scheduler.batches(texts),
+            [["a" * 12, "b" * 12], ["c" * 40], ["d", "e", "f"], ["g"]],
+        )
+
+    def test_embeds_concurrently_in_order(self):
+        EmbeddingRequestHandler.latency_seconds = 0.05
+        scheduler = self.scheduler(max_batch_size=2, max_concurrency=3)
+        texts = [f"Rule {number} " * number for number in range(1, 12)]
+
+        vectors = scheduler.embed_documents(texts)
+
+        self.assertEqual(vectors, [fake_vector(text) for text in texts])
+        self.assertEqual(len(EmbeddingRequestHandler.batches), 6)
+        self.assertGreater(EmbeddingRequestHandler.max_in_flight, 1)
+        self.assertLessEqual(EmbeddingRequestHandler.max_in_flight, 3)
+
+    def test_embeds_from_a_running_event_loop(self):
+        scheduler = self.scheduler()
+        texts = ["Setup", "Scoring"]
+
+        async def embed():
+            return scheduler.embed_documents(texts)
+
+        self.assertEqual(asyncio.run(embed()), [fake_vector(text) for text in texts])
+
+    def test_retries_after_rate_limit(self):
+        EmbeddingRequestHandler.rate_limited = 2
+        scheduler = self.scheduler(max_batch_size=1, max_concurrency=2)
+        texts = ["Setup", "Turn order", "Scoring"]
+
+        started_at = time.monotonic()
+        vectors = scheduler.embed_documents(texts)
+
+        self.assertEqual(vectors, [fake_vector(text) for text in texts])
+        self.assertEqual(scheduler.throttled, 2)
+        self.assertEqual(scheduler.requests, 5)
+        self.assertGreaterEqual(time.monotonic() - started_at, 0.05)
+
+    def test_gives_up_after_max_retries(self):
+        EmbeddingRequestHandler.rate_limited = 10
+        scheduler = self.scheduler(max_retries=2)
+
+        with self.assertRaises(openai.RateLimitError):
+            scheduler.embed_documents(["Setup"])
+        self.assertEqual(scheduler.requests, 3)
+
+    def test_retry_after_seconds(self):
+        for headers, expected in [
+            ({"retry-after": "2"}, 2.0),
+            ({"retry-after-ms": "250"}, 0.25),
+            ({"retry-after": "soon"}, None),
+            ({}, None),
+        ]:
+            with self.subTest(headers=headers):
+                response = mock.Mock(headers=headers)
+                self.assertEqual(retry_after_seconds(response), expected)
+
+    def test_ingestion_embeds_openai_sections_with_the_scheduler(self):
+        embedding = OpenAIEmbeddings(api_key="test", base_url=self.base_url)
+        scheduler = ingestion_embedding(embedding)
+
+        self.assertIsInstance(scheduler, EmbeddingScheduler)
+        self.assertEqual(scheduler.base_url, self.base_url)
+        self.assertEqual(
+            embedding_model_name(scheduler), embedding_model_name(embedding)
+        )
+        fake_embedding = DeterministicFakeEmbedding(size=8)
+        self.assertIs(ingestion_embedding(fake_embedding), fake_embedding)
+
+    def test_add_documents_stores_scheduled_vectors(self):
+        embedding = OpenAIEmbeddings(api_key="test", base_url=self.base_url)
+        vector_store = GameVectorStore(Game.objects.create(name="Test Game"), embedding)
+        sections = [
+            LangchainDocument(page_content=f"Rule {number}") for number in range(5)
+        ]
+
+        vector_store.add_documents(sections, 1)
+
+        self.assertEqual(
+            [
+                vector_store.index.index.reconstruct(position).tolist()
+                for position in range(5)
+            ],
+            [fake_vector(f"Rule {number}") for number in range(5)],
+        )
+
+    @override_settings(EMBEDDING_BATCH_MAX_SIZE=2, EMBEDDING_MAX_CONCURRENCY=3)
+    def test_add_document_batches_embeds_batches_concurrently(self):
+        EmbeddingRequestHandler.latency_seconds = 0.05
+        embedding = OpenAIEmbeddings(api_key="test", base_url=self.base_url)
+        vector_store = GameVectorStore(Game.objects.create(name="Test Game"), embedding)
+        # Batches of the ingestion pipeline, each fits in a single request
+        batches = [
+            [
+                LangchainDocument(page_content=f"Rule {number}")
+                for number in range(start, start + 2)
+            ]
+            for start in range(0, 12, 2)
+        ]
+
+        vector_store.add_document_batches(iter(batches), 1)
+
+        self.assertEqual(len(EmbeddingRequestHandler.batches), 6)
+        self.assertEqual(EmbeddingRequestHandler.max_in_flight, 3)
+        self.assertEqual(
+            [
+                vector_store.index.index.reconstruct(position).tolist()
+                for position in range(12)
+            ],
+            [fake_vector(f"Rule {number}") for number in range(12)],
+        )
+
+
+class IngestionJobTest(TestCase):
+    def test_claim_next_job(self):
+        game = Game.objects.create(name="Test Game")
+        other_game = Game.objects.create(name="Other Game")
+        first = enqueue(game)
+        second = enqueue(game, IngestionJob.REINGEST_ALL)
+        third = enqueue(other_game)
+
+        self.assertEqual(enqueue(game), first)
+
+        job = claim_next_job("worker-1")
+        self.assertEqual(job, first)
+        self.assertEqual(job.state, IngestionJob.RUNNING)
+        self.assertEqual(job.worker, "worker-1")
+        self.assertEqual(job.attempts, 1)
+        # jobs of a game with a running job wait for it to finish
+        self.assertEqual(claim_next_job("worker-2"), third)
+        self.assertIsNone(claim_next_job("worker-2"))
+
+        run_job(job)
+        self.assertEqual(claim_next_job("worker-2"), second)
+
+    def test_interleaved_claims_do_not_run_jobs_of_the_same_game(self):
+        game = Game.objects.create(name="Test Game")
+        first = enqueue(game)
+        enqueue(game, IngestionJob.REINGEST_ALL)
+        first_claims = []
+        now = timezone.now
+
+        def claim_first_after_selecting_candidates():
+            # Worker 1 claims the first job after worker 2 has selected its candidates
+            if not first_claims:
+                first_claims.append(None)
+                first_claims[0] = claim_next_job("worker-1")
+            return now()
+
+        with mock.patch(
+            "games.services.ingestion_job_service.timezone.now",
+            side_effect=claim_first_after_selecting_candidates,
+        ):
+            second_claim = claim_next_job("worker-2")
+
+        self.assertEqual(first_claims, [first])
+        self.assertIsNone(second_claim)
+        self.assertEqual(
+            IngestionJob.objects.filter(state=IngestionJob.RUNNING).count(), 1
+        )
+
+    def test_running_jobs_of_the_same_game_are_rejected(self):
+        game = Game.objects.create(name="Test Game")
+        IngestionJob.objects.create(game=game, state=IngestionJob.RUNNING)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            IngestionJob.objects.create(game=game, state=IngestionJob.RUNNING)
+
+    def test_run_job_records_progress(self):
+        game = Game.objects.create(name="Test Game")
+        Document.objects.create(game=game, url="some-url", display_name="Rules")
+        Document.objects.create(game=game, url="other-url", display_name="FAQ")
+        enqueue(game)
+
+        with mock.patch(
+            "games.services.document_ingestion_service._download_to_file"
+        ) as _download_to_file_mock:
+            _download_to_file_mock.side_effect = copy_test_pdf
+            job = run_job(claim_next_job("worker"))
+
+        job.refresh_from_db()
+        self.assertEqual(job.state, IngestionJob.SUCCEEDED)
+        self.assertEqual((job.documents_done, job.documents_total), (2, 2))
+        self.assertEqual(job.progress, 1.0)
+        self.assertGreaterEqual(job.duration_seconds, 0)
+        game = Game.objects.get(pk=game.id)
+        self.assertTrue(game.ingested)
+        self.assertEqual(game.vector_store.index.index.ntotal, 4)
+
+    def test_run_job_records_failure(self):
+        game = Game.objects.create(name="Test Game")
+        Document.objects.create(game=game, url="some-url")
+        enqueue(game)
+
+        with mock.patch(
+            "games.services.document_ingestion_service._download_to_file"
+        ) as _download_to_file_mock:
+            _download_to_file_mock.side_effect = requests.HTTPError("404 Not Found")
+            job = run_job(claim_next_job("worker"))
+
+        job.refresh_from_db()
+        self.assertEqual(job.state, IngestionJob.FAILED)
+        self.assertEqual(job.error, "HTTPError: 404 Not Found")
+        self.assertEqual(job.documents_done, 0)
+        self.assertFalse(Game.objects.get(pk=game.id).ingested)
+
+    @override_settings(INGESTION_JOB_STALE_SECONDS=60, INGESTION_JOB_MAX_ATTEMPTS=2)
+    def test_requeue_stale_jobs(self):
+        game = Game.objects.create(name="Test Game")
+        enqueue(game)
+        job = claim_next_job("dead-worker")
+        IngestionJob.objects.filter(pk=job.pk).update(
+            heartbeat_at=timezone.now() - timedelta(minutes=5)
+        )
+
+        self.assertEqual(requeue_stale_jobs(), 1)
+        job = claim_next_job("worker")
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(requeue_stale_jobs(), 0)
+
+        IngestionJob.objects.filter(pk=job.pk).update(
+            heartbeat_at=timezone.now() - timedelta(minutes=5)
+        )
+        self.assertEqual(requeue_stale_jobs(), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.state, IngestionJob.FAILED)
+
+    def test_ingestion_worker_runs_queued_jobs(self):
+        game = Game.objects.create(name="Test Game")
+        Document.objects.create(game=game, url="some-url")
+        enqueue(game)
+        output = StringIO()
+
+        with mock.patch(
+            "games.services.document_ingestion_service._download_to_file"
+        ) as _download_to_file_mock:
+            _download_to_file_mock.side_effect = copy_test_pdf
+            call_command(
+                "ingestion_worker", "--burst", "--concurrency", "1", stdout=output
+            )
+
+        self.assertEqual(
+            IngestionJob.objects.get(game=game).state, IngestionJob.SUCCEEDED
+        )
+        self.assertIn("Succeeded", output.getvalue())
+
+
+class BulkIngestCommandTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.manifest = self.directory / "manifest.json"
+        self.manifest.write_text(
+            json.dumps(
+                [
+                    {
+                        "name": "Game One",
+                        "documents": [{"url": "https://example.com/one.pdf"}],
+                        "question_sessions": [],
+                    },
+                    {
+                        "name": "Game Two",
+                        "documents": [
+                            {"url": "https://example.com/two.pdf", "ignore_pages": "2"}
+                        ],
+                    },
+                ]
+            )
+        )
+        self.checkpoint = self.directory / "checkpoint.json"
+
+    def bulk_ingest(self, download):
+        output = StringIO()
+        with mock.patch(
+            "games.services.document_ingestion_service._download_to_file"
+        ) as _download_to_file_mock:
+            _download_to_file_mock.side_effect = download
+            call_command(
+                "bulk_ingest",
+                str(self.manifest),
+                "--workers",
+                "1",
+                "--checkpoint",
+                str(self.checkpoint),
+                stdout=output,
+                stderr=StringIO(),
+            )
+        return output.getvalue(), _download_to_file_mock
+
+    def test_bulk_ingest(self):
+        output, _ = self.bulk_ingest(copy_test_pdf)
+
+        game_one = Game.objects.get(name="Game One")
+        game_two = Game.objects.get(name="Game Two")
+        self.assertTrue(game_one.ingested)
+        self.assertEqual(game_one.vector_store.index.index.ntotal, 2)
+        self.assertEqual(game_two.vector_store.index.index.ntotal, 1)
+        self.assertEqual(game_two.document_set.get().ignore_pages, "2")
+        self.assertIn("Ingested 2 games, failed 0", output)
+        self.assertIn("4 pages, 3 chunks", output)
+        self.assertIn("pages/s", output)
+
+        checkpoint = json.loads(self.checkpoint.read_text())
+        self.assertEqual(checkpoint["Game One"]["status"], "done")
+        self.assertEqual(checkpoint["Game One"]["game_id"], game_one.id)
+
+    def test_bulk_ingest_runs_games_as_ingestion_jobs(self):
+        game_two = Game.objects.create(name="Game Two")
+        IngestionJob.objects.create(
+            game=game_two, state=IngestionJob.RUNNING, worker="worker"
+        )
+
+        output, _ = self.bulk_ingest(copy_test_pdf)
+
+        self.assertIn("Ingested 1 games, failed 1", output)
+        self.assertFalse(Game.objects.get(pk=game_two.id).ingested)
+        self.assertEqual(
+            json.loads(self.checkpoint.read_text())["Game Two"]["error"],
+            "The game has a running ingestion job",
+        )
+        job = IngestionJob.objects.get(game__name="Game One")
+        self.assertEqual(job.state, IngestionJob.SUCCEEDED)
+        self.assertTrue(job.worker.startswith("bulk_ingest:"))
+
+    def test_bulk_ingest_resumes_failed_games(self):
+        def fail_game_two(url, file, **validators):
+            if url.endswith("two.pdf"):
+                raise requests.HTTPError("503 Service Unavailable")
+            return copy_test_pdf(url, file, **validators)
+
+        output, _ = self.bulk_ingest(fail_game_two)
+        self.assertIn("Ingested 1 games, failed 1", output)
+        self.assertEqual(
+            json.loads(self.checkpoint.read_text())["Game Two"]["status"], "failed"
+        )
+
+        output, download_mock = self.bulk_ingest(copy_test_pdf)
+
+        self.assertIn("1 already ingested, ingesting 1", output)
+        download_mock.assert_called_once()
+        self.assertEqual(Game.objects.filter(name="Game Two").count(), 1)
+        self.assertTrue(Game.objects.get(name="Game Two").ingested)
+        self.assertEqual(
+            json.loads(self.checkpoint.read_text())["Game Two"]["status"], "done"
         )
@@ -0,0 +1,149 @@
+"""
+Process wide registry of loaded game indexes.
+
+Loading a game index means fetching the FAISS blob from storage and deserializing it, which is by far the
+most expensive part of answering the first question for a game. The registry keeps loaded indexes around
+for the lifetime of the process (one per gunicorn worker) so that subsequent requests can reuse them.
+
+Entries are keyed on (game id, faiss file name). The faiss file name changes every time an index is
+persisted, so a re-ingest in any process naturally results in a cache miss everywhere else. Adding a version of a
+game index drops the other versions of that game, which are never used again.
+Entries are evicted least recently used first once the total size of the cached indexes exceeds the byte budget.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RegistryEntry:
+    index: Any
+    nbytes: int
+
+
+class VectorStoreRegistry:
+    """
+    A thread safe LRU cache of loaded indexes bounded by the total number of index bytes.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Hashable, RegistryEntry]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._load_locks: dict = {}
+
+    def get(self, key: Hashable):
+        """
+        Return the cached index for key or None if it is not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.index
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Tuple[Any, int]]):
+        """
+        Return the cached index for key, loading it with loader on a miss.
+
+        The loader must return a tuple of (index, nbytes). Concurrent misses for the same key only load once.
+        """
+        index = self.get(key)
+        if index is not None:
+            return index
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            # Another thread might have loaded the index while we waited for the lock
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    return entry.index
+
+            try:
+                index, nbytes = loader()
+                self.put(key, index, nbytes)
+            finally:
+                with self._lock:
+                    self._load_locks.pop(key, None)
+
+        return index
+
+    def put(self, key: Hashable, index: Any, nbytes: int):
+        """
+        Add an index to the registry, evicting the least recently used indexes if we are over budget.
+        """
+        if nbytes > self.max_bytes:
+            logger.warning(
+                f"Index {key} of {nbytes} bytes exceeds the registry budget of {self.max_bytes} bytes, not caching it"
+            )
+            return
+
+        with self._lock:
+            for other_key in [other for other in self._entries if other[0] == key[0]]:
+                self._remove(other_key)
+            self._entries[key] = RegistryEntry(index=index, nbytes=nbytes)
+            self._total_bytes += nbytes
+
+            while self._total_bytes > self.max_bytes:
+                evicted_key, _ = next(iter(self._entries.items()))
+                self._remove(evicted_key)
+                self.evictions += 1
+                logger.info(f"Evicted index {evicted_key} from vector store registry")
+
+    def invalidate(self, game_id: int):
+        """
+        Drop every cached index version for the given game.
+        """
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == game_id]:
+                self._remove(key)
+
+    def clear(self):
+        """
+        Drop all cached indexes and reset the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _remove(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry.nbytes
+
+
+vector_store_registry = VectorStoreRegistry(
+    max_bytes=settings.VECTOR_STORE_REGISTRY_MAX_BYTES
+)
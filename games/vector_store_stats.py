@@ -0,0 +1,114 @@
+"""
+Per process statistics of loaded game indexes.
+
+Every time a game index is loaded from storage, the game vector store records how many vectors it holds, how big
+its files are and how long fetching and deserializing them took. Together with the counters of the vector store
+registry, the local index cache and the query embedding cache, this is what we need to size the workers and the
+cache budgets.
+
+Each gunicorn worker has its own statistics, so the numbers are for the worker that serves the request.
+Recording is a few counters under a lock, so it is always on.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+
+from django.utils import timezone
+
+from games.embedding_cache import embedding_cache, query_embedding_cache
+from games.index_cache import index_cache
+from games.vector_store_registry import vector_store_registry
+
+
+@dataclass
+class IndexLoad:
+    """
+    Statistics of loading a single game index.
+    """
+
+    vector_count: int = 0
+    segments: int = 0
+    index_bytes: int = 0
+    docstore_bytes: int = 0
+    lexical_bytes: int = 0
+    fetch_ms: float = 0.0
+    deserialize_ms: float = 0.0
+    loaded_at: object = field(default_factory=timezone.now)
+
+    @contextmanager
+    def timed(self, attribute):
+        """
+        Add the milliseconds spent in the block to the given attribute.
+        """
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - started_at) * 1000
+            setattr(self, attribute, getattr(self, attribute) + elapsed_ms)
+
+    @property
+    def memory_mapped(self):
+        # A single segment is memory mapped, multiple segments are merged into an in memory copy
+        return self.segments == 1
+
+
+class VectorStoreStats:
+    """
+    A thread safe record of the index loads of each game in this process.
+    """
+
+    def __init__(self):
+        self._games = {}
+        self._lock = threading.Lock()
+
+    def record_load(self, game_id, load: IndexLoad):
+        with self._lock:
+            game = self._games.setdefault(
+                game_id,
+                {"loads": 0, "total_fetch_ms": 0.0, "total_deserialize_ms": 0.0},
+            )
+            game["loads"] += 1
+            game["total_fetch_ms"] += load.fetch_ms
+            game["total_deserialize_ms"] += load.deserialize_ms
+            game["last_load"] = load
+
+    def game_stats(self) -> dict:
+        """
+        Returns the statistics of each loaded game keyed on game id.
+        """
+        with self._lock:
+            return {
+                game_id: {
+                    "loads": game["loads"],
+                    "total_fetch_ms": game["total_fetch_ms"],
+                    "total_deserialize_ms": game["total_deserialize_ms"],
+                    **asdict(game["last_load"]),
+                    "memory_mapped": game["last_load"].memory_mapped,
+                }
+                for game_id, game in self._games.items()
+            }
+
+    def clear(self):
+        with self._lock:
+            self._games.clear()
+
+
+def process_stats() -> dict:
+    """
+    Returns the statistics of the indexes and caches of this process.
+    """
+    return {
+        "pid": os.getpid(),
+        "games": vector_store_stats.game_stats(),
+        "registry": vector_store_registry.stats(),
+        "index_cache": index_cache.stats(),
+        "embedding_cache": embedding_cache.stats(),
+        "query_embedding_cache": query_embedding_cache.stats(),
+    }
+
+
+vector_store_stats = VectorStoreStats()
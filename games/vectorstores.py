@@ -1,12 +1,23 @@
 import importlib
 import sys
-from functools import lru_cache
+import uuid
+from datetime import timedelta
 
+from django.apps import apps
 from django.conf import settings
 from django.core.files.base import ContentFile
-from langchain_community.embeddings.fake import DeterministicFakeEmbedding
+from django.utils import timezone
 from langchain_community.vectorstores import FAISS
-from langchain_openai.embeddings import OpenAIEmbeddings
+
+from games import embedding_backends, index_formats, index_types
+from games.docstores import CompactDocstore
+from games.embedding_cache import embedding_cache, query_embedding_cache
+from games.embedding_scheduler import concurrent_windows, ingestion_embedding
+from games.index_cache import index_cache
+from games.ingestion_stats import EMBED, PERSIST, IngestionStats
+from games.lexical_index import LexicalIndex
+from games.vector_store_registry import vector_store_registry
+from games.vector_store_stats import IndexLoad, vector_store_stats
 
 EMBEDDING_LENGTH = 1536
 
@@ -21,88 +32,520 @@ LEGACY_LANGCHAIN_MODULE_ALIASES = [
     ("langchain.schema.document", "langchain_classic.schema.document"),
 ]
 
-DEFAULT_EMBEDDING = (
-    DeterministicFakeEmbedding(size=1536) if settings.TESTING else OpenAIEmbeddings()
-)
-
 
 class GameVectorStore:
     """
     A vector store for a specific game.
 
     This vector store will have all the game documents loaded and stored along side the game record in the database.
+
+    Loaded indexes are shared through the process wide vector store registry, so creating a GameVectorStore
+    for a game that has already been loaded in this process is cheap.
+    Indexes loaded with a custom embedding are private to the vector store instance.
+
+    Sections are embedded with the embedding backend of the game (see games/embedding_backends.py). A stored index
+    is loaded and queried with the backend recorded in its manifest, which differs from the backend of the game
+    until the game is ingested again after changing its backend.
+
+    New documents are added as flat segments. The index type of the game (see games/index_types.py) is applied
+    when the segments are compacted. Every segment also has a lexical BM25 index of its sections
+    (see games/lexical_index.py), for searches that do not need the query to be embedded.
     """
 
-    @lru_cache(maxsize=5)  # TODO: Understand memory implications of doing this
     def __init__(self, game, embedding=None):
         self.game = game
+        self.index_type = game.index_type or settings.VECTOR_STORE_INDEX_TYPE
 
+        self.shared = embedding is None
+        self.embedding_backend = embedding_backends.game_backend(game)
         if embedding is None:
-            embedding = DEFAULT_EMBEDDING
+            embedding = embedding_backends.get_embedding(self.embedding_backend)
         self.embedding = embedding
-        self.game = game
-        self.index = self._try_load_index()
+        # Bytes of index files written to storage by this instance
+        self.bytes_written = 0
+        self.index, self.setup_ids, self.lexical_index = self._try_load_index()
+        if self.shared and self.index is not None:
+            # Query and extend the index with the backend it was embedded with
+            self.embedding = self.index.embedding_function
+            self.embedding_backend = (
+                embedding_backends.backend_name(self.embedding)
+                or self.embedding_backend
+            )
 
-    def add_documents(self, documents, document_id):
+    def add_documents(self, documents, document_id, stats=None, replace=False):
         """
         Add documents to the vector store
 
+        The documents are persisted as a new segment of the index, so previously added documents are not
+        serialized and uploaded again. With replace, the sections the game document had before are removed in the
+        same manifest swap, so the game always has either the old or the new sections of the document, and an
+        ingest that fails keeps the old ones.
+
         Note:
             Document is a an overloaded terms here. Documents represents the sections of a document as a langchain Document.
             document_id referes to the document_id of the game document the sections belong to.
         """
-        for document in documents:
-            document.metadata["game_id"] = self.game.id
-            document.metadata["document_id"] = document_id
+        self.add_document_batches([documents], document_id, stats, replace)
+
+    def add_document_batches(self, batches, document_id, stats=None, replace=False):
+        """
+        Add batches of documents to the vector store as a single new segment, like add_documents.
+
+        Batches are embedded and appended to the segment as they arrive, so the batches can be produced while
+        earlier batches are embedded. Consecutive batches are embedded together when the embedding scheduler
+        needs more than one batch to keep all of its concurrent requests in flight. The segment itself, with the vectors and texts of all batches, is built in
+        memory and then merged into the loaded index.
+
+        The time spent embedding and building and writing the segment is added to stats, an IngestionStats.
+        """
+        stats = stats or IngestionStats()
+        # The index might be shared with other requests, make sure no one picks it up while we modify it
+        self._invalidate_registry()
+
+        # Only chunks that have not been embedded before by any ingest are sent to the embedding model,
+        # in concurrent token bounded batches (see games/embedding_scheduler.py)
+        embedding = ingestion_embedding(self.embedding)
+        segment_index = None
+        texts = []
+        for documents in concurrent_windows(batches, embedding):
+            for document in documents:
+                document.metadata["game_id"] = self.game.id
+                document.metadata["document_id"] = document_id
+
+            batch_texts = [document.page_content for document in documents]
+            ids = [document.id for document in documents]
+            with stats.stage(EMBED):
+                vectors = embedding_cache.embed_documents(embedding, batch_texts)
+            embeddings = zip(batch_texts, vectors)
+            metadatas = [document.metadata for document in documents]
+            with stats.stage(PERSIST):
+                if segment_index is None:
+                    segment_index = FAISS.from_embeddings(
+                        embeddings,
+                        self.embedding,
+                        metadatas=metadatas,
+                        ids=ids if any(ids) else None,
+                        docstore=CompactDocstore(),
+                    )
+                else:
+                    segment_index.add_embeddings(
+                        embeddings, metadatas=metadatas, ids=ids if any(ids) else None
+                    )
+            texts.extend(batch_texts)
+
+        if segment_index is None:
+            if replace:
+                with stats.stage(PERSIST):
+                    self.remove_document(document_id)
+            return
+
+        with stats.stage(PERSIST):
+            self._add_segment(segment_index, texts, document_id, replace)
+
+    def _add_segment(self, segment_index, texts, document_id, replace):
+        segment_lexical_index = LexicalIndex.build(
+            [segment_index.index_to_docstore_id[i] for i in range(len(texts))], texts
+        )
+
+        removal = self._without_document(document_id) if replace else None
+        if removal is None:
+            segments = self._stored_segments()
+            dropped_segments = []
+        else:
+            index, segments, dropped_segments = removal
+            self.index = index if index.index.ntotal else None
+            self.lexical_index = (
+                self._build_lexical_index(index) if index.index.ntotal else None
+            )
+        segments.append(
+            self._write_segment(
+                segment_index,
+                [document_id],
+                lexical_index=segment_lexical_index,
+            )
+        )
 
-        if self.index is not None:
-            self.index.add_documents(documents)
+        if self.index is None:
+            self.index = segment_index
+            self.lexical_index = segment_lexical_index
         else:
-            self.index = FAISS.from_documents(
-                documents=documents,
-                embedding=self.embedding,
+            self.index = index_formats.merge_indexes([self.index, segment_index])
+            self.lexical_index = LexicalIndex.merge(
+                [self.lexical_index, segment_lexical_index]
             )
-        self._persist_index()
+
+        self._write_manifest(segments)
+        self._delete_segments(dropped_segments)
+
+    def embed_query(self, query):
+        """
+        Embed a question through the query embedding cache shared by all workers.
+        """
+        return query_embedding_cache.embed_query(self.embedding, query)
+
+    def lexical_search(self, query, k=4):
+        """
+        Returns up to k (section, BM25 score) tuples for the query from the lexical index, best match first.
+
+        This does not embed the query, so it never calls the embedding model.
+        """
+        if self.lexical_index is None:
+            return []
+        return [
+            (self.index.docstore.search(doc_id), score)
+            for doc_id, score in self.lexical_index.search(query, k)
+        ]
+
+    def setup_documents(self):
+        """
+        Returns the setup page sections of the game documents.
+
+        The docstore ids of the setup sections are recorded when they are ingested, so this is a direct docstore
+        lookup with no embedding or vector search.
+        """
+        return [self.index.docstore.search(doc_id) for doc_id in self.setup_ids]
+
+    def compact(self):
+        """
+        Merge all segments of the stored index into a single segment of the index type of the game.
+
+        A single segment is memory mapped directly when loaded, where multiple segments have to be merged in memory.
+        """
+        segments = self._stored_segments()
+        if not segments:
+            return
+
+        index_type = index_types.effective_index_type(
+            self.index_type, self.index.index.ntotal
+        )
+        if len(segments) == 1 and segments[0]["index_type"] == index_type:
+            return
+
+        self._invalidate_registry()
+
+        document_ids = []
+        for segment in segments:
+            if segment["document_ids"] is None:
+                document_ids = None
+                break
+            document_ids.extend(segment["document_ids"])
+
+        self.index = self._rebuild_index(segments, index_type)
+        self._write_manifest(
+            [
+                self._write_segment(
+                    self.index, document_ids, index_type, self.lexical_index
+                )
+            ]
+        )
+        self._delete_segments(segments)
+
+    def remove_document(self, document_id):
+        """
+        Remove the sections of a game document from the vector store, leaving the other documents untouched.
+
+        Segments holding only sections of the document are dropped, segments shared with other documents are
+        rewritten without them. Returns the number of removed sections.
+        """
+        removal = self._without_document(document_id)
+        if removal is None:
+            return 0
+
+        index, segments, dropped_segments = removal
+        removed = self.index.index.ntotal - index.index.ntotal
+        if segments:
+            self.index = index
+            self.lexical_index = self._build_lexical_index(index)
+            self._write_manifest(segments)
+        else:
+            self._drop_manifest()
+            self.index = None
+            self.setup_ids = []
+            self.lexical_index = None
+        self._delete_segments(dropped_segments)
+
+        return removed
+
+    def _without_document(self, document_id):
+        """
+        Returns the index and the segments without the sections of a game document, and the segments they replace.
+        Returns None if the vector store has no sections of the document.
+
+        Segments shared with other documents are written again without the sections, pointing the game to the
+        segments is up to the caller.
+        """
+        if self.index is None:
+            return None
+
+        manifest = self._read_manifest(self.game.faiss_file.name)
+        if manifest is not None and not any(
+            self._segment_may_contain(segment, document_id)
+            for segment in manifest["segments"]
+        ):
+            return None
+
+        index = index_formats.without_document(self.index, document_id)
+        if index.index.ntotal == self.index.index.ntotal:
+            return None
+
+        self._invalidate_registry()
+
+        segments = []
+        dropped_segments = []
+        for segment in self._stored_segments():
+            if not self._segment_may_contain(segment, document_id):
+                segments.append(segment)
+                continue
+
+            dropped_segments.append(segment)
+            if segment["document_ids"] == [document_id]:
+                continue
+
+            segment_index, _ = self._load_segment(segment)
+            segment_index = index_formats.without_document(segment_index, document_id)
+            if segment_index.index.ntotal:
+                document_ids = segment["document_ids"]
+                if document_ids is not None:
+                    document_ids = [id for id in document_ids if id != document_id]
+                segments.append(
+                    self._write_segment(
+                        segment_index,
+                        document_ids,
+                        segment["index_type"],
+                    )
+                )
+
+        return index, segments, dropped_segments
+
+    def document_ids(self):
+        """
+        Returns the ids of the game documents that have sections in the vector store.
+        """
+        if self.index is None:
+            return set()
+
+        manifest = self._read_manifest(self.game.faiss_file.name)
+        if manifest is not None and all(
+            segment["document_ids"] is not None for segment in manifest["segments"]
+        ):
+            return {
+                document_id
+                for segment in manifest["segments"]
+                for document_id in segment["document_ids"]
+            }
+        return set(index_formats.section_document_ids(self.index))
+
+    def upgrade_format(self, verify=True):
+        """
+        Rewrite a legacy pickled index in the current split format and record the format version on the game.
+
+        With verify the rewritten index is loaded back from storage and compared to the original index before the
+        original file is deleted. If they differ the game is pointed back to the original file and a ValueError
+        is raised. Returns True if the index was rewritten.
+        """
+        if not self.game.faiss_file:
+            return False
+
+        original_name = self.game.faiss_file.name
+        manifest = self._read_manifest(original_name)
+        if manifest is not None:
+            if self.game.index_format_version != manifest["version"]:
+                self.game.index_format_version = manifest["version"]
+                self.game.save()
+            return False
+
+        self._invalidate_registry()
+        segments = self._stored_segments()
+        self._write_manifest(segments, delete_previous=False)
+
+        if verify:
+            try:
+                rewritten_index = GameVectorStore(self.game, self.embedding).index
+                index_formats.verify_same_index(self.index, rewritten_index)
+            except Exception:
+                rewritten_name = self.game.faiss_file.name
+                self._invalidate_registry()
+                self.game.faiss_file.name = original_name
+                self.game.index_format_version = None
+                self.game.save()
+                self._supersede([rewritten_name])
+                self._delete_segments(segments)
+                raise
+
+        self._supersede([original_name])
+        return True
 
     def clear(self):
         """
         Clear the vector store
         """
-        if self.game.faiss_file is not None:
-            self.game.faiss_file.delete()
+        self._invalidate_registry()
+        if self.game.faiss_file:
+            manifest = self._read_manifest(self.game.faiss_file.name)
+            if manifest is not None:
+                self._delete_segments(manifest["segments"])
+            self._drop_manifest()
         self.index = None
+        self.setup_ids = []
+        self.lexical_index = None
 
     def _try_load_index(self):
         """
-        If the index exists, load it. Otherwise return None
+        If the index exists, load it. Returns a tuple of the index, the ids of its setup sections and its lexical
+        index.
         """
+        if not self.game.faiss_file:
+            return None, [], None
+
         try:
-            self.game.faiss_file.open("rb")
-            try:
-                data = self.game.faiss_file.read()
-            finally:
-                self.game.faiss_file.close()
+            return self._load_or_get_index()
+        except FileNotFoundError:
+            # The index was replaced after the game was read and its files have been deleted since,
+            # load the index the game points to now
+            self.game.refresh_from_db(fields=["faiss_file", "index_format_version"])
+            if not self.game.faiss_file:
+                return None, [], None
+            return self._load_or_get_index()
 
-            self._register_legacy_langchain_module_aliases()
+    def _load_or_get_index(self):
+        if not self.shared:
+            loaded_index, _ = self._load_index()
+            return loaded_index
 
-            try:
-                return FAISS.deserialize_from_bytes(
-                    data,
-                    self.embedding,
-                    allow_dangerous_deserialization=True,
+        return vector_store_registry.get_or_load(self._registry_key(), self._load_index)
+
+    def _load_index(self):
+        """
+        Load the index from storage.
+        Returns a tuple of (index, setup section ids, lexical index) and the size of the stored index files.
+
+        Split format segments are memory mapped from the local index cache and merged in memory if there are
+        more than one. Legacy indexes are unpickled and their lexical index is built in memory.
+        """
+        load = IndexLoad()
+        storage = self.game.faiss_file.storage
+        with load.timed("fetch_ms"):
+            # Manifests are never overwritten, legacy pickled indexes may have been
+            data = index_cache.fetch(
+                storage,
+                self.game.faiss_file.name,
+                immutable=self.game.index_format_version is not None,
+            ).read_bytes()
+
+        manifest = index_formats.parse_manifest(data)
+        if manifest is None:
+            # Migrated games never go through the legacy unpickling and module aliases
+            if self.game.index_format_version is not None:
+                raise ValueError(
+                    f"Index of {self.game} is recorded as split format version "
+                    f"{self.game.index_format_version} but is not a manifest"
                 )
-            except ModuleNotFoundError as e:
-                if self._register_legacy_langchain_module_alias(e.name):
-                    return FAISS.deserialize_from_bytes(
-                        data,
-                        self.embedding,
-                        allow_dangerous_deserialization=True,
-                    )
+            with load.timed("deserialize_ms"):
+                index = self._load_legacy_index(data)
+                lexical_index = self._build_lexical_index(index)
+            load.segments = 0
+            load.index_bytes = len(data)
+            self._record_load(load, index)
+            return (index, index_formats.setup_ids(index), lexical_index), len(data)
+
+        if self.shared:
+            self.embedding_backend = manifest["segments"][0]["embedding_backend"]
+            self.embedding = embedding_backends.get_embedding(self.embedding_backend)
+
+        segment_indexes = []
+        lexical_indexes = []
+        for segment in manifest["segments"]:
+            segment_index, _ = self._load_segment(segment, load)
+            segment_indexes.append(segment_index)
+            lexical_indexes.append(self._load_segment_lexical_index(segment, load))
+
+        with load.timed("deserialize_ms"):
+            if len(segment_indexes) == 1:
+                index = segment_indexes[0]
+                lexical_index = lexical_indexes[0]
+            else:
+                index = index_formats.merge_indexes(segment_indexes)
+                lexical_index = LexicalIndex.merge(lexical_indexes)
+        load.segments = len(segment_indexes)
+        self._record_load(load, index)
+        return (
+            index,
+            self._setup_ids(manifest["segments"]),
+            lexical_index,
+        ), load.index_bytes + load.docstore_bytes + load.lexical_bytes
+
+    def _load_segment(self, segment, load=None):
+        """
+        Memory map a segment from the local index cache. Returns a tuple of the index and the size of its files.
+
+        The sizes of the files and the time spent fetching and loading them are added to load if it is given.
+        """
+        load = load or IndexLoad()
+        storage = self.game.faiss_file.storage
+        with load.timed("fetch_ms"):
+            index_path = index_cache.fetch(storage, segment["index"], immutable=True)
+            docstore_path = index_cache.fetch(
+                storage, segment["docstore"], immutable=True
+            )
+        with load.timed("deserialize_ms"):
+            index = index_formats.load_split_index(
+                index_path, docstore_path, self.embedding
+            )
+        index_bytes = index_path.stat().st_size
+        docstore_bytes = docstore_path.stat().st_size
+        load.index_bytes += index_bytes
+        load.docstore_bytes += docstore_bytes
+        return index, index_bytes + docstore_bytes
+
+    def _load_segment_lexical_index(self, segment, load):
+        """
+        Load the lexical index of a segment, adding the size of its file and the time spent to load.
+        """
+        with load.timed("fetch_ms"):
+            path = index_cache.fetch(
+                self.game.faiss_file.storage, segment["lexical"], immutable=True
+            )
+        with load.timed("deserialize_ms"):
+            data = path.read_bytes()
+            lexical_index = LexicalIndex.load(data)
+        load.lexical_bytes += len(data)
+        return lexical_index
+
+    def _record_load(self, load, index):
+        load.vector_count = index.index.ntotal
+        vector_store_stats.record_load(self.game.id, load)
+
+    @staticmethod
+    def _build_lexical_index(index):
+        ids = [index.index_to_docstore_id[i] for i in range(index.index.ntotal)]
+        return LexicalIndex.build(
+            ids, [index.docstore.search(doc_id).page_content for doc_id in ids]
+        )
+
+    def _load_legacy_index(self, data):
+        self._register_legacy_langchain_module_aliases()
+
+        try:
+            return FAISS.deserialize_from_bytes(
+                data,
+                self.embedding,
+                allow_dangerous_deserialization=True,
+            )
+        except ModuleNotFoundError as e:
+            if not self._register_legacy_langchain_module_alias(e.name):
                 raise
-        except ValueError as e:
-            if "attribute has no file associated with it." in str(e):
-                return None
-            raise e
+            return FAISS.deserialize_from_bytes(
+                data,
+                self.embedding,
+                allow_dangerous_deserialization=True,
+            )
+
+    def _registry_key(self):
+        return (self.game.id, self.game.faiss_file.name)
+
+    def _invalidate_registry(self):
+        if self.shared:
+            vector_store_registry.invalidate(self.game.id)
 
     @classmethod
     def _register_legacy_langchain_module_aliases(cls):
@@ -149,12 +592,190 @@ class GameVectorStore:
 
         return False
 
-    def _persist_index(self):
+    def _stored_segments(self):
+        """
+        Returns the segments of the stored index. A stored legacy index is first rewritten as a single segment.
+        """
+        if not self.game.faiss_file:
+            return []
+
+        manifest = self._read_manifest(self.game.faiss_file.name)
+        if manifest is None:
+            return [self._write_segment(self.index, None)]
+        return manifest["segments"]
+
+    def _rebuild_index(self, segments, index_type):
         """
-        Persist the index to storage
+        Rebuild the index as a new index of index_type.
+
+        Quantized indexes only hold approximations of the vectors, so the embedded vectors are read from the
+        embedding cache where possible, so rebuilding does not compound the quantization errors.
+        """
+        vectors = self.index.index.reconstruct_n(0, self.index.index.ntotal)
+
+        if any(segment["index_type"] != index_types.FLAT for segment in segments):
+            texts = [
+                self.index.docstore.search(
+                    self.index.index_to_docstore_id[position]
+                ).page_content
+                for position in range(self.index.index.ntotal)
+            ]
+            cached_vectors = embedding_cache.cached_vectors(self.embedding, texts)
+            for position, vector in enumerate(cached_vectors):
+                if vector is not None:
+                    vectors[position] = vector
+
+        return FAISS(
+            self.index.embedding_function,
+            index_types.build_faiss_index(index_type, vectors),
+            self.index.docstore,
+            dict(self.index.index_to_docstore_id),
+        )
+
+    def _write_segment(
+        self, index, document_ids, index_type=index_types.FLAT, lexical_index=None
+    ):
+        """
+        Write index as a new segment in storage and return the segment for the manifest.
+
+        The lexical index of the segment is built from index unless it is given.
+        """
+        storage = self.game.faiss_file.storage
+        base_name = self._new_file_name()
+        index_data = index_formats.serialize_raw_index(index)
+        docstore_data = index_formats.serialize_docstore(index)
+        if lexical_index is None:
+            lexical_index = self._build_lexical_index(index)
+        lexical_data = lexical_index.serialize()
+        self.bytes_written += len(index_data) + len(docstore_data) + len(lexical_data)
+
+        return {
+            "index": storage.save(
+                self._generate_file_name(f"{base_name}.index"),
+                ContentFile(index_data),
+            ),
+            "docstore": storage.save(
+                self._generate_file_name(f"{base_name}.docstore"),
+                ContentFile(docstore_data),
+            ),
+            "lexical": storage.save(
+                self._generate_file_name(f"{base_name}.lexical"),
+                ContentFile(lexical_data),
+            ),
+            "document_ids": document_ids,
+            "index_type": index_type,
+            "embedding_backend": self.embedding_backend,
+            "setup_ids": index_formats.setup_ids(index),
+            "bytes": len(index_data) + len(docstore_data) + len(lexical_data),
+        }
+
+    def _write_manifest(self, segments, delete_previous=True):
+        """
+        Point the game to a new manifest for segments
+
+        Every manifest gets a new unique name, which acts as the index version for the registry.
+        The previous manifest is superseded once the new one has been saved, but not the segments it refers to.
+        """
+        previous_name = self.game.faiss_file.name
+        self.setup_ids = self._setup_ids(segments)
+
+        self.game.index_format_version = index_formats.SPLIT_FORMAT_VERSION
+        manifest_data = index_formats.build_manifest(segments)
+        self.bytes_written += len(manifest_data)
+        self.game.faiss_file.save(self._new_file_name(), ContentFile(manifest_data))
+        self.game.save()
+
+        if previous_name and delete_previous:
+            self._supersede([previous_name])
+
+        if self.shared:
+            vector_store_registry.put(
+                self._registry_key(),
+                (self.index, self.setup_ids, self.lexical_index),
+                sum(segment.get("bytes", 0) for segment in segments),
+            )
+
+    def _read_manifest(self, name):
+        """
+        Read the manifest stored as name. Returns None if name is a legacy pickled index.
         """
-        self.game.faiss_file.save(
-            f"{self.game.slug}-{self.game.id}",
-            ContentFile(self.index.serialize_to_bytes()),
+        with self.game.faiss_file.storage.open(name, "rb") as file:
+            # Manifests are tiny, legacy pickles are not, so only read the whole file for manifests
+            data = file.read(1)
+            if data == b"{":
+                data += file.read()
+        return index_formats.parse_manifest(data)
+
+    @staticmethod
+    def _setup_ids(segments):
+        return [doc_id for segment in segments for doc_id in segment["setup_ids"]]
+
+    @staticmethod
+    def _segment_may_contain(segment, document_id):
+        # Segments converted from legacy indexes do not know which documents they hold
+        return segment["document_ids"] is None or document_id in segment["document_ids"]
+
+    def _delete_segments(self, segments):
+        self._supersede(
+            [
+                segment[name]
+                for segment in segments
+                for name in ("index", "docstore", "lexical")
+            ]
         )
+
+    def _drop_manifest(self):
+        """
+        Point the game to no index at all.
+        """
+        previous_name = self.game.faiss_file.name
+        self.game.faiss_file = None
+        self.game.index_format_version = None
         self.game.save()
+        self._supersede([previous_name])
+
+    def _supersede(self, names):
+        """
+        Delete index files that the game no longer points to.
+
+        Other processes may have read the previous manifest of the game just before it was replaced, and still be
+        loading its files. So unless VECTOR_STORE_SUPERSEDED_FILE_GRACE_SECONDS is 0 the files are only recorded
+        here, and deleted after the grace period by delete_superseded_files.
+        """
+        storage = self.game.faiss_file.storage
+        if not settings.VECTOR_STORE_SUPERSEDED_FILE_GRACE_SECONDS:
+            for name in names:
+                storage.delete(name)
+            return
+
+        model = _superseded_file_model()
+        model.objects.bulk_create([model(name=name) for name in names])
+
+    def _new_file_name(self):
+        return f"{self.game.slug}-{self.game.id}-{uuid.uuid4().hex[:8]}"
+
+    def _generate_file_name(self, file_name):
+        return self.game.faiss_file.field.generate_filename(self.game, file_name)
+
+
+def delete_superseded_files():
+    """
+    Delete the index files that were superseded more than VECTOR_STORE_SUPERSEDED_FILE_GRACE_SECONDS ago.
+    Returns the number of deleted files. Run by the ingestion workers.
+    """
+    model = _superseded_file_model()
+    storage = apps.get_model("games", "Game")._meta.get_field("faiss_file").storage
+    expired = model.objects.filter(
+        superseded_at__lt=timezone.now()
+        - timedelta(seconds=settings.VECTOR_STORE_SUPERSEDED_FILE_GRACE_SECONDS)
+    )
+    deleted = 0
+    for superseded_file in expired:
+        storage.delete(superseded_file.name)
+        superseded_file.delete()
+        deleted += 1
+    return deleted
+
+
+def _superseded_file_model():
+    return apps.get_model("games", "SupersededIndexFile")
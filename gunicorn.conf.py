@@ -0,0 +1,18 @@
+import os
+
+
+def post_fork(server, worker):
+    """
+    Prewarm the vector store registry of every worker with the indexes of the most popular games.
+
+    Loading happens in a background thread, so the worker starts serving requests right away.
+    The /up/ health check reports the worker as ready once prewarming is done.
+    """
+    import django
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "rulesbot.settings")
+    django.setup()
+
+    from games.prewarm import prewarmer
+
+    prewarmer.start()
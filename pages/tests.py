@@ -1,3 +1,5 @@
+from unittest import mock
+
 from django.test import TestCase
 from django.urls import reverse
 
@@ -8,3 +10,9 @@ class HealthcheckViewTests(TestCase):
 
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.content, b"ok")
+
+    def test_up_view_while_prewarming(self):
+        with mock.patch("pages.views.prewarmer", mock.Mock(ready=False)):
+            response = self.client.get(reverse("up"))
+
+        self.assertEqual(response.status_code, 503)
@@ -3,6 +3,7 @@ from django.shortcuts import render
 from django.views import generic
 
 from games.models import Game
+from games.prewarm import prewarmer
 
 
 class LandingView(generic.ListView):
@@ -22,4 +23,7 @@ def terms_view(request):
 
 
 def up_view(request):
+    # Do not report the worker as ready before the indexes of the popular games are loaded, or prewarming timed out
+    if not prewarmer.ready:
+        return HttpResponse("prewarming", status=503)
     return HttpResponse("ok")
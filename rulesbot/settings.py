@@ -16,6 +16,7 @@ import tempfile
 from pathlib import Path
 
 import environ
+from django.core.exceptions import ImproperlyConfigured
 from django.core.management.utils import get_random_secret_key
 
 env = environ.Env(
@@ -174,6 +175,63 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 TESTING = len(sys.argv) > 1 and sys.argv[1] == "test"
 
+# Retrieval of rulebook sections: "vector" search, or "hybrid" fusing vector and lexical BM25 search.
+# In hybrid mode queries of at most RETRIEVER_LEXICAL_MAX_TERMS words with lexical matches skip the vector search.
+RETRIEVER_SEARCH_MODE = env("RETRIEVER_SEARCH_MODE", default="vector")
+if RETRIEVER_SEARCH_MODE not in ("vector", "hybrid"):
+    raise ImproperlyConfigured(
+        f"RETRIEVER_SEARCH_MODE must be vector or hybrid, not {RETRIEVER_SEARCH_MODE!r}"
+    )
+RETRIEVER_LEXICAL_MAX_TERMS = env.int("RETRIEVER_LEXICAL_MAX_TERMS", default=2)
+
+# Rulebook downloads, see games/services/download_service.py
+RULEBOOK_DOWNLOAD_CONNECT_TIMEOUT_SECONDS = env.float(
+    "RULEBOOK_DOWNLOAD_CONNECT_TIMEOUT_SECONDS", default=10
+)
+RULEBOOK_DOWNLOAD_READ_TIMEOUT_SECONDS = env.float(
+    "RULEBOOK_DOWNLOAD_READ_TIMEOUT_SECONDS", default=60
+)
+RULEBOOK_DOWNLOAD_RETRIES = env.int("RULEBOOK_DOWNLOAD_RETRIES", default=3)
+RULEBOOK_DOWNLOAD_RETRY_BACKOFF_SECONDS = env.float(
+    "RULEBOOK_DOWNLOAD_RETRY_BACKOFF_SECONDS", default=1
+)
+RULEBOOK_DOWNLOAD_MAX_BYTES = env.int(
+    "RULEBOOK_DOWNLOAD_MAX_BYTES", default=200 * 1024 * 1024
+)
+
+# Rulebook page extraction, see games/loaders/pdf_pages.py. Rulebooks of at least PDF_PARALLEL_MIN_PAGES pages
+# are extracted by a pool of PDF_EXTRACTION_WORKERS processes, set it to 1 to always extract serially.
+PDF_EXTRACTION_WORKERS = env.int(
+    "PDF_EXTRACTION_WORKERS", default=min(4, os.cpu_count() or 1)
+)
+PDF_PARALLEL_MIN_PAGES = env.int("PDF_PARALLEL_MIN_PAGES", default=100)
+
+# Embedding of rulebook sections during ingestion, see games/embedding_scheduler.py.
+# The OpenAI API accepts up to 2048 inputs and 300k tokens per request, stay well below that.
+EMBEDDING_BATCH_MAX_TOKENS = env.int("EMBEDDING_BATCH_MAX_TOKENS", default=100_000)
+EMBEDDING_BATCH_MAX_SIZE = env.int("EMBEDDING_BATCH_MAX_SIZE", default=1000)
+EMBEDDING_MAX_CONCURRENCY = env.int("EMBEDDING_MAX_CONCURRENCY", default=4)
+EMBEDDING_MAX_RETRIES = env.int("EMBEDDING_MAX_RETRIES", default=6)
+EMBEDDING_RETRY_BACKOFF_SECONDS = env.float(
+    "EMBEDDING_RETRY_BACKOFF_SECONDS", default=1
+)
+
+# Background ingestion jobs, run by the ingestion_worker management command.
+# See games/services/ingestion_job_service.py
+INGESTION_WORKER_CONCURRENCY = env.int("INGESTION_WORKER_CONCURRENCY", default=2)
+INGESTION_WORKER_POLL_SECONDS = env.float("INGESTION_WORKER_POLL_SECONDS", default=5)
+INGESTION_JOB_HEARTBEAT_SECONDS = env.float(
+    "INGESTION_JOB_HEARTBEAT_SECONDS", default=30
+)
+INGESTION_JOB_STALE_SECONDS = env.int("INGESTION_JOB_STALE_SECONDS", default=300)
+INGESTION_JOB_MAX_ATTEMPTS = env.int("INGESTION_JOB_MAX_ATTEMPTS", default=3)
+
+# Streaming ingestion pipeline, see games/services/document_ingestion_service.py. Sections are split into batches
+# of INGESTION_PIPELINE_BATCH_SIZE, and page extraction runs at most INGESTION_PIPELINE_QUEUE_SIZE batches ahead of
+# the embedding. Consecutive batches are embedded together, up to EMBEDDING_MAX_CONCURRENCY requests at a time.
+INGESTION_PIPELINE_BATCH_SIZE = env.int("INGESTION_PIPELINE_BATCH_SIZE", default=256)
+INGESTION_PIPELINE_QUEUE_SIZE = env.int("INGESTION_PIPELINE_QUEUE_SIZE", default=4)
+
 if TESTING:
     MEDIA_ROOT = Path(tempfile.mkdtemp(prefix="rulesbot-test-media-"))
     STORAGES["default"] = {
@@ -217,3 +275,67 @@ LOGOUT_REDIRECT_URL = "/"
 
 # ChatGPT settings
 DEFAULT_CHATGPT_MODEL = "gpt-5.4-nano"
+
+# Vector store settings
+# Maximum number of index bytes each process keeps loaded in the vector store registry
+VECTOR_STORE_REGISTRY_MAX_BYTES = env.int(
+    "VECTOR_STORE_REGISTRY_MAX_BYTES", default=512 * 1024 * 1024
+)
+
+# Local disk cache for index files, shared by all workers on a host
+VECTOR_STORE_DISK_CACHE_DIR = env(
+    "VECTOR_STORE_DISK_CACHE_DIR",
+    default=os.path.join(tempfile.gettempdir(), "rulesbot-index-cache"),
+)
+VECTOR_STORE_DISK_CACHE_MAX_BYTES = env.int(
+    "VECTOR_STORE_DISK_CACHE_MAX_BYTES", default=2 * 1024 * 1024 * 1024
+)
+
+# Index files of earlier index versions are deleted by the ingestion workers this long after they were replaced,
+# so other workers that are still loading them do not fail. 0 deletes them right away.
+VECTOR_STORE_SUPERSEDED_FILE_GRACE_SECONDS = env.int(
+    "VECTOR_STORE_SUPERSEDED_FILE_GRACE_SECONDS", default=60 * 60
+)
+
+# Default faiss index type of game indexes, see games/index_types.py. Can be overridden per game.
+VECTOR_STORE_INDEX_TYPE = env("VECTOR_STORE_INDEX_TYPE", default="flat")
+# The settings can not import games/index_types.py, keep this in sync with its INDEX_TYPE_CHOICES
+if VECTOR_STORE_INDEX_TYPE not in ("flat", "sq8", "sqfp16", "ivf_pq", "hnsw"):
+    raise ImproperlyConfigured(
+        "VECTOR_STORE_INDEX_TYPE must be flat, sq8, sqfp16, ivf_pq or hnsw, "
+        f"not {VECTOR_STORE_INDEX_TYPE!r}"
+    )
+
+# Default embedding backend of game indexes, see games/embedding_backends.py. Can be overridden per game.
+EMBEDDING_BACKEND = env("EMBEDDING_BACKEND", default="fake" if TESTING else "openai")
+# The settings can not import games/embedding_backends.py, keep this in sync with its backends
+if EMBEDDING_BACKEND not in ("openai", "hashed") and not (
+    TESTING and EMBEDDING_BACKEND == "fake"
+):
+    raise ImproperlyConfigured(
+        f"EMBEDDING_BACKEND must be openai or hashed, not {EMBEDDING_BACKEND!r}"
+    )
+HASHED_EMBEDDING_DIMENSIONS = env.int("HASHED_EMBEDDING_DIMENSIONS", default=1024)
+
+# Prewarm the registry of each worker with the indexes of the games with the most chat sessions in the last days
+VECTOR_STORE_PREWARM_GAMES = env.int("VECTOR_STORE_PREWARM_GAMES", default=10)
+VECTOR_STORE_PREWARM_DAYS = env.int("VECTOR_STORE_PREWARM_DAYS", default=30)
+VECTOR_STORE_PREWARM_WORKERS = env.int("VECTOR_STORE_PREWARM_WORKERS", default=2)
+# Workers report ready on /up/ after prewarming for this long even if it is not done, so the health check passes
+VECTOR_STORE_PREWARM_TIMEOUT_SECONDS = env.float(
+    "VECTOR_STORE_PREWARM_TIMEOUT_SECONDS", default=20
+)
+
+# Cache of question embeddings, in process in front of a database table shared by all workers
+QUERY_EMBEDDING_CACHE_MAX_ENTRIES = env.int(
+    "QUERY_EMBEDDING_CACHE_MAX_ENTRIES", default=1000
+)
+QUERY_EMBEDDING_CACHE_TTL_SECONDS = env.int(
+    "QUERY_EMBEDDING_CACHE_TTL_SECONDS", default=7 * 24 * 60 * 60
+)
+
+if TESTING:
+    VECTOR_STORE_DISK_CACHE_DIR = Path(
+        tempfile.mkdtemp(prefix="rulesbot-test-index-cache-")
+    )
+    VECTOR_STORE_SUPERSEDED_FILE_GRACE_SECONDS = 0
@@ -0,0 +1,171 @@
+"""
+This script compares the embedding backends of games/embedding_backends.py on retrieval latency and quality.
+
+The script is run from the root of the project.
+
+Usage:
+    python -m tests.benchmarks.benchmark_embedding_backends
+    python -m tests.benchmarks.benchmark_embedding_backends --pdf path/to/rulebook.pdf --queries 500
+    OPENAI_API_KEY=... python -m tests.benchmarks.benchmark_embedding_backends
+
+The rulebooks of the tests/fixtures/evaluate_rulesbot/*.json fixtures are downloaded and split into sections the
+same way as when ingesting a game, or the given PDF files are used instead. The openai backend is only benchmarked
+when OPENAI_API_KEY is set. Embeddings are computed directly, without the embedding caches.
+
+For each backend it reports:
+    - Embed sections: sections embedded per second, as when ingesting
+    - Query latency: mean and p95 of embedding a query plus a k=3 search of a flat index, i.e. the retrieval
+      latency of a question that is not in the query embedding cache
+    - Passage hit@3: the share of queries made of a random passage of --passage-words words of a section that
+      return that section in the top 3
+    - Answer hit@3: for the fixture questions, the share that return the section best matching the reference
+      answer (by BM25) in the top 3. Only with the fixture rulebooks
+    - Same top 3 as openai: the share of queries with the same top 3 sections as the openai backend
+"""
+
+import os
+import random
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import django
+
+# Load django - this has to be done before loading the loaders, hence the odd import order
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "rulesbot.settings")
+django.setup()
+
+import numpy as np  # noqa: E402
+
+from games import embedding_backends, index_types  # noqa: E402
+from games.embedding_backends import HashedNgramEmbedding  # noqa: E402
+from games.lexical_index import LexicalIndex  # noqa: E402
+from tests.benchmarks.benchmark_index_types import (  # noqa: E402
+    K,
+    build_index,
+    download_rulebooks,
+    load_fixtures,
+    load_sections,
+)
+
+
+def backends():
+    embeddings = {
+        "fake": embedding_backends.get_embedding(embedding_backends.FAKE),
+        "hashed": HashedNgramEmbedding(use_numpy=True),
+        "hashed (python)": HashedNgramEmbedding(use_numpy=False),
+    }
+    if os.environ.get("OPENAI_API_KEY"):
+        embeddings["openai"] = embedding_backends.get_embedding(
+            embedding_backends.OPENAI
+        )
+    return embeddings
+
+
+def passage_queries(texts, count, words, seed=0):
+    """
+    Returns (query, position of its section) for random passages of sections with enough words.
+    """
+    generator = random.Random(seed)
+    candidates = [
+        position for position, text in enumerate(texts) if len(text.split()) > words
+    ]
+    queries = []
+    for position in generator.sample(candidates, min(count, len(candidates))):
+        text_words = texts[position].split()
+        start = generator.randrange(len(text_words) - words)
+        queries.append((" ".join(text_words[start:][:words]), position))
+    return queries
+
+
+def answer_queries(fixtures, texts):
+    """
+    Returns (question, position of the section best matching its reference answer) for the fixture questions.
+    """
+    lexical_index = LexicalIndex.build(
+        [str(position) for position in range(len(texts))], texts
+    )
+    queries = []
+    for fixture in fixtures:
+        for session in fixture.get("question_sessions", []):
+            matches = lexical_index.search(session["answer"], k=1)
+            if matches:
+                queries.append((session["question"], int(matches[0][0])))
+    return queries
+
+
+def retrieve(embedding, index, queries):
+    """
+    Returns the top k section positions of each query and the latency of each query in ms.
+    """
+    results = []
+    latencies = []
+    for query, _ in queries:
+        started_at = time.perf_counter()
+        documents = index.similarity_search_by_vector(embedding.embed_query(query), k=K)
+        latencies.append((time.perf_counter() - started_at) * 1000)
+        results.append([int(document.id) for document in documents])
+    return results, latencies
+
+
+def hit_rate(results, queries):
+    if not queries:
+        return float("nan")
+    return np.mean(
+        [position in result for result, (_, position) in zip(results, queries)]
+    )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--pdf",
+        type=Path,
+        action="append",
+        help="Rulebook to use instead of the fixture rulebooks. Can be given multiple times.",
+    )
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--passage-words", type=int, default=12)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        fixtures = [] if args.pdf else load_fixtures()
+        paths = args.pdf or download_rulebooks(fixtures, Path(directory))
+        texts = load_sections(paths, 0)
+
+    passages = passage_queries(texts, args.queries, args.passage_words)
+    answers = answer_queries(fixtures, texts) if fixtures else []
+    print(
+        f"{len(texts)} sections, {len(passages)} passage queries, {len(answers)} answer queries"
+    )
+
+    top_sections = {}
+    for name, embedding in backends().items():
+        started_at = time.perf_counter()
+        vectors = np.array(embedding.embed_documents(texts), dtype=np.float32)
+        embed_seconds = time.perf_counter() - started_at
+        index = build_index(index_types.FLAT, embedding, texts, vectors)
+
+        passage_results, latencies = retrieve(embedding, index, passages)
+        answer_results, answer_latencies = retrieve(embedding, index, answers)
+        latencies += answer_latencies
+        top_sections[name] = passage_results + answer_results
+
+        print(f"Backend: {name} ({vectors.shape[1]} dimensions)")
+        print(f"  Embed sections:      {len(texts) / embed_seconds:.0f} sections/s")
+        print(f"  Query latency mean:  {np.mean(latencies):.3f} ms")
+        print(f"  Query latency p95:   {np.percentile(latencies, 95):.3f} ms")
+        print(f"  Passage hit@{K}:       {hit_rate(passage_results, passages):.3f}")
+        if answers:
+            print(f"  Answer hit@{K}:        {hit_rate(answer_results, answers):.3f}")
+
+    if "openai" in top_sections:
+        for name, results in top_sections.items():
+            same = np.mean(
+                [
+                    result == reference
+                    for result, reference in zip(results, top_sections["openai"])
+                ]
+            )
+            print(f"{name}: same top {K} as openai {same:.3f}")
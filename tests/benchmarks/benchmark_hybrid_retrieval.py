@@ -0,0 +1,209 @@
+"""
+This script compares vector only retrieval with hybrid (vector and lexical BM25) retrieval in RulesBotRetriever
+on latency and on overlap of the retrieved sections.
+
+The script is run from the root of the project.
+
+Usage:
+    python -m tests.benchmarks.benchmark_hybrid_retrieval
+    python -m tests.benchmarks.benchmark_hybrid_retrieval --embedding-latency-ms 150
+    python -m tests.benchmarks.benchmark_hybrid_retrieval --openai
+    python -m tests.benchmarks.benchmark_hybrid_retrieval --pdf path/to/rulebook.pdf
+
+The rulebooks of the tests/fixtures/evaluate_rulesbot/*.json fixtures are downloaded and split into sections the
+same way as when ingesting a game, or the given PDF files are used instead. The questions of the fixtures are used
+as queries, together with the short keyword queries made of their two rarest terms.
+
+Sections are embedded with DeterministicFakeEmbedding unless --openai is given. Fake embeddings are free and
+random, so use --embedding-latency-ms to simulate the round trip to the embedding API and --openai for overlap
+numbers that say anything about answer quality. Queries are embedded directly, without the query embedding cache.
+
+For each search mode and query kind it reports:
+    - Query latency: mean and p95 of a k=3 retrieval, including embedding the query
+    - Embedding calls: the share of queries that had to be embedded
+    - Overlap@3: the share of the vector only top 3 sections also returned by the mode
+"""
+
+import os
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import django
+
+# Load django - this has to be done before loading the loaders, hence the odd import order
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "rulesbot.settings")
+django.setup()
+
+import numpy as np  # noqa: E402
+from langchain_community.embeddings.fake import DeterministicFakeEmbedding  # noqa: E402
+from langchain_community.vectorstores import FAISS  # noqa: E402
+from langchain_core.documents import Document  # noqa: E402
+from langchain_openai.embeddings import OpenAIEmbeddings  # noqa: E402
+
+from chat.retrievers.rules_bot_retriever import (  # noqa: E402
+    HYBRID_SEARCH,
+    VECTOR_SEARCH,
+    RulesBotRetriever,
+)
+from games.lexical_index import LexicalIndex, tokenize  # noqa: E402
+from games.models import Game  # noqa: E402
+from games.vectorstores import GameVectorStore  # noqa: E402
+from tests.benchmarks.benchmark_index_types import (  # noqa: E402
+    download_rulebooks,
+    load_fixtures,
+    load_sections,
+)
+
+K = 3
+
+
+class BenchmarkVectorStore(GameVectorStore):
+    """
+    An in memory game vector store that embeds queries directly and counts the embedding calls.
+    """
+
+    def __init__(self, embedding, texts, embedding_latency_ms):
+        super().__init__(Game(name="Benchmark"), embedding)
+        self.embedding_latency_ms = embedding_latency_ms
+        self.embedding_calls = 0
+
+        documents = [
+            Document(id=str(position), page_content=text, metadata={"page": position})
+            for position, text in enumerate(texts)
+        ]
+        self.index = FAISS.from_documents(documents, embedding)
+        self.lexical_index = LexicalIndex.build(
+            [document.id for document in documents], texts
+        )
+
+    def embed_query(self, query):
+        self.embedding_calls += 1
+        time.sleep(self.embedding_latency_ms / 1000)
+        return self.embedding.embed_query(query)
+
+
+def keyword_query(question, lexical_index):
+    """
+    The two rarest terms of the question that are in the index, like a user typing a few keywords.
+    """
+    terms = list(dict.fromkeys(tokenize(question)))
+    terms = [term for term in terms if term in lexical_index.postings]
+    terms.sort(key=lambda term: len(lexical_index.postings[term][0]))
+    return " ".join(terms[:2])
+
+
+def retrieve(vector_store, search_mode, queries):
+    """
+    Returns the retrieved section ids of each query and the latency of each query in ms.
+    """
+    retriever = RulesBotRetriever(
+        index=vector_store.index,
+        vector_store=vector_store,
+        search_kwargs={"k": K},
+        search_mode=search_mode,
+    )
+    results = []
+    latencies = []
+    vector_store.embedding_calls = 0
+    for query in queries:
+        started_at = time.perf_counter()
+        documents = retriever.invoke(query)
+        latencies.append((time.perf_counter() - started_at) * 1000)
+        results.append([document.id for document in documents])
+    return results, latencies, vector_store.embedding_calls
+
+
+def print_results(name, queries, results, baseline_results, latencies, calls):
+    overlap = np.mean(
+        [
+            len(set(result) & set(baseline)) / len(baseline)
+            for result, baseline in zip(results, baseline_results)
+            if baseline
+        ]
+    )
+    print(f"{name}:")
+    print(f"  Query latency mean:  {np.mean(latencies):.3f} ms")
+    print(f"  Query latency p95:   {np.percentile(latencies, 95):.3f} ms")
+    print(f"  Embedding calls:     {calls / len(queries):.3f}")
+    print(f"  Overlap@{K}:          {overlap:.3f}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--pdf",
+        type=Path,
+        action="append",
+        help="Rulebook to use instead of the fixture rulebooks. Can be given multiple times.",
+    )
+    parser.add_argument("--embedding-latency-ms", type=float, default=0)
+    parser.add_argument(
+        "--openai",
+        action="store_true",
+        help="Embed with OpenAI instead of fake embeddings. Makes embedding API calls.",
+    )
+    args = parser.parse_args()
+
+    fixtures = load_fixtures()
+    embedding = (
+        OpenAIEmbeddings() if args.openai else DeterministicFakeEmbedding(size=1536)
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = args.pdf or download_rulebooks(fixtures, Path(directory))
+        if not paths:
+            paths = [Path("games/fixtures/test.pdf")]
+            print(
+                "Could not download any fixture rulebooks, using games/fixtures/test.pdf"
+            )
+        texts = load_sections(paths, 0)
+
+    vector_store = BenchmarkVectorStore(embedding, texts, args.embedding_latency_ms)
+    questions = [
+        session["question"]
+        for fixture in fixtures
+        for session in fixture["question_sessions"]
+    ]
+    query_kinds = {
+        "questions": questions,
+        "keyword queries": [
+            query
+            for query in (
+                keyword_query(question, vector_store.lexical_index)
+                for question in questions
+            )
+            if query
+        ],
+    }
+
+    print(
+        f"Benchmarking {len(texts)} sections with {len(questions)} questions, "
+        f"simulated embedding latency {args.embedding_latency_ms:.0f} ms"
+    )
+
+    for kind, queries in query_kinds.items():
+        if not queries:
+            print(f"No {kind} match the sections, skipping them")
+            continue
+        baseline_results, latencies, calls = retrieve(
+            vector_store, VECTOR_SEARCH, queries
+        )
+        print_results(
+            f"Vector search, {kind}",
+            queries,
+            baseline_results,
+            baseline_results,
+            latencies,
+            calls,
+        )
+        results, latencies, calls = retrieve(vector_store, HYBRID_SEARCH, queries)
+        print_results(
+            f"Hybrid search, {kind}",
+            queries,
+            results,
+            baseline_results,
+            latencies,
+            calls,
+        )
@@ -0,0 +1,151 @@
+"""
+This script compares the memory used per worker process when loading a game index in the legacy pickled
+format and in the memory mapped split format.
+
+The script is run from the root of the project.
+
+Usage:
+    python -m tests.benchmarks.benchmark_index_memory
+    python -m tests.benchmarks.benchmark_index_memory --vectors 50000 --workers 6
+
+For each format it starts a number of worker processes (like our gunicorn workers), loads the same index in
+each of them, runs a search to touch all vectors and reports:
+    - RSS: resident memory of the worker, including shared pages
+    - PSS: proportional set size, where shared pages are divided between the processes sharing them
+The sum of PSS across workers is the real memory cost of the index on the host.
+"""
+
+import multiprocessing
+import os
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+from langchain_community.embeddings.fake import DeterministicFakeEmbedding
+from langchain_community.vectorstores import FAISS
+
+from games import index_formats
+
+
+def build_index(vectors: int, dimension: int) -> FAISS:
+    embedding = DeterministicFakeEmbedding(size=dimension)
+    rng = np.random.default_rng(42)
+    text_embeddings = [
+        (f"Section {i} of the rulebook", rng.random(dimension, dtype=np.float32))
+        for i in range(vectors)
+    ]
+    return FAISS.from_embeddings(
+        text_embeddings,
+        embedding,
+        metadatas=[{"page": i // 5, "document_id": 1} for i in range(vectors)],
+    )
+
+
+def write_formats(index: FAISS, directory: Path) -> dict:
+    legacy_path = directory / "legacy.faiss"
+    legacy_path.write_bytes(index.serialize_to_bytes())
+
+    split_index_path = directory / "split.index"
+    split_index_path.write_bytes(index_formats.serialize_raw_index(index))
+    docstore_path = directory / "split.docstore"
+    docstore_path.write_bytes(index_formats.serialize_docstore(index))
+
+    return {
+        "legacy": (legacy_path,),
+        "split": (split_index_path, docstore_path),
+    }
+
+
+def memory_usage_kb():
+    """
+    Returns the (RSS, PSS) of the current process in kB.
+    """
+    usage = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("Rss", "Pss"):
+                usage[key] = int(value.split()[0])
+    return usage["Rss"], usage["Pss"]
+
+
+def worker(index_format, paths, dimension, ready, start, results):
+    embedding = DeterministicFakeEmbedding(size=dimension)
+    baseline_rss, baseline_pss = memory_usage_kb()
+
+    started_at = time.perf_counter()
+    if index_format == "legacy":
+        index = FAISS.deserialize_from_bytes(
+            paths[0].read_bytes(), embedding, allow_dangerous_deserialization=True
+        )
+    else:
+        index = index_formats.load_split_index(paths[0], paths[1], embedding)
+    # A flat index search touches every vector, like a worker that has served a few questions
+    index.similarity_search_by_vector(np.zeros(dimension, dtype=np.float32), k=3)
+    load_seconds = time.perf_counter() - started_at
+
+    # Wait until every worker has loaded the index, so the PSS reflects the pages shared between them
+    ready.wait()
+    start.wait()
+    rss, pss = memory_usage_kb()
+    results.put((rss - baseline_rss, pss - baseline_pss, load_seconds))
+
+
+def run_format(index_format, paths, dimension, workers):
+    context = multiprocessing.get_context("spawn")
+    ready = context.Barrier(workers)
+    start = context.Barrier(workers)
+    results = context.Queue()
+
+    processes = [
+        context.Process(
+            target=worker,
+            args=(index_format, paths, dimension, ready, start, results),
+        )
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    measurements = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return measurements
+
+
+def print_results(index_format, measurements, stored_bytes):
+    rss = [rss for rss, _, _ in measurements]
+    pss = [pss for _, pss, _ in measurements]
+    load_seconds = [load_seconds for _, _, load_seconds in measurements]
+    print(f"Format: {index_format}")
+    print(f"  Stored size:            {stored_bytes / 1024 / 1024:.1f} MB")
+    print(f"  Load time per worker:   {np.mean(load_seconds) * 1000:.0f} ms")
+    print(f"  RSS per worker:         {np.mean(rss) / 1024:.1f} MB")
+    print(f"  PSS per worker:         {np.mean(pss) / 1024:.1f} MB")
+    print(f"  PSS across all workers: {sum(pss) / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--vectors", type=int, default=20000)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--workers", type=int, default=6)
+    args = parser.parse_args()
+
+    print(
+        f"Building index with {args.vectors} vectors of dimension {args.dimension} "
+        f"and loading it in {args.workers} workers"
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        formats = write_formats(
+            build_index(args.vectors, args.dimension), Path(directory)
+        )
+        for index_format, paths in formats.items():
+            measurements = run_format(index_format, paths, args.dimension, args.workers)
+            print_results(
+                index_format,
+                measurements,
+                sum(os.path.getsize(path) for path in paths),
+            )
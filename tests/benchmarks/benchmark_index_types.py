@@ -0,0 +1,184 @@
+"""
+This script compares the index types of games/index_types.py on recall, query latency and size.
+
+The script is run from the root of the project.
+
+Usage:
+    python -m tests.benchmarks.benchmark_index_types
+    python -m tests.benchmarks.benchmark_index_types --copies 20
+    python -m tests.benchmarks.benchmark_index_types --pdf path/to/rulebook.pdf
+
+The rulebooks of the tests/fixtures/evaluate_rulesbot/*.json fixtures are downloaded and split into sections the
+same way as when ingesting a game (without summarizing setup pages), or the given PDF files are used instead.
+Sections are embedded with DeterministicFakeEmbedding, so no embedding API calls are made. The questions of the
+fixtures are used as queries. Use --copies to add copies of the sections and measure indexes of bigger games.
+
+For each index type it reports:
+    - Recall@3: the share of the top 3 flat index results also returned by the index type
+    - Same top 3: the share of queries with exactly the same top 3 sections as the flat index,
+      i.e. where RulesBotRetriever would give the model the same context
+    - Query latency: mean and p95 of a k=3 similarity search through the langchain FAISS wrapper
+    - Bytes per vector: size of the serialized faiss index divided by the number of vectors
+"""
+
+import json
+import os
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import django
+
+# Load django - this has to be done before loading the loaders, hence the odd import order
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "rulesbot.settings")
+django.setup()
+
+import faiss  # noqa: E402
+import numpy as np  # noqa: E402
+import requests  # noqa: E402
+from langchain_community.docstore.in_memory import InMemoryDocstore  # noqa: E402
+from langchain_community.embeddings.fake import DeterministicFakeEmbedding  # noqa: E402
+from langchain_community.vectorstores import FAISS  # noqa: E402
+from langchain_core.documents import Document  # noqa: E402
+
+from games import index_types  # noqa: E402
+from games.loaders.pdf_loader_and_summarizer import (  # noqa: E402
+    _load_pages,
+    _split_pages_to_sections,
+)
+
+FIXTURES = Path(__file__).parent.parent.joinpath("fixtures", "evaluate_rulesbot")
+K = 3
+
+
+def load_fixtures():
+    return [json.loads(path.read_text()) for path in sorted(FIXTURES.glob("*.json"))]
+
+
+def download_rulebooks(fixtures, directory: Path) -> list:
+    paths = []
+    for fixture in fixtures:
+        for number, document in enumerate(fixture["documents"]):
+            path = directory / f"{fixture['name']}-{number}.pdf"
+            try:
+                response = requests.get(document["url"], timeout=60)
+                response.raise_for_status()
+            except requests.RequestException as e:
+                print(f"Skipping {document['url']}: {e}")
+                continue
+            path.write_bytes(response.content)
+            paths.append(path)
+    return paths
+
+
+def load_sections(paths, copies) -> list:
+    texts = []
+    for path in paths:
+        texts.extend(
+            section.page_content
+            for section in _split_pages_to_sections(_load_pages(str(path)))
+        )
+    return texts + [
+        f"{text} (copy {copy})" for copy in range(1, copies + 1) for text in texts
+    ]
+
+
+def build_index(index_type, embedding, texts, vectors) -> FAISS:
+    docstore = InMemoryDocstore(
+        {
+            str(position): Document(id=str(position), page_content=text)
+            for position, text in enumerate(texts)
+        }
+    )
+    return FAISS(
+        embedding,
+        index_types.build_faiss_index(index_type, vectors),
+        docstore,
+        {position: str(position) for position in range(len(texts))},
+    )
+
+
+def top_k(index: FAISS, query_vectors) -> tuple:
+    """
+    Returns the top k docstore ids of each query and the latency of each query in ms.
+    """
+    results = []
+    latencies = []
+    for query_vector in query_vectors:
+        started_at = time.perf_counter()
+        documents = index.similarity_search_by_vector(query_vector, k=K)
+        latencies.append((time.perf_counter() - started_at) * 1000)
+        results.append([document.id for document in documents])
+    return results, latencies
+
+
+def print_results(index_type, index, results, baseline_results, latencies):
+    recall = np.mean(
+        [
+            len(set(result) & set(baseline)) / len(baseline)
+            for result, baseline in zip(results, baseline_results)
+        ]
+    )
+    same_top_k = np.mean(
+        [result == baseline for result, baseline in zip(results, baseline_results)]
+    )
+    index_bytes = faiss.serialize_index(index.index).nbytes
+
+    print(f"Index type: {index_type}")
+    print(f"  Recall@{K}:           {recall:.3f}")
+    print(f"  Same top {K}:         {same_top_k:.3f}")
+    print(f"  Query latency mean:  {np.mean(latencies):.3f} ms")
+    print(f"  Query latency p95:   {np.percentile(latencies, 95):.3f} ms")
+    print(f"  Bytes per vector:    {index_bytes / index.index.ntotal:.0f}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--pdf",
+        type=Path,
+        action="append",
+        help="Rulebook to use instead of the fixture rulebooks. Can be given multiple times.",
+    )
+    parser.add_argument("--copies", type=int, default=0)
+    parser.add_argument("--dimension", type=int, default=1536)
+    args = parser.parse_args()
+
+    fixtures = load_fixtures()
+    embedding = DeterministicFakeEmbedding(size=args.dimension)
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = args.pdf or download_rulebooks(fixtures, Path(directory))
+        if not paths:
+            paths = [Path("games/fixtures/test.pdf")]
+            print(
+                "Could not download any fixture rulebooks, using games/fixtures/test.pdf"
+            )
+        texts = load_sections(paths, args.copies)
+
+    questions = [
+        session["question"]
+        for fixture in fixtures
+        for session in fixture["question_sessions"]
+    ]
+    vectors = np.array(embedding.embed_documents(texts), dtype=np.float32)
+    query_vectors = [embedding.embed_query(question) for question in questions]
+
+    print(
+        f"Benchmarking {len(texts)} sections of dimension {args.dimension} with {len(questions)} queries"
+    )
+
+    baseline_results = None
+    for index_type, _ in index_types.INDEX_TYPE_CHOICES:
+        built_type = index_types.effective_index_type(index_type, len(texts))
+        if built_type != index_type:
+            print(f"Index type: {index_type}")
+            print(f"  Skipped, {len(texts)} sections builds a {built_type} index")
+            continue
+
+        index = build_index(index_type, embedding, texts, vectors)
+        results, latencies = top_k(index, query_vectors)
+        if baseline_results is None:
+            baseline_results = results
+        print_results(index_type, index, results, baseline_results, latencies)
@@ -0,0 +1,148 @@
+"""
+This script compares the time and memory of ingesting a large rulebook by loading all its sections before embedding
+them, with the streaming ingestion pipeline of games/services/document_ingestion_service.py.
+
+The script is run from the root of the project.
+
+Usage:
+    python -m tests.benchmarks.benchmark_ingestion_pipeline
+    python -m tests.benchmarks.benchmark_ingestion_pipeline --pages 1000 --embedding-latency-ms 200
+    python -m tests.benchmarks.benchmark_ingestion_pipeline --pdf path/to/rulebook.pdf
+
+Without --pdf a synthetic rulebook of --pages pages of rules text is generated. Sections are embedded by a fake
+embedding of 1536 dimensions, which waits --embedding-latency-ms per request of --batch-size sections like a
+request to the embeddings API would.
+
+It reports the time, the peak of memory allocated by Python (tracemalloc) and the peak resident memory of:
+    - materialized: load_and_split, then embedding all sections and building the FAISS index (the previous ingest)
+    - streaming: the pipeline, extracting and splitting pages in a background thread while the sections are
+      embedded and appended to the FAISS index --batch-size at a time
+
+Each mode runs in a fresh process, so the resident memory of one does not hide the other.
+"""
+
+import math
+import os
+import resource
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from types import SimpleNamespace
+
+import django
+
+# Load django - this has to be done before loading the loaders, hence the odd import order
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "rulesbot.settings")
+django.setup()
+
+from langchain_community.embeddings.fake import (  # noqa: E402
+    DeterministicFakeEmbedding,
+)
+from langchain_community.vectorstores import FAISS  # noqa: E402
+
+from games.loaders.pdf_loader_and_summarizer import (  # noqa: E402
+    load_and_split,
+    stream_sections,
+)
+from games.services.document_ingestion_service import (  # noqa: E402
+    _batched,
+    _buffered,
+)
+from tests.benchmarks.benchmark_pdf_parsing import write_rulebook  # noqa: E402
+
+
+class SlowFakeEmbedding(DeterministicFakeEmbedding):
+    latency_seconds: float = 0.0
+    batch_size: int = 256
+
+    def embed_documents(self, texts):
+        time.sleep(self.latency_seconds * math.ceil(len(texts) / self.batch_size))
+        return super().embed_documents(texts)
+
+
+def materialized(path, document, embedding, batch_size, queue_size):
+    sections = load_and_split(path, document)
+    texts = [section.page_content for section in sections]
+    return FAISS.from_embeddings(
+        zip(texts, embedding.embed_documents(texts)),
+        embedding,
+        metadatas=[section.metadata for section in sections],
+    )
+
+
+def streaming(path, document, embedding, batch_size, queue_size):
+    index = None
+    for sections in _buffered(
+        _batched(stream_sections(path, document), batch_size), queue_size
+    ):
+        texts = [section.page_content for section in sections]
+        embeddings = zip(texts, embedding.embed_documents(texts))
+        metadatas = [section.metadata for section in sections]
+        if index is None:
+            index = FAISS.from_embeddings(embeddings, embedding, metadatas=metadatas)
+        else:
+            index.add_embeddings(embeddings, metadatas=metadatas)
+    return index
+
+
+MODES = {"materialized": materialized, "streaming": streaming}
+
+
+def run(mode, path, latency_seconds, batch_size, queue_size):
+    embedding = SlowFakeEmbedding(
+        size=1536, latency_seconds=latency_seconds, batch_size=batch_size
+    )
+    document = SimpleNamespace(ignore_pages="", setup_pages="")
+
+    tracemalloc.start()
+    started_at = time.perf_counter()
+    index = MODES[mode](path, document, embedding, batch_size, queue_size)
+    elapsed = time.perf_counter() - started_at
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "seconds": elapsed,
+        "sections": index.index.ntotal,
+        "peak_mb": peak / 1024**2,
+        # ru_maxrss is in kilobytes on Linux
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--pdf", type=Path)
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--embedding-latency-ms", type=float, default=100)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--queue-size", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.pdf
+        if path is None:
+            path = Path(directory) / "rulebook.pdf"
+            write_rulebook(path, args.pages)
+
+        print(
+            f"{path.name}: embedding latency {args.embedding_latency_ms:.0f} ms per {args.batch_size} sections, "
+            f"queue of {args.queue_size} batches"
+        )
+        for mode in MODES:
+            with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as executor:
+                result = executor.submit(
+                    run,
+                    mode,
+                    str(path),
+                    args.embedding_latency_ms / 1000,
+                    args.batch_size,
+                    args.queue_size,
+                ).result()
+            print(
+                f"  {mode.capitalize() + ':':14} {result['seconds']:.2f} s, {result['sections']} sections, "
+                f"Python peak {result['peak_mb']:.1f} MB, max RSS {result['max_rss_mb']:.1f} MB"
+            )
@@ -0,0 +1,93 @@
+"""
+This script compares extracting the pages of rulebooks serially with extracting them in parallel in a pool of
+worker processes (games/loaders/pdf_pages.py).
+
+The script is run from the root of the project.
+
+Usage:
+    python -m tests.benchmarks.benchmark_pdf_extraction
+    python -m tests.benchmarks.benchmark_pdf_extraction --workers 8 --runs 10
+    python -m tests.benchmarks.benchmark_pdf_extraction --pdf path/to/rulebook.pdf
+
+The rulebooks of the tests/fixtures/evaluate_rulesbot/*.json fixtures are downloaded, or the given PDF files are
+used instead, together with a synthetic rulebook of --pages pages of rules text.
+
+For each rulebook it reports the mean and minimum time of:
+    - serial: load_pages in this process, the loader before parallel extraction
+    - parallel: load_pages with --workers worker processes, once the pool is started
+
+and checks that both return the same pages. Starting the pool is a one off cost per process, reported separately.
+"""
+
+import os
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import django
+
+# Load django - this has to be done before loading the loaders, hence the odd import order
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "rulesbot.settings")
+django.setup()
+
+import numpy as np  # noqa: E402
+
+from games.loaders.pdf_pages import load_pages  # noqa: E402
+from tests.benchmarks.benchmark_index_types import (  # noqa: E402
+    download_rulebooks,
+    load_fixtures,
+)
+from tests.benchmarks.benchmark_pdf_parsing import write_rulebook  # noqa: E402
+
+
+def measure(function, runs):
+    timings = []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        pages = function()
+        timings.append((time.perf_counter() - started_at) * 1000)
+    return pages, timings
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--pdf",
+        type=Path,
+        action="append",
+        help="Rulebook to use instead of the fixture rulebooks. Can be given multiple times.",
+    )
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = args.pdf or download_rulebooks(load_fixtures(), Path(directory))
+        synthetic = Path(directory) / "synthetic.pdf"
+        write_rulebook(synthetic, args.pages)
+        paths.append(synthetic)
+
+        started_at = time.perf_counter()
+        load_pages(synthetic, workers=args.workers)
+        print(
+            f"Started {args.workers} workers in {(time.perf_counter() - started_at) * 1000:.1f} ms "
+            f"({os.cpu_count()} CPUs), {args.runs} runs"
+        )
+
+        for path in paths:
+            serial_pages, serial = measure(lambda: load_pages(path), args.runs)
+            parallel_pages, parallel = measure(
+                lambda: load_pages(path, workers=args.workers), args.runs
+            )
+            print(f"{path.name}: {len(serial_pages)} pages")
+            print(
+                f"  Serial:    mean {np.mean(serial):.1f} ms, min {np.min(serial):.1f} ms"
+            )
+            print(
+                f"  Parallel:  mean {np.mean(parallel):.1f} ms, min {np.min(parallel):.1f} ms"
+            )
+            print(f"  Speedup:   {np.mean(serial) / np.mean(parallel):.2f}x")
+            if parallel_pages != serial_pages:
+                print("  Warning: the parallel pages differ from the serial pages")
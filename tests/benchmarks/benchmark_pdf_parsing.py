@@ -0,0 +1,98 @@
+"""
+This script compares the time spent parsing a rulebook when ingesting it, before and after validating and
+extracting pages in a single pass with PyMuPDF (games/loaders/pdf_pages.py).
+
+The script is run from the root of the project.
+
+Usage:
+    python -m tests.benchmarks.benchmark_pdf_parsing
+    python -m tests.benchmarks.benchmark_pdf_parsing --pages 400 --runs 10
+    python -m tests.benchmarks.benchmark_pdf_parsing --pdf path/to/rulebook.pdf
+
+Without --pdf a synthetic rulebook of --pages pages of rules text is generated.
+
+It reports the mean and minimum time of:
+    - two pass: validating with pypdf, then extracting pages with PyMuPDFLoader (the previous ingest)
+    - single pass: load_pages
+"""
+
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+import pymupdf
+from langchain_community.document_loaders import PyMuPDFLoader
+from pypdf import PdfReader
+
+from games.loaders.pdf_pages import load_pages
+
+RULES_TEXT = (
+    "On your turn you may move your pawn up to three spaces and then draw a card. "
+    "If you land on a space with another player, you may trade one resource card with them. "
+    "At the end of the round every player discards down to seven cards. "
+)
+
+
+def write_rulebook(path: Path, pages: int):
+    pdf = pymupdf.open()
+    for number in range(pages):
+        page = pdf.new_page()
+        page.insert_textbox(
+            page.rect + (50, 50, -50, -50),
+            f"Page {number + 1}\n\n" + RULES_TEXT * 12,
+            fontsize=9,
+        )
+    pdf.save(path)
+
+
+def two_pass(path):
+    with open(path, "rb") as pdf_file:
+        PdfReader(pdf_file)
+    return PyMuPDFLoader(str(path)).load()
+
+
+def single_pass(path):
+    return load_pages(path)
+
+
+def measure(function, path, runs):
+    timings = []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        pages = function(path)
+        timings.append((time.perf_counter() - started_at) * 1000)
+    return pages, timings
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--pdf", type=Path)
+    parser.add_argument("--pages", type=int, default=250)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.pdf
+        if path is None:
+            path = Path(directory) / "rulebook.pdf"
+            write_rulebook(path, args.pages)
+
+        results = {}
+        for name, function in [("two pass", two_pass), ("single pass", single_pass)]:
+            results[name] = measure(function, path, args.runs)
+
+        pages = results["single pass"][0]
+        print(
+            f"Parsing {path.name}: {len(pages)} pages, {path.stat().st_size / 1024 / 1024:.1f} MB, {args.runs} runs"
+        )
+        if results["two pass"][0] != pages:
+            print("  Warning: the single pass pages differ from PyMuPDFLoader")
+
+    for name, (_, timings) in results.items():
+        print(f"{name}:")
+        print(f"  Mean:  {np.mean(timings):.1f} ms")
+        print(f"  Min:   {np.min(timings):.1f} ms")
+    saved = np.mean(results["two pass"][1]) - np.mean(results["single pass"][1])
+    print(f"Saved per ingest: {saved:.1f} ms")
@@ -0,0 +1,133 @@
+"""
+This script compares the time of getting an uploaded rulebook ready for parsing by downloading it over HTTP from its
+storage url, with reading it from the storage backend as games/services/document_ingestion_service.py does.
+
+The script is run from the root of the project.
+
+Usage:
+    python -m tests.benchmarks.benchmark_rulebook_storage
+    python -m tests.benchmarks.benchmark_rulebook_storage --pages 2000 --runs 20
+    python -m tests.benchmarks.benchmark_rulebook_storage --pdf path/to/rulebook.pdf
+
+Without --pdf a synthetic rulebook of --pages pages of rules text is generated. It is saved to a FileSystemStorage
+in a temporary directory, which is also served over HTTP on localhost as a stand-in for the media url.
+
+It reports the mean and p95 over --runs runs of:
+    - http: downloading the rulebook from its url to a temporary file (the previous ingest)
+    - storage copy: copying the rulebook in chunks from storage.open() to a temporary file, as for remote storages
+    - storage path: using the file of the local storage as is
+"""
+
+import functools
+import os
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import django
+
+# Load django - this has to be done before loading the loaders, hence the odd import order
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "rulesbot.settings")
+django.setup()
+
+import numpy as np  # noqa: E402
+from django.core.files.storage import FileSystemStorage  # noqa: E402
+from django.db.models.fields.files import FieldFile  # noqa: E402
+
+from games.models import Document  # noqa: E402
+from games.services.document_ingestion_service import (  # noqa: E402
+    _read_from_storage,
+)
+from games.services.download_service import download_to_file  # noqa: E402
+from tests.benchmarks.benchmark_pdf_parsing import write_rulebook  # noqa: E402
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class RemoteFieldFile(FieldFile):
+    """
+    A field file of a storage without local files, like S3.
+    """
+
+    @property
+    def path(self):
+        raise NotImplementedError
+
+
+def http(rulebook_file, file):
+    download_to_file(rulebook_file.url, file)
+    return file.name
+
+
+def storage_copy(rulebook_file, file):
+    remote_file = RemoteFieldFile(
+        rulebook_file.instance, rulebook_file.field, rulebook_file.name
+    )
+    remote_file.storage = rulebook_file.storage
+    return _read_from_storage(remote_file, file)
+
+
+def storage_path(rulebook_file, file):
+    return _read_from_storage(rulebook_file, file)
+
+
+MODES = {"http": http, "storage copy": storage_copy, "storage path": storage_path}
+
+
+def measure(mode, rulebook_file, runs):
+    timings = []
+    for _ in range(runs):
+        with tempfile.NamedTemporaryFile() as file:
+            started_at = time.perf_counter()
+            filename = MODES[mode](rulebook_file, file)
+            timings.append((time.perf_counter() - started_at) * 1000)
+            size = os.path.getsize(filename)
+    return timings, size
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--pdf", type=Path)
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.pdf
+        if path is None:
+            path = Path(directory) / "source.pdf"
+            write_rulebook(path, args.pages)
+
+        media = Path(directory) / "media"
+        server = ThreadingHTTPServer(
+            ("127.0.0.1", 0), functools.partial(QuietHandler, directory=str(media))
+        )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        storage = FileSystemStorage(
+            location=media, base_url=f"http://127.0.0.1:{server.server_port}/"
+        )
+
+        document = Document()
+        rulebook_file = FieldFile(
+            document, Document._meta.get_field("rulebook_file"), None
+        )
+        rulebook_file.storage = storage
+        with open(path, "rb") as source:
+            rulebook_file.name = storage.save("rulebook.pdf", source)
+
+        print(f"{path.name}: {storage.size(rulebook_file.name) / 1024**2:.1f} MB")
+        try:
+            for mode in MODES:
+                timings, size = measure(mode, rulebook_file, args.runs)
+                print(
+                    f"  {mode.capitalize() + ':':14} mean {np.mean(timings):.2f} ms, "
+                    f"p95 {np.percentile(timings, 95):.2f} ms, {size} bytes"
+                )
+        finally:
+            server.shutdown()
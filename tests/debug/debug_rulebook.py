@@ -24,7 +24,7 @@ from games.models import Game
 from games.services.document_ingestion_service import ingest_document
 
 
-def load_and_split_alternative(filename):
+def load_and_split_alternative(filename, document, **kwargs):
     print("Loading and splitting document in alternative way")
     loader = PyPDFLoader(filename)
     pages = loader.load_and_split()
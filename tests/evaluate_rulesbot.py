@@ -35,6 +35,7 @@ Test data is specified in the fixtures/evaluate_rulesbot/*.json files. One file
         ]
     }
 """
+
 import json
 import os
 from argparse import ArgumentParser
@@ -52,6 +53,7 @@ from colorama import Fore, Style  # noqa: E402
 from chat.models import ChatSession  # noqa: E402
 from chat.services import agentic_streaming_question_answering_service  # noqa: E402
 from chat.services import streaming_question_answering_service  # noqa: E402
+from games.embedding_cache import embedding_cache  # noqa: E402
 from games.models import Game  # noqa: E402
 from games.services import document_ingestion_service  # noqa: E402
 
@@ -73,11 +75,20 @@ def setup_game(game: dict) -> Game:
 
 
 def ingest_game(game: Game) -> None:
+    embedding_cache.reset_stats()
     for document in game.document_set.all():
         document_ingestion_service.ingest_document(document)
     game.ingested = True
     game.save()
 
+    # Chunks embedded by a previous run are served from the embedding cache
+    stats = embedding_cache.stats()
+    print(
+        Fore.CYAN
+        + f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses"
+        + Style.RESET_ALL
+    )
+
 
 def setup_chat_session(game: Game, question_session) -> ChatSession:
     messages = question_session.get("messages", [])